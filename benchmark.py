@@ -0,0 +1,405 @@
+"""
+離線效能測試：以本地假資料取代 yfinance 與 Telegram，量測 daily_job、handle_stock_query
+與 get_ma_position_data 的耗時、各階段時間、記憶體高峰與每秒處理筆數，不需要網路。
+
+    python benchmark.py --rows 2000 --tickers 400 --bars 1500 --latency 0.05
+    python benchmark.py --json bench.json                    # 存下結果
+    python benchmark.py --baseline bench.json --tolerance 0.3 # 與舊結果比較，變慢超過 30% 時回傳非 0
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import asyncio
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import functools
+import contextlib
+import io
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# ================== 假的行情來源 ==================
+class SyntheticMarket:
+    """
+    與 yf.download 呼叫方式相容的假行情來源，每檔股票的走勢由代號決定（可重現）。
+
+    - bars：每檔股票的歷史 K 棒數
+    - latency：每次請求的延遲秒數（另外每檔加 per_ticker_latency）
+    - failure_rate：請求直接拋出例外的機率
+    - otc_ratio：只存在於 .TWO 的代號比例，用來觸發 .TW → .TWO 的重試
+    - missing_ratio：兩個市場都查不到的代號比例
+    """
+
+    def __init__(self, bars: int = 1500, latency: float = 0.0, per_ticker_latency: float = 0.0,
+                 failure_rate: float = 0.0, otc_ratio: float = 0.3, missing_ratio: float = 0.02,
+                 end: str = "2026-10-15", seed: int = 0):
+        self.bars = bars
+        self.latency = latency
+        self.per_ticker_latency = per_ticker_latency
+        self.failure_rate = failure_rate
+        self.otc_ratio = otc_ratio
+        self.missing_ratio = missing_ratio
+        self.index = pd.bdate_range(end=end, periods=bars)
+        self.seed = seed
+        self.requests = 0
+        self.tickers_requested = 0
+        self.bars_served = 0
+        self.failures = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._cache: Dict[str, pd.DataFrame] = {}
+
+    def _code_hash(self, code: str) -> float:
+        return zlib.crc32(f"{self.seed}:{code}".encode()) / 2**32
+
+    def market_of(self, code: str) -> Optional[str]:
+        h = self._code_hash(code)
+        if h < self.missing_ratio:
+            return None
+        return ".TWO" if h < self.missing_ratio + self.otc_ratio else ".TW"
+
+    def history(self, ticker: str) -> pd.DataFrame:
+        code, _, suffix = ticker.partition(".")
+        if self.market_of(code) != "." + suffix:
+            return pd.DataFrame()
+        if ticker not in self._cache:
+            rng = np.random.default_rng(zlib.crc32(code.encode()))
+            close = 20 + 80 * rng.random() * np.exp(np.cumsum(rng.normal(0, 0.018, self.bars)))
+            spread = close * rng.uniform(0.002, 0.02, self.bars)
+            self._cache[ticker] = pd.DataFrame({
+                "Open": close + rng.normal(0, 0.3, self.bars) * spread,
+                "High": close + spread,
+                "Low": close - spread,
+                "Close": close,
+                "Volume": rng.integers(1_000, 5_000_000, self.bars).astype(float),
+            }, index=self.index)
+        return self._cache[ticker]
+
+    def __call__(self, tickers, period: Optional[str] = None, start: Optional[str] = None,
+                 group_by: Optional[str] = None, **kwargs) -> pd.DataFrame:
+        tickers_list = [tickers] if isinstance(tickers, str) else list(tickers)
+        with self._lock:
+            self.requests += 1
+            self.tickers_requested += len(tickers_list)
+            failed = self._rng.random() < self.failure_rate
+        delay = self.latency + self.per_ticker_latency * len(tickers_list)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.failures += 1
+            raise ConnectionError("synthetic provider failure")
+
+        frames = {}
+        for ticker in tickers_list:
+            df = self.history(ticker)
+            if df.empty:
+                continue
+            if start is not None:
+                df = df[df.index >= pd.Timestamp(start)]
+            elif period and period != "max":
+                df = df[df.index > self.index[-1] - _period_offset(period)]
+            frames[ticker] = df
+        with self._lock:
+            self.bars_served += sum(len(df) for df in frames.values())
+        if not frames:
+            return pd.DataFrame()
+        wide = pd.concat(frames, axis=1)
+        if group_by != "ticker":
+            # yfinance 預設欄位為 (Price, Ticker)
+            wide = wide.swaplevel(0, 1, axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+        return wide
+
+
+def _period_offset(period: str) -> pd.DateOffset:
+    """把 yfinance 的 period（例如 6mo、2y、5d）換成時間長度。"""
+    units = {"d": "days", "mo": "months", "y": "years"}
+    for suffix, unit in units.items():
+        if period.endswith(suffix) and period[:-len(suffix)].isdigit():
+            return pd.DateOffset(**{unit: int(period[:-len(suffix)])})
+    raise ValueError(f"不支援的 period: {period}")
+
+
+# ================== 假的 Telegram ==================
+class _SentMessage:
+    def __init__(self, message_id: int):
+        self.id = message_id
+
+
+class FakeTelegramClient:
+    """記錄所有送出的訊息，可設定每則訊息的延遲。"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: List[Dict[str, Any]] = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append({"chat_id": chat_id, "text": text})
+        return _SentMessage(len(self.sent))
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append({"chat_id": chat_id, "text": text, "edit": message_id})
+        return _SentMessage(message_id)
+
+
+class FakeMessage:
+    """模擬 Pyrogram 的 Message，只實作 handler 用到的部分。"""
+
+    def __init__(self, text: str, chat_id: int = 1):
+        self.text = text
+        self.replies: List[str] = []
+        self.chat = type("Chat", (), {"id": chat_id})()
+        self.from_user = type("User", (), {"id": chat_id})()
+
+    async def reply(self, text, **kwargs):
+        self.replies.append(text)
+        return _SentMessage(len(self.replies))
+
+
+# ================== 假的報告表 ==================
+BROKERS = ["凱基", "元大", "富邦", "國泰", "永豐", "群益", "統一", "摩根", "高盛", "美林"]
+
+
+def make_report_sheet(rows: int, tickers: int, seed: int = 0) -> pd.DataFrame:
+    """產生 rows 筆、涵蓋 tickers 檔股票的券商報告表，欄位與實際上傳的 Excel 相同。"""
+    rng = np.random.default_rng(seed)
+    codes = np.array([str(1101 + i * 7) for i in range(tickers)])
+    picked = rng.integers(0, tickers, rows)
+    dates = pd.Timestamp("2026-10-15") - pd.to_timedelta(rng.integers(0, 120, rows), unit="D")
+
+    def growth(low, high, blank_ratio):
+        values = rng.uniform(low, high, rows).round(2)
+        return np.where(rng.random(rows) < blank_ratio, np.nan, values)
+
+    eps24 = rng.uniform(0.5, 30, rows).round(2)
+    return pd.DataFrame({
+        "股票代號": codes[picked],
+        "公司名稱": [f"公司{c}" for c in codes[picked]],
+        "券商": rng.choice(BROKERS, rows),
+        "日期": dates.strftime("%Y/%m/%d 12:00:00 AM"),
+        "目標價": rng.uniform(30, 900, rows).round(1).astype(str),
+        "EPS24": eps24,
+        "EPS25": (eps24 * rng.uniform(0.8, 1.5, rows)).round(2),
+        "EPS26": (eps24 * rng.uniform(0.9, 1.8, rows)).round(2),
+        "EPS27": (eps24 * rng.uniform(1.0, 2.2, rows)).round(2),
+        "EPS25成長率(%)": growth(-10, 60, 0.1),
+        "EPS26成長率(%)": growth(-5, 80, 0.05),
+        "EPS27成長率(%)": growth(-10, 60, 0.2),
+        "報告摘要": ["營收成長動能延續，維持買進評等。" * 8] * rows,
+    })
+
+
+# ================== 量測工具 ==================
+class StageTimer:
+    """包裝模組中的函式，累計每個階段的耗時與呼叫次數（只在 benchmark 內使用）。"""
+
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self._restore: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _record(self, stage: str, elapsed: float) -> None:
+        with self._lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def wrap(self, module: Any, name: str, stage: str) -> None:
+        original = getattr(module, name)
+        if asyncio.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self._record(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self._record(stage, time.perf_counter() - start)
+        setattr(module, name, timed)
+        self._restore.append(lambda: setattr(module, name, original))
+
+    def reset(self) -> None:
+        self.totals.clear()
+        self.calls.clear()
+
+    def restore(self) -> None:
+        for undo in reversed(self._restore):
+            undo()
+        self._restore.clear()
+
+
+def _measure(func: Callable[[], Any]) -> Dict[str, float]:
+    """執行 func 並回傳耗時與 Python 記憶體配置高峰（MB）。"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"wall_s": wall, "peak_mb": peak / 2**20}
+
+
+# ================== 主程式 ==================
+def _prepare_environment(workdir: str) -> None:
+    """main.py 在 import 時就會讀取環境變數，必須在 import 之前設定好。"""
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "benchmark")
+    os.environ.setdefault("BOT_TOKEN", "1:benchmark")
+    os.environ.setdefault("ALL_ID", "1,2,3")
+    os.environ.setdefault("PORT", "10000")
+    # 所有會寫檔的位置都指向暫存目錄，不動到 data/ 下正式的價格庫、檢查點、訂閱設定與快照
+    os.environ["PRICE_DB_PATH"] = os.path.join(workdir, "prices.sqlite")
+    os.environ["SHEET_DIR"] = os.path.join(workdir, "sheets")
+    os.environ["SCAN_CHECKPOINT_PATH"] = os.path.join(workdir, "scans.sqlite")
+    os.environ["SUBSCRIBER_DB_PATH"] = os.path.join(workdir, "subscribers.sqlite")
+    os.environ["SNAPSHOT_DIR"] = os.path.join(workdir, "snapshots")
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="stock_notify_bench_")
+    _prepare_environment(workdir)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+        import get_stock_position
+        import report_sheet
+        from price_store import PriceStore
+
+    market = SyntheticMarket(bars=args.bars, latency=args.latency, per_ticker_latency=args.per_ticker_latency,
+                             failure_rate=args.failure_rate, seed=args.seed)
+    client = FakeTelegramClient(latency=args.send_latency)
+    get_stock_position.set_price_provider(market)
+    get_stock_position.set_price_store(PriceStore(os.path.join(workdir, "prices.sqlite")))
+    main.app = client
+    # 收件人來自訂閱設定（ALL_ID 在 import 時已複製進 subscriber_store），沒有個人設定的使用預設條件
+    main.subscriber_store.default_ids = list(range(1, args.recipients + 1))
+
+    timer = StageTimer()
+    timer.wrap(main, "prepare_report_sheet", "ingest")
+    timer.wrap(main, "_scan_candidates", "candidates")
+    timer.wrap(get_stock_position, "get_bars_batch", "fetch")
+    timer.wrap(get_stock_position, "sync_history", "fetch_single")
+    timer.wrap(get_stock_position, "score_close_matrix", "score")
+    timer.wrap(main, "broadcast", "broadcast")
+    timer.wrap(main, "broadcast_status", "broadcast")
+    timer.wrap(main, "broadcast_edit", "broadcast")
+
+    raw = make_report_sheet(args.rows, args.tickers, seed=args.seed)
+    report: Dict[str, Any] = {"config": vars(args), "scenarios": {}}
+
+    def scenario(name: str, func: Callable[[], Any], rows: int) -> None:
+        timer.reset()
+        requests_before = market.requests
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = _measure(func)
+        stats["rows_per_s"] = rows / stats["wall_s"] if stats["wall_s"] else float("inf")
+        stats["requests"] = market.requests - requests_before
+        stats["stages_s"] = dict(timer.totals)
+        report["scenarios"][name] = stats
+
+    def ingest():
+        main.latest_df = main.prepare_report_sheet(raw)
+        main.latest_index = report_sheet.ReportIndex(main.latest_df)
+
+    def scan():
+        asyncio.run(main.daily_job())
+
+    scenario("ingest", ingest, args.rows)
+    scenario("scan_cold", scan, args.rows)               # 本地價格庫為空
+    get_stock_position.analysis_cache.clear()
+    scenario("scan_warm_store", scan, args.rows)         # 只補抓新 K 棒
+    scenario("scan_cached", scan, args.rows)             # 全部命中記憶體快取
+
+    query_code = raw["股票代號"].value_counts().index[0]
+
+    def query():
+        message = FakeMessage(query_code)
+        asyncio.run(main.manual_trigger(None, message))
+
+    get_stock_position.analysis_cache.clear()
+    scenario("query", query, int((raw["股票代號"] == query_code).sum()))
+
+    single_codes = list(dict.fromkeys(raw["股票代號"]))[: args.single]
+
+    def single():
+        for code in single_codes:
+            get_stock_position.get_ma_position_data(code)
+
+    scenario("get_ma_position_data", single, len(single_codes))
+
+    timer.restore()
+    report["provider"] = {"requests": market.requests, "tickers_requested": market.tickers_requested,
+                          "bars_served": market.bars_served, "failures": market.failures}
+    report["messages_sent"] = len(client.sent)
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{'scenario':<22}{'wall(s)':>10}{'peak(MB)':>10}{'rows/s':>12}{'requests':>10}  stages(s)")
+    for name, stats in report["scenarios"].items():
+        stages = ", ".join(f"{k}={v:.3f}" for k, v in sorted(stats["stages_s"].items()))
+        print(f"{name:<22}{stats['wall_s']:>10.3f}{stats['peak_mb']:>10.1f}{stats['rows_per_s']:>12.0f}"
+              f"{stats['requests']:>10}  {stages}")
+    print(f"provider: {report['provider']}, messages sent: {report['messages_sent']}")
+
+
+def compare_with_baseline(report: Dict[str, Any], baseline_path: str, tolerance: float) -> List[str]:
+    """與舊結果比較，回傳變慢超過 tolerance 的情境。"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, stats in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old and stats["wall_s"] > old["wall_s"] * (1 + tolerance):
+            regressions.append(f"{name}: {old['wall_s']:.3f}s -> {stats['wall_s']:.3f}s")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="stock_notify 離線效能測試")
+    parser.add_argument("--rows", type=int, default=1000, help="報告表筆數")
+    parser.add_argument("--tickers", type=int, default=300, help="報告表涵蓋的股票檔數")
+    parser.add_argument("--bars", type=int, default=1500, help="每檔股票的歷史 K 棒數")
+    parser.add_argument("--latency", type=float, default=0.0, help="每次查價請求的延遲秒數")
+    parser.add_argument("--per-ticker-latency", type=float, default=0.0, help="請求中每檔股票額外的延遲秒數")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="查價請求失敗的機率")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="每則 Telegram 訊息的延遲秒數")
+    parser.add_argument("--recipients", type=int, default=3, help="廣播收件人數")
+    parser.add_argument("--single", type=int, default=20, help="get_ma_position_data 單檔測試的檔數")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="把結果存成 JSON")
+    parser.add_argument("--baseline", help="與這份 JSON 結果比較")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許變慢的比例")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        regressions = compare_with_baseline(report, args.baseline, args.tolerance)
+        if regressions:
+            print("效能退步：\n" + "\n".join(regressions))
+            sys.exit(1)
@@ -0,0 +1,190 @@
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pyrogram.errors import FloodWait
+
+from metrics import BROADCAST_FLOODWAIT, BROADCAST_MESSAGES, BROADCAST_SEND_SECONDS
+from rate_limit import TokenBucket
+
+# Telegram 單則訊息的字數上限
+TELEGRAM_MESSAGE_LIMIT = 4096
+# 全域發送速率（Telegram 對 bot 的建議上限約每秒 30 則）
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+# 遇到 FloodWait 時最多重試幾次
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+
+_bucket: Optional[TokenBucket] = None
+_bucket_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_bucket() -> TokenBucket:
+    """所有廣播共用的限速器；asyncio.Lock 綁定 event loop，換了 loop 就重新建立。"""
+    global _bucket, _bucket_loop
+    loop = asyncio.get_running_loop()
+    if _bucket is None or _bucket_loop is not loop:
+        _bucket = TokenBucket(BROADCAST_RATE)
+        _bucket_loop = loop
+    return _bucket
+
+
+def split_message(entries: Iterable[str], header: str = "", footer: str = "",
+                  limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    把多筆條目組成數則訊息，每則不超過 limit 字，只在條目之間切開，
+    不會把一筆股票資料或 HTML 標籤切成兩半。header 放在第一則開頭，footer 放在最後一則結尾。
+    單一條目本身超過上限時，才退而求其次依行切開。
+    """
+    chunks: List[str] = []
+    current = header
+    for entry in entries:
+        for piece in _split_oversized(entry, limit):
+            if current and len(current) + len(piece) > limit:
+                chunks.append(current)
+                current = ""
+            current += piece
+    if footer:
+        if current and len(current) + len(footer) > limit:
+            chunks.append(current)
+            current = ""
+        current += footer
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split_oversized(entry: str, limit: int) -> List[str]:
+    """超過上限的單一條目依換行切開，單行仍過長就硬切。"""
+    if len(entry) <= limit:
+        return [entry]
+    pieces: List[str] = []
+    current = ""
+    for line in entry.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            pieces.append(current)
+            current = ""
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+async def send_with_retry(client: Any, chat_id: int, text: str, bucket: TokenBucket,
+                          max_retries: int = BROADCAST_MAX_RETRIES, **kwargs) -> Any:
+    """經過限速器發送一則訊息；遇到 FloodWait 依 Telegram 要求的秒數等待後重試。"""
+    return await _call_with_retry(lambda: client.send_message(chat_id, text, **kwargs), chat_id, bucket,
+                                  max_retries)
+
+
+async def edit_with_retry(client: Any, chat_id: int, message_id: int, text: str, bucket: TokenBucket,
+                          max_retries: int = BROADCAST_MAX_RETRIES, **kwargs) -> Any:
+    """經過限速器編輯一則已送出的訊息，重試方式同 send_with_retry。"""
+    return await _call_with_retry(lambda: client.edit_message_text(chat_id, message_id, text, **kwargs),
+                                  chat_id, bucket, max_retries)
+
+
+async def _call_with_retry(call: Callable[[], Awaitable[Any]], chat_id: int, bucket: TokenBucket,
+                           max_retries: int) -> Any:
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        try:
+            with BROADCAST_SEND_SECONDS.time():
+                sent = await call()
+            BROADCAST_MESSAGES.inc(result="ok")
+            return sent
+        except FloodWait as e:
+            BROADCAST_FLOODWAIT.inc()
+            if attempt == max_retries:
+                BROADCAST_MESSAGES.inc(result="error")
+                raise
+            wait = float(e.value or 1)
+            logging.warning(f"發送給 {chat_id} 遇到 FloodWait，等待 {wait} 秒後重試")
+            # FloodWait 是針對整個 bot，暫停共用的限速器讓其他收件人也一起等
+            bucket.pause(wait)
+        except Exception:
+            BROADCAST_MESSAGES.inc(result="error")
+            raise
+
+
+async def broadcast(client: Any, chat_ids: Iterable[int], chunks: List[str],
+                    bucket: Optional[TokenBucket] = None, **kwargs) -> Dict[int, Optional[Exception]]:
+    """
+    同時發送給所有收件人，每位收件人依序收到 chunks 的每一則（維持順序）。
+    總速率由共用的 token bucket 控制；單一收件人失敗不影響其他人。
+    回傳 {chat_id: None 或發送失敗的例外}。
+    """
+    bucket = bucket or get_bucket()
+
+    async def deliver(chat_id: int) -> None:
+        for chunk in chunks:
+            await send_with_retry(client, chat_id, chunk, bucket, **kwargs)
+
+    chat_ids = list(chat_ids)
+    outcomes = await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids), return_exceptions=True)
+    results: Dict[int, Optional[Exception]] = {}
+    for chat_id, outcome in zip(chat_ids, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(f"發送給 {chat_id} 失敗: {outcome}")
+            results[chat_id] = outcome
+        else:
+            results[chat_id] = None
+    return results
+
+
+async def broadcast_status(client: Any, chat_ids: Iterable[int], text: str,
+                           bucket: Optional[TokenBucket] = None, **kwargs) -> Dict[int, Optional[int]]:
+    """
+    每位收件人各送一則之後會被編輯的訊息（例如掃描進度），
+    回傳 {chat_id: 訊息 id}，發送失敗的為 None。
+    """
+    bucket = bucket or get_bucket()
+    chat_ids = list(chat_ids)
+    outcomes = await asyncio.gather(*(send_with_retry(client, chat_id, text, bucket, **kwargs)
+                                      for chat_id in chat_ids), return_exceptions=True)
+    message_ids: Dict[int, Optional[int]] = {}
+    for chat_id, outcome in zip(chat_ids, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(f"發送給 {chat_id} 失敗: {outcome}")
+            message_ids[chat_id] = None
+        else:
+            message_ids[chat_id] = outcome.id
+    return message_ids
+
+
+async def broadcast_edit(client: Any, message_ids: Dict[int, Optional[int]], chunks: List[str],
+                         bucket: Optional[TokenBucket] = None, **kwargs) -> Dict[int, Optional[Exception]]:
+    """
+    把 chunks 的第一則編輯進 broadcast_status 送出的訊息，其餘各則接著發送；
+    沒有訊息 id 或編輯失敗的收件人改為全部重新發送。回傳格式同 broadcast。
+    """
+    bucket = bucket or get_bucket()
+
+    async def deliver(chat_id: int, message_id: Optional[int]) -> None:
+        rest = chunks
+        if message_id is not None and chunks:
+            try:
+                await edit_with_retry(client, chat_id, message_id, chunks[0], bucket, **kwargs)
+                rest = chunks[1:]
+            except Exception as e:
+                logging.warning(f"編輯 {chat_id} 的訊息失敗，改為重新發送: {e}")
+        for chunk in rest:
+            await send_with_retry(client, chat_id, chunk, bucket, **kwargs)
+
+    chat_ids = list(message_ids)
+    outcomes = await asyncio.gather(*(deliver(chat_id, message_ids[chat_id]) for chat_id in chat_ids),
+                                    return_exceptions=True)
+    results: Dict[int, Optional[Exception]] = {}
+    for chat_id, outcome in zip(chat_ids, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(f"發送給 {chat_id} 失敗: {outcome}")
+            results[chat_id] = outcome
+        else:
+            results[chat_id] = None
+    return results
@@ -0,0 +1,112 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+# 同時進行的查價 / 指標計算數量上限（Render 免費方案資源有限，預設保守一點）
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "4"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """取得（必要時建立）掃描專用的執行緒池。"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix="scan")
+    return _executor
+
+
+def set_concurrency(limit: int) -> None:
+    """調整執行緒池大小；舊的池會在手上工作完成後關閉。"""
+    global _executor, SCAN_CONCURRENCY
+    old = _executor
+    SCAN_CONCURRENCY = max(1, int(limit))
+    _executor = None
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    把同步的 yfinance 下載或 pandas 計算丟到執行緒池執行，
+    讓 Pyrogram 與 FastAPI 共用的 event loop 在掃描期間仍能回應。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+class SingleFlight:
+    """
+    合併同一個 key 的並行請求：同時有多個呼叫者要同一個 key 時，
+    只有第一個真的執行，其餘等待同一個結果（例外也會一併傳給所有等待者）。
+    等待者被取消不會影響正在執行的工作。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def _register(self, key: Hashable) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # 沒有人等待時也要取走例外，避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        return future
+
+    def _resolve(self, key: Hashable, future: asyncio.Future, result: Any = None,
+                 error: Optional[BaseException] = None) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """執行 func()，若同一個 key 已在執行中則直接等待它的結果。"""
+        existing = self._inflight.get(key)
+        if existing is None:
+            # 以獨立的 task 執行，第一個呼叫者被取消也不會中斷其他人在等的工作
+            existing = asyncio.ensure_future(func())
+            existing.add_done_callback(lambda f: f.cancelled() or f.exception())
+            existing.add_done_callback(lambda f: self._inflight.pop(key, None) if self._inflight.get(key) is f else None)
+            self._inflight[key] = existing
+        return await asyncio.shield(existing)
+
+    async def do_many(self, keys: Iterable[Hashable],
+                      func: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]) -> Dict[Hashable, Any]:
+        """
+        批次版的 do：已在執行中的 key 直接等待，其餘的 key 交給 func(缺少的 keys) 一次處理，
+        func 需回傳 {key: 結果}。執行期間其他人對這些 key 的 do / do_many 也會合併進來。
+        """
+        keys = list(dict.fromkeys(keys))
+        waiting = {key: self._inflight[key] for key in keys if key in self._inflight}
+        missing = [key for key in keys if key not in waiting]
+        owned = {key: self._register(key) for key in missing}
+
+        if missing:
+            try:
+                results = await func(missing)
+            except BaseException as e:
+                for key, future in owned.items():
+                    self._resolve(key, future, error=e)
+                raise
+            for key, future in owned.items():
+                if key in results:
+                    self._resolve(key, future, results[key])
+                else:
+                    self._resolve(key, future, error=KeyError(key))
+
+        merged = {key: owned[key].result() for key in missing if not owned[key].exception()}
+        for key, future in waiting.items():
+            try:
+                merged[key] = await asyncio.shield(future)
+            except Exception:
+                continue
+        return merged
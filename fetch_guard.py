@@ -0,0 +1,191 @@
+import os
+import time
+import random
+import socket
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+from metrics import FETCH_ATTEMPTS, FETCH_BREAKER_OPEN
+from rate_limit import AdaptiveRateLimiter, CircuitBreaker
+
+# 查價請求的起始速率（每秒請求數，一次請求可含一整批股票），之後依延遲與錯誤自動調整
+FETCH_RATE = float(os.getenv("FETCH_RATE", "5"))
+# 閒置後最多可連續發出幾次請求
+FETCH_BURST = float(os.getenv("FETCH_BURST", "10"))
+FETCH_MIN_RATE = float(os.getenv("FETCH_MIN_RATE", "0.2"))
+FETCH_MAX_RATE = float(os.getenv("FETCH_MAX_RATE", "10"))
+# 單次請求超過這麼多秒視為供應商變慢，降低速率
+FETCH_TARGET_LATENCY = float(os.getenv("FETCH_TARGET_LATENCY", "5"))
+# 暫時性錯誤（連線、逾時、限流）最多重試幾次，等待時間為 0 ~ min(上限, 基準 × 2^次數) 的隨機值
+FETCH_MAX_RETRIES = int(os.getenv("FETCH_MAX_RETRIES", "3"))
+FETCH_RETRY_BASE = float(os.getenv("FETCH_RETRY_BASE", "1"))
+FETCH_RETRY_MAX = float(os.getenv("FETCH_RETRY_MAX", "30"))
+# 連續失敗幾次就斷路，暫停查價 cooldown 秒（再失敗則加倍，最多 max_cooldown 秒）
+FETCH_BREAKER_THRESHOLD = int(os.getenv("FETCH_BREAKER_THRESHOLD", "5"))
+FETCH_BREAKER_COOLDOWN = float(os.getenv("FETCH_BREAKER_COOLDOWN", "60"))
+FETCH_BREAKER_MAX_COOLDOWN = float(os.getenv("FETCH_BREAKER_MAX_COOLDOWN", "600"))
+
+_THROTTLE_MARKERS = ("too many requests", "rate limit", "ratelimit", "429")
+_TRANSIENT_MARKERS = ("timed out", "timeout", "connection", "temporarily", "could not resolve", "dnserror",
+                      "failed to perform", "502", "503", "504")
+
+STAT_KEYS = ["requests", "ok", "retries", "failed", "throttled", "breaker_opened", "breaker_rejected"]
+
+
+class ProviderThrottled(Exception):
+    """價格來源回應限流（例如 yf.download 把 YFRateLimitError 只記進 log 而沒有拋出）。"""
+
+
+class ProviderUnavailable(ConnectionError):
+    """價格來源對這次請求的 ticker 回應連線中斷、逾時等暫時性錯誤，但沒有拋出（yf.download 只記進 log）。"""
+
+
+class CircuitOpen(Exception):
+    """斷路中（或已有其他呼叫端在試探），這次查價直接放棄、不送出。"""
+
+
+def classify_error(exc: BaseException) -> str:
+    """
+    把查價例外分成 throttle（被限流）、transient（連線、逾時等可重試）與 fatal（不重試）。
+    查不到資料的股票不會拋出例外（回傳空表），不在這裡處理。
+    """
+    if isinstance(exc, CircuitOpen):
+        return "fatal"
+    if isinstance(exc, ProviderThrottled) or type(exc).__name__ == "YFRateLimitError":
+        return "throttle"
+    message = str(exc).lower()
+    if any(marker in message for marker in _THROTTLE_MARKERS):
+        return "throttle"
+    if isinstance(exc, (ConnectionError, TimeoutError, socket.timeout)):
+        return "transient"
+    if any(marker in message for marker in _TRANSIENT_MARKERS):
+        return "transient"
+    return "fatal"
+
+
+def raise_for_errors(errors: Optional[Dict[str, Any]], tickers: Union[str, Iterable[str]]) -> None:
+    """
+    檢查價格來源記錄的個別 ticker 錯誤，只看這次請求的 tickers：
+    有限流訊息時拋出 ProviderThrottled，有連線、逾時等暫時性錯誤時拋出 ProviderUnavailable，
+    交給 FetchGuard 重試與斷路；查不到資料（例如已下市）的不算錯誤。
+    """
+    wanted = {t.upper() for t in ([tickers] if isinstance(tickers, str) else tickers)}
+    transient = None
+    for ticker, error in (errors or {}).items():
+        if ticker.upper() not in wanted:
+            continue
+        kind = classify_error(Exception(str(error)))
+        if kind == "throttle":
+            raise ProviderThrottled(f"{ticker}: {error}")
+        if kind == "transient" and transient is None:
+            transient = f"{ticker}: {error}"
+    if transient is not None:
+        raise ProviderUnavailable(transient)
+
+
+def rate_limiter(share: float = 1.0) -> AdaptiveRateLimiter:
+    """
+    依 FETCH_* 設定建立查價限速器。share < 1 時只取整體額度的這個比例：
+    限速器只在一個行程內共用，多個行程同時查價時各取 1 / 行程數，合計才不會超過設定的速率。
+    """
+    return AdaptiveRateLimiter(FETCH_RATE * share, FETCH_MIN_RATE * share, FETCH_MAX_RATE * share,
+                               FETCH_TARGET_LATENCY, capacity=max(1.0, FETCH_BURST * share))
+
+
+class FetchGuard:
+    """
+    所有查價請求的共同入口：先問斷路器、等自適應限速器，再呼叫價格來源；
+    暫時性錯誤以指數退避加隨機抖動重試，連續失敗時斷路，斷路期間的呼叫立即拋出 CircuitOpen。
+    累計的成功、重試、失敗次數可用 stats() 取得，呼叫端以前後差值得到單次掃描的數字。
+    """
+
+    def __init__(self, limiter: Optional[AdaptiveRateLimiter] = None, breaker: Optional[CircuitBreaker] = None,
+                 max_retries: int = FETCH_MAX_RETRIES, retry_base: float = FETCH_RETRY_BASE,
+                 retry_max: float = FETCH_RETRY_MAX, sleep: Callable[[float], None] = time.sleep):
+        self.limiter = limiter or rate_limiter()
+        self.breaker = breaker or CircuitBreaker(FETCH_BREAKER_THRESHOLD, FETCH_BREAKER_COOLDOWN,
+                                                 FETCH_BREAKER_MAX_COOLDOWN)
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._stats: Dict[str, float] = {key: 0 for key in STAT_KEYS}
+
+    def _count(self, key: str, value: float = 1) -> None:
+        with self._lock:
+            self._stats[key] += value
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次重試前的等待秒數（full jitter）。"""
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        經過斷路器、限速與重試呼叫 func；重試用盡或遇到不可重試的錯誤時拋出最後的例外，
+        斷路中（包括重試途中斷路）則拋出 CircuitOpen，不等待 cooldown。
+        """
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._count("breaker_rejected")
+                FETCH_ATTEMPTS.inc(result="rejected")
+                raise CircuitOpen(f"價格來源斷路中，{self.breaker.retry_after():.0f} 秒後才會再試探")
+            self.limiter.acquire()
+            self._count("requests")
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                self.limiter.record(time.monotonic() - started, throttled=kind == "throttle")
+                if kind == "throttle":
+                    self._count("throttled")
+                    FETCH_ATTEMPTS.inc(result="throttled")
+                if kind == "fatal" or attempt == self.max_retries:
+                    if kind == "fatal":
+                        self.breaker.release()
+                    elif self.breaker.record_failure():
+                        self._on_breaker_open(e)
+                    self._count("failed")
+                    FETCH_ATTEMPTS.inc(result="failed")
+                    raise
+                if self.breaker.record_failure():
+                    self._on_breaker_open(e)
+                self._count("retries")
+                FETCH_ATTEMPTS.inc(result="retry")
+                delay = self.backoff(attempt)
+                print(f"🔄 查價{'被限流' if kind == 'throttle' else '失敗'}，{delay:.1f} 秒後重試"
+                      f"（第 {attempt + 1} 次）: {e}")
+                self._sleep(delay)
+                continue
+            self.limiter.record(time.monotonic() - started)
+            self.breaker.record_success()
+            self._count("ok")
+            FETCH_ATTEMPTS.inc(result="ok")
+            return result
+
+    def _on_breaker_open(self, error: BaseException) -> None:
+        self._count("breaker_opened")
+        FETCH_BREAKER_OPEN.inc()
+        print(f"⚠️ 價格來源連續失敗，暫停查價 {self.breaker.cooldown:g} 秒: {error}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stats)
+
+    def stats_since(self, before: Dict[str, float]) -> Dict[str, float]:
+        """與 before（先前的 stats()）相比增加的次數，例如一次掃描期間的查價統計。"""
+        now = self.stats()
+        return {key: round(now[key] - before.get(key, 0), 3) for key in STAT_KEYS}
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "rate": round(self.limiter.rate, 3),
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            **self.stats(),
+        }
+
+
+# 全域共用：同一個行程內的所有查價共享速率與斷路狀態
+fetch_guard = FetchGuard()
@@ -1,86 +1,391 @@
 import yfinance as yf
 import pandas as pd
 import numpy as np
-from typing import Dict, Union, Tuple, Any
+import os
+import re
+import ast
+import time
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Union, Tuple, Any
  
-def get_ma_position_data(stock: Union[str, int], period: str = "30y") -> Dict[str, Union[str, float]]:
+from price_store import (SUFFIXES, PriceStore, is_stale, load_symbol_listing, split_ticker, sync_history,
+                         sync_history_batch)
+
+from ma_cache import TradingDayCache
+from fetch_guard import fetch_guard, raise_for_errors
+from metrics import (FETCH_EMPTY, FETCH_ERRORS, FETCH_SECONDS, FETCH_SUFFIX_FALLBACK, FETCH_TICKERS,
+                     INDICATOR_SECONDS)
+from ma_engine import (MA_PERIODS, SCORE_MA_PERIODS, close_matrix_from_series, frame_to_results,
+                       latest_moving_averages, score_close_matrix)
+from indicators import CORE_INDICATORS, active_indicators, compute_latest, history_period, required_bars
+
+DOWNLOAD_KWARGS = {"auto_adjust": True, "progress": False, "timeout": 10}
+
+# 分析結果快取：同一交易日內重複查詢同一檔股票直接回傳，收盤後自動失效
+analysis_cache = TradingDayCache()
+
+# 價格資料來源，預設為 yf.download；測試時可用 set_price_provider 換成本地假資料
+_download = yf.download
+_price_store: Optional[PriceStore] = None
+
+
+def set_price_provider(provider) -> None:
+    """替換價格資料來源，provider 需與 yf.download 的呼叫方式相容。"""
+    global _download
+    _download = provider
+
+
+def _guarded_download(tickers, **kwargs) -> pd.DataFrame:
+    """經過 fetch_guard 呼叫價格來源：自適應限速、暫時性錯誤重試，來源中斷時斷路暫停查價。"""
+    return fetch_guard.call(_download_checked, tickers, **kwargs)
+
+
+def _download_checked(tickers, **kwargs) -> pd.DataFrame:
+    """
+    呼叫價格來源。yf.download 不會拋出個別 ticker 的錯誤（逾時、連線中斷、限流都只寫進 log 並回傳空表），
+    這裡收集同一個執行緒在這次呼叫中記錄的錯誤，屬於這次 tickers 的暫時性錯誤改為拋出。
+    """
+    with _DownloadErrorLog() as log:
+        df = _download(tickers, **kwargs)
+    raise_for_errors(log.errors, tickers)
+    return df
+
+
+class _DownloadErrorLog(logging.Handler):
+    """
+    在 with 區塊內收集 yfinance logger 記錄的個別 ticker 錯誤，回傳 {ticker: 錯誤訊息}。
+    只收目前執行緒的紀錄，其他掃描執行緒同時進行的下載不會混進來（不讀全域的 yf.shared._ERRORS）。
+    """
+
+    # yf.download 結束時的彙總："['2330.TW', '2317.TW']: 錯誤訊息"；請求失敗時另有逐檔的 "Failed to get ticker"
+    _SUMMARY = re.compile(r"^(\[.*?\]): (.*)$", re.S)
+    _FAILED = re.compile(r"Failed to get ticker '([^']+)' reason: (.*)", re.S)
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.thread = threading.get_ident()
+        self.errors: Dict[str, str] = {}
+        self._logger = logging.getLogger("yfinance")
+
+    def __enter__(self) -> "_DownloadErrorLog":
+        self._logger.addHandler(self)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._logger.removeHandler(self)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.thread != self.thread:
+            return
+        message = record.getMessage().strip()
+        failed = self._FAILED.search(message)
+        if failed:
+            self._add([failed.group(1)], failed.group(2))
+            return
+        summary = self._SUMMARY.match(message)
+        if summary:
+            try:
+                tickers = ast.literal_eval(summary.group(1))
+            except (ValueError, SyntaxError):
+                return
+            self._add(tickers, summary.group(2))
+
+    def _add(self, tickers: Iterable[str], error: str) -> None:
+        for ticker in tickers:
+            key = str(ticker).upper()
+            # 同一檔可能同時有「連線失敗」與之後的「查無資料」，兩則都保留才不會把斷線誤判成查無資料
+            self.errors[key] = f"{self.errors[key]}; {error}" if key in self.errors else error
+
+
+def get_price_store() -> PriceStore:
+    """取得（必要時建立）本地價格庫。"""
+    global _price_store
+    if _price_store is None:
+        _price_store = PriceStore()
+        # 有提供上市櫃清單時，先預載後綴對照表，第一次掃描就不必試錯
+        listing_path = os.getenv("SYMBOL_LISTING_PATH")
+        if listing_path and os.path.exists(listing_path):
+            load_symbol_listing(_price_store, listing_path)
+    return _price_store
+
+
+def set_price_store(store: PriceStore) -> None:
+    global _price_store
+    _price_store = store
+
+
+def _extra_indicators() -> List[str]:
+    """EXTRA_INDICATORS 中、計分用 MA 以外的指標。"""
+    return [name for name in active_indicators() if name not in CORE_INDICATORS]
+
+
+def _default_nan_result(stock_code: str) -> Dict[str, Union[str, float]]:
+    return {"股票代號": stock_code, "現價": np.nan, **{f"MA{n}": np.nan for n in MA_PERIODS},
+            **{name: np.nan for name in _extra_indicators()}}
+
+
+def _compute_ma_data(stock_code: str, close: Union[pd.Series, pd.DataFrame],
+                     volume: Optional[pd.Series] = None) -> Dict[str, Union[str, float]]:
+    """
+    由收盤價序列計算現價與各 MA 數值（四捨五入到小數點後第二位），有啟用額外指標時一併計算。
+    單檔與批次下載共用這段邏輯，確保兩條路徑的結果一致。
+    """
+    # 新版 yfinance 的 df["Close"] 可能是只有一欄的 DataFrame
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+
+    valid = close.notna()
+    close = close[valid]
+    if close.empty:
+        return _default_nan_result(stock_code)
+
+    # 1. 取得最新收盤價 (現價)
+    latest_price = float(close.iloc[-1])
+
+    # 2. 計算並取得均線數值（與 ma_engine 批次計算共用同一段 rolling mean，兩條路徑寫進同一個快取）
+    _, mas = latest_moving_averages(close.to_numpy(dtype=float), MA_PERIODS)
+    ma_data = {f"MA{n}": float(mas[n][0]) for n in MA_PERIODS}
+
+    # 3. 額外指標（EMA、RSI、成交量均線等）
+    extras = _extra_indicators()
+    if extras:
+        volumes = volume[valid].to_numpy(dtype=float) if volume is not None else None
+        values = compute_latest(close.to_numpy(dtype=float), volumes, extras)
+        ma_data.update({name: float(values[name][0]) for name in extras})
+
+    # 4. 組織回傳字典
+    return {
+        "股票代號": stock_code,
+        "現價": latest_price,
+        **ma_data
+    }
+
+
+def get_ma_position_data(stock: Union[str, int], period: Optional[str] = None) -> Dict[str, Union[str, float]]:
     """
     計算並回傳指定股票的現價及主要移動平均線（MA）數值，並四捨五入到小數點後第二位。
-    使用 .tail(1).item() 獲取最新數值，提高程式碼穩定性。
+    period 預設依啟用中的指標需要的 K 棒數決定（見 indicators.history_period）。
     """
     stock_code = str(stock)
-    # 這裡我們不再只補齊 .TW，而是準備兩個嘗試的 ticker
-    ticker_tw = stock_code + ".TW"
-    ticker_two = stock_code + ".TWO"
-    ticker_list = [ticker_tw, ticker_two]
-    
-    ma_periods = [5, 10, 20, 60, 120, 240]
-    default_nan_result = {"股票代號": stock_code, "現價": np.nan, **{f"MA{n}": np.nan for n in ma_periods}}
-    df = pd.DataFrame()
-    final_ticker = ""
+    period = period or history_period()
+    store = get_price_store()
+    # 依後綴對照表決定嘗試順序：已解析過的代號只會抓一次
+    suffix_order = store.suffix_order(stock_code)
+
+    fallback: Optional[Tuple[str, pd.DataFrame]] = None
+    # 下載本身失敗（而不是查無資料）時不能記成「兩個市場都查不到」，否則短暫斷線會讓這檔停查 SUFFIX_RETRY_DAYS 天
+    failed = False
     try:
-        for ticker in ticker_list:
+        for attempt, suffix in enumerate(suffix_order):
+            ticker = stock_code + suffix
+            if attempt > 0:
+                FETCH_SUFFIX_FALLBACK.inc()
+            FETCH_TICKERS.inc(mode="single")
             try:
-                # 嘗試下載
-                df = yf.download(ticker, period=period, auto_adjust=True, progress=False, timeout=10)
-                
-                if not df.empty:
-                    final_ticker = ticker
-                    break # 成功下載後跳出迴圈
-                
+                # 同步本地價格庫：第一次抓完整歷史，之後只補抓新的 K 棒
+                with FETCH_SECONDS.time(mode="single"):
+                    synced = sync_history(store, ticker, _guarded_download, period=period, **DOWNLOAD_KWARGS)
+                if not synced:
+                    continue
             except Exception as e:
-                # 忽略下載失敗的錯誤，繼續嘗試下一個 ticker
-                pass
+                # 重試後仍失敗（連線中斷、限流等）：記錄原因後繼續嘗試下一個 ticker
+                FETCH_ERRORS.inc(mode="single")
+                print(f"⚠️ {ticker} 下載失敗: {e}")
+                failed = True
+                continue
 
-        if df.empty:
-            print(f"⚠️ 股票 {stock_code} ({ticker}) 數據下載失敗或為空。")
-            return default_nan_result
+            # 只讀取指標需要的最後幾根 K 棒
+            bars = _load_bars(store, ticker)
+            if is_stale(bars["Close"]) and suffix != suffix_order[-1]:
+                # 資料停止更新，可能已轉上市櫃，先保留再試另一個市場
+                fallback = fallback or (suffix, bars)
+                continue
+            store.set_symbols({stock_code: suffix})
+            return _compute_ma_data(stock_code, bars["Close"], bars["Volume"])
 
-        price_col = "Close"
-        
-        # 1. 取得最新收盤價 (現價)
-        # 使用 .tail(1) 獲取最後一個數據點，並使用 .item() 安全地提取單一數值
-        
-        # 首先確保 price_col 存在且不為空
-        latest_row = df[price_col].dropna().tail(1)
-        
-        latest_price = float(df[price_col].dropna().iloc[-1])
-                
+        if fallback is not None:
+            # 另一個市場也沒有較新的資料（例如已下市），沿用原本的結果
+            return _compute_ma_data(stock_code, fallback[1]["Close"], fallback[1]["Volume"])
 
+        if suffix_order and not failed:
+            store.set_symbols({stock_code: None})
+        FETCH_EMPTY.inc()
+        print(f"⚠️ 股票 {stock_code} 數據下載失敗或為空。")
+        return _default_nan_result(stock_code)
+
+    except Exception as e:
+        print(f"❌ 處理股票 {stock_code} 時發生錯誤: {e}")
+        return _default_nan_result(stock_code)
+
+
+_EMPTY_BARS = pd.DataFrame({"Close": pd.Series(dtype=float), "Volume": pd.Series(dtype=float)})
+
+
+def _load_bars(store: PriceStore, ticker: str) -> pd.DataFrame:
+    """從本地價格庫讀出啟用中的指標需要的最後幾根 K 棒（收盤價與成交量）。"""
+    return store.load(ticker, tail=required_bars())[["Close", "Volume"]].dropna(subset=["Close"])
+
+
+def _download_bars(tickers: List[str], period: str, batch_size: int,
+                   batch_pause: float) -> Tuple[Dict[str, pd.DataFrame], Set[str]]:
+    """
+    把 tickers 切成每批 batch_size 檔同步到本地價格庫（一批只發一次請求），
+    再從本地讀出指標需要的 K 棒，回傳 ({ticker: 收盤價與成交量}, 下載失敗的 ticker)。
+    下載失敗的批次與查無資料不同，呼叫端不應把它們記成查不到。
+    """
+    store = get_price_store()
+    bars: Dict[str, pd.DataFrame] = {}
+    failed: Set[str] = set()
+    for start in range(0, len(tickers), batch_size):
+        if start > 0 and batch_pause > 0:
+            # 額外的固定停頓（請求速率已由 fetch_guard 依供應商狀況調整，預設不需要）
+            time.sleep(batch_pause)
+        chunk = tickers[start:start + batch_size]
+        FETCH_TICKERS.inc(len(chunk), mode="batch")
+        try:
+            with FETCH_SECONDS.time(mode="batch"):
+                available = sync_history_batch(store, chunk, _guarded_download, period=period, threads=True, **DOWNLOAD_KWARGS)
+        except Exception as e:
+            FETCH_ERRORS.inc(mode="batch")
+            print(f"⚠️ 批次下載失敗 ({len(chunk)} 檔): {e}")
+            failed.update(chunk)
+            continue
+        for ticker in chunk:
+            if available.get(ticker):
+                bars[ticker] = _load_bars(store, ticker)
+            elif available.get(ticker, False) is None:
+                failed.add(ticker)
+    return bars, failed
+
+
+def get_bars_batch(stocks: Iterable[Union[str, int]], period: Optional[str] = None,
+                   batch_size: int = 50, batch_pause: float = 0.0,
+                   failed: Optional[Set[str]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    一次取得整組股票計算指標所需的 K 棒，回傳 {股票代號: 收盤價與成交量}，查不到的為空表。
+    period 預設只下載啟用中的指標需要的歷史長度（見 indicators.history_period）。
+    failed 指定時，下載失敗（斷路、連線中斷等，而不是查無資料）而沒有資料的代號會加入其中。
+
+    已解析過後綴的代號直接以正確的市場成批下載；未解析過的先以 .TW 成批下載，
+    抓不到的再以 .TWO 成批重試。請求次數只跟批次數有關，而不是跟股票檔數成正比。
+    """
+    period = period or history_period()
+    store = get_price_store()
+    codes = list(dict.fromkeys(str(s).strip() for s in stocks))
+    orders = {code: store.suffix_order(code) for code in codes}
+    results: Dict[str, pd.DataFrame] = {}
+    resolved: Dict[str, Optional[str]] = {}
+    fallback: Dict[str, pd.DataFrame] = {}
+    # 有任一後綴下載失敗的代號：沒有確認兩個市場都查不到，不寫入負快取
+    download_failed: Set[str] = set()
+
+    pending = [code for code in codes if orders[code]]
+    for attempt in range(len(SUFFIXES)):
+        if not pending:
+            break
+        # 依這一輪要嘗試的後綴分組，每組各自成批下載
+        groups: Dict[str, List[str]] = {}
+        for code in pending:
+            if attempt < len(orders[code]):
+                groups.setdefault(orders[code][attempt], []).append(code)
+
+        still_missing = []
+        for suffix, group in groups.items():
+            if attempt > 0:
+                FETCH_SUFFIX_FALLBACK.inc(len(group))
+            downloaded, errors = _download_bars([code + suffix for code in group], period, batch_size, batch_pause)
+            for code in group:
+                if code + suffix in errors:
+                    download_failed.add(code)
+                bars = downloaded.get(code + suffix)
+                if bars is None or bars.empty:
+                    still_missing.append(code)
+                    continue
+                if is_stale(bars["Close"]) and attempt + 1 < len(orders[code]):
+                    # 資料停止更新，可能已轉上市櫃，先保留再試另一個市場
+                    fallback.setdefault(code, bars)
+                    still_missing.append(code)
+                    continue
+                resolved[code] = suffix
+                results[code] = bars
+        pending = still_missing
+
+    for code in pending:
+        if code in fallback:
+            results[code] = fallback[code]
+            continue
+        if code in download_failed:
+            # 下次查詢再重新解析
+            if failed is not None:
+                failed.add(code)
+            continue
+        resolved[code] = None
+        FETCH_EMPTY.inc()
+        print(f"⚠️ 股票 {code} 數據下載失敗或為空。")
+
+    for code in codes:
+        if code not in results:
+            # 查不到，或近期已確認兩個市場都查不到而不再重複請求
+            results[code] = _EMPTY_BARS
+
+    store.set_symbols(resolved)
+    return results
+
+
+def get_closes_batch(stocks: Iterable[Union[str, int]], period: Optional[str] = None,
+                     batch_size: int = 50, batch_pause: float = 0.0) -> Dict[str, pd.Series]:
+    """只需要收盤價時的 get_bars_batch，回傳 {股票代號: 收盤價序列}，查不到的為空序列。"""
+    bars = get_bars_batch(stocks, period=period, batch_size=batch_size, batch_pause=batch_pause)
+    return {code: frame["Close"] for code, frame in bars.items()}
 
-        # 2. 計算並取得均線數值
-        ma_data = {}
-        for n in ma_periods:
-            df[f"MA{n}"] = df[price_col].rolling(n).mean()
-            
-            # 獲取 MA 數值
-            ma_row = df[f"MA{n}"].dropna().tail(1)
-            
-            if ma_row.empty:
-                 ma_value = np.nan
-            else:
-                 ma_value_raw = ma_row.item()
-                 
-                 # 嚴格檢查並處理 NaN
-                 if pd.isna(ma_value_raw):
-                     ma_value = np.nan
-                 else:
-                     ma_value = round(float(ma_value_raw), 2)
-            
-            ma_data[f"MA{n}"] = ma_value
-
-        # 3. 組織回傳字典
-        result: Dict[str, Union[str, float]] = {
-            "股票代號": stock_code,
-            "現價": latest_price,
-            **ma_data
-        }
-        
-        return result
 
+def get_ma_position_data_batch(stocks: Iterable[Union[str, int]], period: Optional[str] = None,
+                               batch_size: int = 50, batch_pause: float = 0.0) -> Dict[str, Dict[str, Union[str, float]]]:
+    """批次版的 get_ma_position_data：一次處理整組股票代號，回傳 {股票代號: MA 字典}。"""
+    bars = get_bars_batch(stocks, period=period, batch_size=batch_size, batch_pause=batch_pause)
+    return {code: _safe_compute_ma_data(code, frame["Close"], frame["Volume"]) for code, frame in bars.items()}
+
+
+def get_latest_prices(stocks: Iterable[Union[str, int]], batch_size: int = 50
+                      ) -> Dict[str, Tuple[pd.Timestamp, float]]:
+    """
+    盤中監控用：只抓當天的 1 分 K，回傳 {股票代號: (最後一筆的時間, 最新價)}，不重抓歷史。
+    只處理已解析過後綴的代號（監控清單在建立時已經用 get_closes_batch 查過一次）。
+    """
+    store = get_price_store()
+    tickers: Dict[str, str] = {}
+    for code in dict.fromkeys(str(s).strip() for s in stocks):
+        entry = store.get_symbol(code)
+        if entry is not None and entry[0] is not None:
+            tickers[code + entry[0]] = code
+
+    prices: Dict[str, Tuple[pd.Timestamp, float]] = {}
+    names = list(tickers)
+    for start in range(0, len(names), batch_size):
+        chunk = names[start:start + batch_size]
+        FETCH_TICKERS.inc(len(chunk), mode="latest")
+        try:
+            with FETCH_SECONDS.time(mode="latest"):
+                df = _guarded_download(chunk, period="1d", interval="1m", group_by="ticker", **DOWNLOAD_KWARGS)
+        except Exception as e:
+            FETCH_ERRORS.inc(mode="latest")
+            print(f"⚠️ 即時報價下載失敗 ({len(chunk)} 檔): {e}")
+            continue
+        for ticker in chunk:
+            bars = split_ticker(df, ticker, single=len(chunk) == 1)
+            if not bars.empty:
+                prices[tickers[ticker]] = (bars.index[-1], float(bars["Close"].iloc[-1]))
+    return prices
+
+
+def _safe_compute_ma_data(stock_code: str, close: pd.Series,
+                          volume: Optional[pd.Series] = None) -> Dict[str, Union[str, float]]:
+    try:
+        return _compute_ma_data(stock_code, close, volume)
     except Exception as e:
         print(f"❌ 處理股票 {stock_code} 時發生錯誤: {e}")
-        return default_nan_result
+        return _default_nan_result(stock_code)
 
 def get_ma_alignment_from_data(ma_data: Dict, consolidation_threshold: float = 0.02) -> Tuple[str, Dict]:
     """
@@ -163,7 +468,7 @@ def calculate_ma_scores(ma_data: Dict[str, Union[str, float]]) -> Dict[str, Any]
     # 計算各均線偏離度 (D_n)，並轉為百分比
     # 必須確保分母不為零，雖然在股價數據中幾乎不可能，但量化程式碼應保持嚴謹。
     
-    ma_periods = [240, 60, 20]
+    ma_periods = SCORE_MA_PERIODS
     for n in ma_periods:
         ma_key = f"MA{n}"
         ma_value = ma_data.get(ma_key)
@@ -191,7 +496,6 @@ def calculate_ma_scores(ma_data: Dict[str, Union[str, float]]) -> Dict[str, Any]
 # --- 額外獎勵分數 ---
     D240 = ma_devs['D240']
     D60 = ma_devs['D60']
-    print(buy_score)
     if D240 < 0 and D60 > 0:
         buy_score += 2 # 底部反彈 (長線低於，中線高於)
         status = "長線支撐/中期反彈"
@@ -201,7 +505,6 @@ def calculate_ma_scores(ma_data: Dict[str, Union[str, float]]) -> Dict[str, Any]
         status = "潛力觀察"
     else:
         status = "位置偏高/趨勢不明"
-    print(current_price)
     return {
         "MA買點分數": buy_score, 
         "D240": ma_devs['D240'], 
@@ -210,6 +513,78 @@ def calculate_ma_scores(ma_data: Dict[str, Union[str, float]]) -> Dict[str, Any]
         "買點判斷": status,
         "現價": current_price,
     }
+
+
+def analyze_stock(stock: Union[str, int], period: Optional[str] = None,
+                  consolidation_threshold: float = 0.02) -> Tuple[Dict[str, Union[str, float]], str, Dict[str, Any]]:
+    """
+    查價並一次算完 (MA 字典, 排列狀態, 買點分數)，方便整段丟到執行緒池執行。
+    同一交易日內重複查詢直接由 analysis_cache 回傳，不再重新查價計算。
+    """
+    key = (str(stock).strip(), consolidation_threshold)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return cached
+
+    ma_data = get_ma_position_data(stock, period=period)
+    with INDICATOR_SECONDS.time(mode="single"):
+        stock_status = get_ma_alignment_from_data(ma_data, consolidation_threshold=consolidation_threshold)
+        result = (ma_data, stock_status, calculate_ma_scores(ma_data))
+    if not pd.isna(ma_data["現價"]):
+        # 查價失敗的結果不快取，下次查詢會再試一次
+        analysis_cache.put(key, result)
+    return result
+
+
+def score_bars(bars: Dict[str, pd.DataFrame], consolidation_threshold: float = 0.02) -> pd.DataFrame:
+    """
+    把 get_bars_batch 的結果組成矩陣，交給 ma_engine 一次算完（格式同 score_close_matrix，依 bars 的順序）；
+    有啟用額外指標時，同一個視窗內一併算出。
+    """
+    rows = required_bars()
+    close = close_matrix_from_series({code: frame["Close"] for code, frame in bars.items()}, rows=rows)
+    extras = _extra_indicators()
+    extra_values = None
+    if extras:
+        # 成交量以收盤價的有效列選取（同單檔路徑），任一欄有缺口時兩個矩陣仍逐列對齊
+        valid = {code: frame["Close"].notna() for code, frame in bars.items()}
+        volume = close_matrix_from_series({code: frame["Volume"] for code, frame in bars.items()}, rows=rows,
+                                          valid=valid)
+        extra_values = compute_latest(close.to_numpy(), volume.to_numpy(), extras)
+    return score_close_matrix(close, consolidation_threshold=consolidation_threshold, extra=extra_values)
+
+
+def analyze_stocks_batch(stocks: Iterable[Union[str, int]], period: Optional[str] = None, batch_size: int = 50,
+                         batch_pause: float = 0.0, consolidation_threshold: float = 0.02,
+                         failed: Optional[Set[str]] = None
+                         ) -> Dict[str, Tuple[Dict[str, Union[str, float]], str, Dict[str, Any]]]:
+    """
+    批次版的 analyze_stock，回傳 {股票代號: (MA 字典, 排列狀態, 買點分數)}。
+    快取中沒有的股票才查價，並以 score_bars 整批一次算完。
+    failed 指定時會加入下載失敗的代號（結果同查無資料，為 NaN），見 get_bars_batch。
+    """
+    codes = list(dict.fromkeys(str(s).strip() for s in stocks))
+    results: Dict[str, Tuple[Dict[str, Union[str, float]], str, Dict[str, Any]]] = {}
+    misses = []
+    for code in codes:
+        cached = analysis_cache.get((code, consolidation_threshold))
+        if cached is None:
+            misses.append(code)
+        else:
+            results[code] = cached
+
+    if misses:
+        bars = get_bars_batch(misses, period=period, batch_size=batch_size, batch_pause=batch_pause, failed=failed)
+        with INDICATOR_SECONDS.time(mode="batch"):
+            scored = frame_to_results(score_bars(bars, consolidation_threshold=consolidation_threshold))
+        for code, result in scored.items():
+            if not pd.isna(result[0]["現價"]):
+                analysis_cache.put((code, consolidation_threshold), result)
+            results[code] = result
+
+    return {code: results[code] for code in codes}
+
+
 # 範例使用
 # if __name__ == "__main__":
 #     data_2330 = get_ma_position_data("2330", period="30y")
@@ -217,4 +592,4 @@ def calculate_ma_scores(ma_data: Dict[str, Union[str, float]]) -> Dict[str, Any]
 #     status_bullish = get_ma_alignment_from_data(data_2330, consolidation_threshold=0.02)
 #     print(status_bullish)
 #     print("\n--- 台積電 (2330) 均線數據 (最終穩定版本 - 使用 .item()) ---")
-#     print(data_2330)
\ No newline at end of file
+#     print(data_2330)
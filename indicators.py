@@ -0,0 +1,161 @@
+import os
+import math
+import numpy as np
+from typing import Callable, Dict, List, Optional, Sequence
+
+from ma_engine import MA_PERIODS, compact_columns, moving_averages_from_window
+
+# 除了計分用的 MA 之外，額外計算的指標（逗號分隔，例如 "EMA20,RSI14,VOL_MA20"），結果會放進 MA 字典
+EXTRA_INDICATORS = [x.strip() for x in os.getenv("EXTRA_INDICATORS", "").split(",") if x.strip()]
+
+# 換算下載期間時的保險係數（停牌、假日等造成的 K 棒缺口）
+LOOKBACK_MARGIN = 1.2
+# 一年約有幾個交易日
+TRADING_DAYS_PER_YEAR = 245
+# yfinance 可用的 period 與對應天數，由短到長
+_PERIOD_DAYS = [("1mo", 30), ("3mo", 91), ("6mo", 182), ("1y", 365), ("2y", 730), ("5y", 1826), ("10y", 3652)]
+
+
+class Indicator:
+    """
+    一個指標的定義：name 為結果欄位名稱，kind 決定算法，period 為參數，
+    source 為輸入欄位（Close 或 Volume），lookback 為最新一根需要的 K 棒數。
+    """
+
+    def __init__(self, name: str, kind: str, period: int, source: str = "Close", lookback: Optional[int] = None):
+        self.name = name
+        self.kind = kind
+        self.period = period
+        self.source = source
+        self.lookback = lookback or period
+
+    def __repr__(self) -> str:
+        return f"Indicator({self.name!r}, {self.kind!r}, {self.period}, lookback={self.lookback})"
+
+
+# kind 的算法：輸入 (已靠齊的視窗, 每欄有效值數量, 同一種 kind 的所有指標)，回傳 {指標名稱: 每檔的最新值}
+KindFunc = Callable[[np.ndarray, np.ndarray, List[Indicator]], Dict[str, np.ndarray]]
+
+INDICATORS: Dict[str, Indicator] = {}
+KINDS: Dict[str, KindFunc] = {}
+
+
+def register(indicator: Indicator) -> Indicator:
+    """註冊（或覆蓋）一個指標；kind 需已用 register_kind 註冊。"""
+    if indicator.kind not in KINDS:
+        raise ValueError(f"未知的指標類型: {indicator.kind}")
+    INDICATORS[indicator.name] = indicator
+    return indicator
+
+
+def register_kind(kind: str, func: KindFunc) -> None:
+    KINDS[kind] = func
+
+
+# ================== 內建算法 ==================
+def _sma(window: np.ndarray, counts: np.ndarray, indicators: List[Indicator]) -> Dict[str, np.ndarray]:
+    """所有 SMA 共用 ma_engine 的 rolling mean，整段視窗傳入，與 ma_engine.latest_moving_averages 逐位元一致。"""
+    periods = sorted({ind.period for ind in indicators})
+    mas = moving_averages_from_window(window, counts, periods)
+    return {ind.name: mas[ind.period] for ind in indicators}
+
+
+def _ema(window: np.ndarray, counts: np.ndarray, indicators: List[Indicator]) -> Dict[str, np.ndarray]:
+    """指數移動平均，以各自 lookback 內第一個有效值起算（四捨五入到兩位）。"""
+    results = {}
+    for ind in indicators:
+        alpha = 2.0 / (ind.period + 1)
+        ema = np.full(window.shape[1], np.nan)
+        for row in window[-ind.lookback:]:
+            ema = np.where(np.isnan(ema), row, np.where(np.isnan(row), ema, alpha * row + (1 - alpha) * ema))
+        ema[counts < ind.period] = np.nan
+        results[ind.name] = np.round(ema, 2)
+    return results
+
+
+def _rsi(window: np.ndarray, counts: np.ndarray, indicators: List[Indicator]) -> Dict[str, np.ndarray]:
+    """Wilder RSI（平滑係數 1/period），以各自 lookback 內的漲跌幅計算（四捨五入到兩位）。"""
+    results = {}
+    for ind in indicators:
+        alpha = 1.0 / ind.period
+        diffs = np.diff(window[-(ind.lookback + 1):], axis=0)
+        gain = np.full(window.shape[1], np.nan)
+        loss = np.full(window.shape[1], np.nan)
+        for diff in diffs:
+            up, down = np.clip(diff, 0, None), np.clip(-diff, 0, None)
+            gain = np.where(np.isnan(gain), up, np.where(np.isnan(diff), gain, alpha * up + (1 - alpha) * gain))
+            loss = np.where(np.isnan(loss), down, np.where(np.isnan(diff), loss, alpha * down + (1 - alpha) * loss))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rsi = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+        rsi[np.isnan(gain) | (counts <= ind.period)] = np.nan
+        results[ind.name] = np.round(rsi, 2)
+    return results
+
+
+register_kind("sma", _sma)
+register_kind("ema", _ema)
+register_kind("rsi", _rsi)
+
+for _n in MA_PERIODS:
+    register(Indicator(f"MA{_n}", "sma", _n))
+# EMA / RSI 理論上受全部歷史影響；暖身長度取到最早一根的權重約剩 e^-12，誤差遠小於兩位小數
+# （EMA 平滑係數 2/(n+1) 約需 6 倍週期，RSI 的 1/n 約需 12 倍週期）
+for _n in (12, 20, 26, 60):
+    register(Indicator(f"EMA{_n}", "ema", _n, lookback=6 * _n))
+for _n in (6, 14):
+    register(Indicator(f"RSI{_n}", "rsi", _n, lookback=12 * _n))
+for _n in (5, 20, 60):
+    register(Indicator(f"VOL_MA{_n}", "sma", _n, source="Volume"))
+
+# 買點計分與排列判斷一定需要的指標
+CORE_INDICATORS = [f"MA{n}" for n in MA_PERIODS]
+
+
+def active_indicators(extra: Optional[Sequence[str]] = None) -> List[str]:
+    """目前要計算的指標：計分用的 MA 加上 EXTRA_INDICATORS（未註冊的名稱會被略過）。"""
+    extra = EXTRA_INDICATORS if extra is None else extra
+    return list(dict.fromkeys(CORE_INDICATORS + [name for name in extra if name in INDICATORS]))
+
+
+def required_bars(names: Optional[Sequence[str]] = None) -> int:
+    """計算 names 中所有指標的最新值，總共需要最後幾根 K 棒（各指標 lookback 的聯集）。"""
+    names = active_indicators() if names is None else names
+    # RSI 需要多一根來算第一個漲跌幅
+    return max(INDICATORS[name].lookback + (INDICATORS[name].kind == "rsi") for name in names)
+
+
+def history_period(names: Optional[Sequence[str]] = None) -> str:
+    """把需要的 K 棒數換算成 yfinance 的 period，只下載剛好夠用的歷史，而不是 max / 30y。"""
+    days = math.ceil(required_bars(names) / TRADING_DAYS_PER_YEAR * 365 * LOOKBACK_MARGIN) + 30
+    for period, period_days in _PERIOD_DAYS:
+        if period_days >= days:
+            return period
+    return "max"
+
+
+def compute_latest(close: np.ndarray, volume: Optional[np.ndarray] = None,
+                   names: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    對 日期 × 股票 的收盤價（與成交量）矩陣，算出 names 中每個指標的最新值，回傳 {指標名稱: 每檔的值}。
+    每種輸入只靠齊一次、取一次聯集視窗，同一種 kind 的指標一起計算。
+    """
+    names = active_indicators() if names is None else list(names)
+    rows = required_bars(names)
+    sources = {"Close": close, "Volume": volume}
+    groups: Dict[tuple, List[Indicator]] = {}
+    for name in names:
+        ind = INDICATORS[name]
+        groups.setdefault((ind.source, ind.kind), []).append(ind)
+
+    windows = {}
+    results: Dict[str, np.ndarray] = {}
+    for (source, kind), members in groups.items():
+        if sources.get(source) is None:
+            width = np.asarray(close).reshape(len(close), -1).shape[1]
+            results.update({ind.name: np.full(width, np.nan) for ind in members})
+            continue
+        if source not in windows:
+            windows[source] = compact_columns(sources[source], rows)
+        window, counts = windows[source]
+        results.update(KINDS[kind](window, counts, members))
+    return {name: results[name] for name in names}
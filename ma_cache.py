@@ -0,0 +1,110 @@
+import os
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+TAIPEI = ZoneInfo("Asia/Taipei")
+MARKET_OPEN = datetime.time(9, 0)
+MARKET_CLOSE = datetime.time(13, 30)
+
+# 快取最多保留幾檔股票
+MA_CACHE_SIZE = int(os.getenv("MA_CACHE_SIZE", "4096"))
+# 盤中價格會變動，盤中算出的結果最多沿用幾秒；盤後則一直沿用到下一次收盤
+MA_CACHE_INTRADAY_TTL = float(os.getenv("MA_CACHE_INTRADAY_TTL", "600"))
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(TAIPEI)
+
+
+def _is_trading_day(day: datetime.date) -> bool:
+    # 只排除週末；國定假日當天沒有新 K 棒，快取多算一次也不影響正確性
+    return day.weekday() < 5
+
+
+def last_trading_session(now: Optional[datetime.datetime] = None) -> datetime.date:
+    """目前資料所屬的交易日：收盤前算前一個交易日，收盤後算當天。"""
+    now = (now or _now()).astimezone(TAIPEI)
+    day = now.date()
+    if not (_is_trading_day(day) and now.time() >= MARKET_CLOSE):
+        day -= datetime.timedelta(days=1)
+        while not _is_trading_day(day):
+            day -= datetime.timedelta(days=1)
+    return day
+
+
+def next_market_close(now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    """下一次台股收盤的時間點。"""
+    now = (now or _now()).astimezone(TAIPEI)
+    day = now.date()
+    while True:
+        close = datetime.datetime.combine(day, MARKET_CLOSE, tzinfo=TAIPEI)
+        if _is_trading_day(day) and close > now:
+            return close
+        day += datetime.timedelta(days=1)
+
+
+def is_trading_hours(now: Optional[datetime.datetime] = None) -> bool:
+    now = (now or _now()).astimezone(TAIPEI)
+    return _is_trading_day(now.date()) and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+class TradingDayCache:
+    """
+    以 (key, 交易日) 為鍵的 LRU 快取，條目在下一次收盤時自動失效；
+    盤中寫入的條目另外受 intraday_ttl 限制。附帶 hit/miss/eviction 計數。
+    """
+
+    def __init__(self, maxsize: int = MA_CACHE_SIZE, intraday_ttl: float = MA_CACHE_INTRADAY_TTL):
+        self.maxsize = maxsize
+        self.intraday_ttl = intraday_ttl
+        self._data: "OrderedDict[Tuple[Hashable, datetime.date], Tuple[datetime.datetime, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = _now()
+        full_key = (key, last_trading_session(now))
+        with self._lock:
+            entry = self._data.get(full_key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[full_key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(full_key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        now = _now()
+        expires = next_market_close(now)
+        if is_trading_hours(now):
+            expires = min(expires, now + datetime.timedelta(seconds=self.intraday_ttl))
+        full_key = (key, last_trading_session(now))
+        with self._lock:
+            self._data[full_key] = (expires, value)
+            self._data.move_to_end(full_key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,304 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+MA_PERIODS = [5, 10, 20, 60, 120, 240]
+# calculate_ma_scores 計算偏離度用到的均線
+SCORE_MA_PERIODS = [240, 60, 20]
+
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    """
+    四捨五入到小數點後兩位，結果與 Python 內建 round(v, 2) 逐位元一致。
+
+    round 是對 v 的精確十進位值取整，而 v * 100 本身有捨入誤差，
+    所以只有 v * 100 非常接近 .5 邊界的值才可能和 np.rint 不同，這些值改用 Python round 逐一處理。
+    """
+    values = np.asarray(values, dtype=float)
+    scaled = values * 100
+    rounded = np.rint(scaled) / 100
+    with np.errstate(invalid="ignore"):
+        frac = np.abs(scaled - np.floor(scaled) - 0.5)
+        ambiguous = frac <= 1e-9 * np.maximum(1.0, np.abs(scaled))
+    if ambiguous.any():
+        rounded[ambiguous] = [round(v, 2) for v in values[ambiguous].tolist()]
+    return rounded
+
+
+def compact_columns(values: np.ndarray, rows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把每一欄的有效值（非 NaN）往下靠齊，只保留最後 rows 列。
+    回傳 (rows × 欄數 的矩陣, 每欄有效值數量)，不足的部分在上方補 NaN。
+    等同於對每一欄各自做 dropna().tail(rows)。
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    if valid.all():
+        window = values[-rows:]
+    else:
+        # 穩定排序讓 NaN 排到前面、有效值保持原本順序排在後面
+        order = np.argsort(valid, axis=0, kind="stable")
+        window = np.take_along_axis(values, order, axis=0)[-rows:]
+    if window.shape[0] < rows:
+        pad = np.full((rows - window.shape[0], window.shape[1]), np.nan)
+        window = np.vstack([pad, window])
+    return window, counts
+
+
+def latest_moving_averages(values: np.ndarray, periods: Sequence[int] = MA_PERIODS
+                           ) -> Tuple[np.ndarray, Dict[int, np.ndarray]]:
+    """
+    對 日期 × 股票 的收盤價矩陣，一次算出每檔的現價與最新一根的各期 MA（已四捨五入到兩位）。
+
+    每欄的有效值靠齊後逐欄做 pandas rolling mean，與單檔對同一段收盤價做 close.rolling(n).mean()
+    逐位元一致；上方補的 NaN 與其他欄都不影響結果，所以單檔和多檔計算的結果完全相同。
+    """
+    values = np.asarray(values, dtype=float)
+    rows = values.shape[0] if values.ndim else 0
+    window, counts = compact_columns(values, max(rows, max(periods)))
+    return window[-1].copy(), moving_averages_from_window(window, counts, periods)
+
+
+def moving_averages_from_window(window: np.ndarray, counts: np.ndarray, periods: Sequence[int]) -> Dict[int, np.ndarray]:
+    """
+    由 compact_columns 靠齊後的視窗（至少 max(periods) 列）算出最新一根的各期 MA。
+    rolling mean 的結果與它看過的整段歷史有關，呼叫端要傳入與單檔路徑相同的整段視窗，不能先截短。
+    """
+    frame = pd.DataFrame(window)
+    mas: Dict[int, np.ndarray] = {}
+    for n in periods:
+        ma = frame.rolling(n).mean().to_numpy()[-1].copy()
+        ma[counts < n] = np.nan
+        mas[n] = _round2(ma)
+    return mas
+
+
+def trend_labels(consolidation_threshold: float = 0.02) -> List[str]:
+    """alignment_vector 可能回傳的所有排列狀態（跨行程傳遞時以索引代替字串）。"""
+    return ["數據不完整", "多頭排列", "空頭排列", f"盤整/均線糾纏 (差距 < {consolidation_threshold*100:.2f}%)",
+            "趨勢不明顯"]
+
+
+# score_vectors 可能回傳的所有買點判斷
+SIGNAL_LABELS = ["數據缺失", "長線支撐/中期反彈", "強勁買點", "潛力觀察", "位置偏高/趨勢不明"]
+
+
+def alignment_vector(price: np.ndarray, mas: Dict[int, np.ndarray],
+                     consolidation_threshold: float = 0.02) -> np.ndarray:
+    """向量化版的 get_ma_alignment_from_data，回傳每檔（或每格）的排列狀態字串，輸入可為任意形狀。"""
+    ma5, ma10, ma20, ma60 = mas[5], mas[10], mas[20], mas[60]
+    incomplete = np.isnan(price) | np.isnan(ma5) | np.isnan(ma10) | np.isnan(ma20) | np.isnan(ma60)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bullish = (ma5 > ma10) & (ma10 > ma20) & (ma20 > ma60) & (price > ma5)
+        bearish = (ma5 < ma10) & (ma10 < ma20) & (ma20 < ma60) & (price < ma5)
+        max_ma = np.maximum(np.maximum(ma5, ma10), ma20)
+        min_ma = np.minimum(np.minimum(ma5, ma10), ma20)
+        consolidation = (max_ma - min_ma) / min_ma <= consolidation_threshold
+
+    status = np.full(price.shape, "趨勢不明顯", dtype=object)
+    status[consolidation] = f"盤整/均線糾纏 (差距 < {consolidation_threshold*100:.2f}%)"
+    status[bearish] = "空頭排列"
+    status[bullish] = "多頭排列"
+    status[incomplete] = "數據不完整"
+    return status
+
+
+def score_vectors(price: np.ndarray, mas: Dict[int, np.ndarray]) -> Dict[str, np.ndarray]:
+    """向量化版的 calculate_ma_scores，回傳 MA買點分數、D240/D60/D20 與買點判斷，輸入可為任意形狀。"""
+    devs: Dict[int, np.ndarray] = {}
+    with np.errstate(invalid="ignore"):
+        for n in SCORE_MA_PERIODS:
+            devs[n] = ((price - mas[n]) / (mas[n] + 0.0001)) * 100
+
+        d240, d60, d20 = devs[240], devs[60], devs[20]
+        score = np.zeros(price.shape, dtype=int)
+        score += np.where(d240 <= 0, 6, np.where((d240 > 0) & (d240 <= 5), 4, 0))
+        score += np.where((d60 >= -3) & (d60 <= 0), 3, np.where((d60 > 0) & (d60 <= 3), 1, 0))
+        score += np.where((d20 >= -1) & (d20 <= 1), 1, 0)
+
+        rounded = {n: _round2(devs[n]) for n in devs}
+        rebound = (rounded[240] < 0) & (rounded[60] > 0)
+
+    score = score + np.where(rebound, 2, 0)
+    status = np.full(price.shape, "位置偏高/趨勢不明", dtype=object)
+    status[score >= 5] = "潛力觀察"
+    status[score >= 8] = "強勁買點"
+    status[rebound] = "長線支撐/中期反彈"
+
+    missing = np.isnan(price)
+    score[missing] = 0
+    status[missing] = "數據缺失"
+    for n in rounded:
+        rounded[n][missing] = np.nan
+
+    return {"MA買點分數": score, "D240": rounded[240], "D60": rounded[60], "D20": rounded[20], "買點判斷": status}
+
+
+def score_close_matrix(close: pd.DataFrame, consolidation_threshold: float = 0.02,
+                       extra: Optional[Dict[str, np.ndarray]] = None) -> pd.DataFrame:
+    """
+    輸入 日期 × 股票 的收盤價矩陣，一次算出所有股票最新的現價、MA5–MA240、
+    排列狀態、買點分數與偏離度。每一列與單檔的
+    get_ma_position_data / get_ma_alignment_from_data / calculate_ma_scores 對同一段收盤價的結果逐位元一致。
+    extra 為額外指標的最新值（{指標名稱: 每檔的值}），會原樣加在 MA 欄位之後。
+    """
+    price, mas = latest_moving_averages(close.to_numpy(dtype=float), MA_PERIODS)
+    scores = score_vectors(price, mas)
+    frame = pd.DataFrame({"現價": price, **{f"MA{n}": mas[n] for n in MA_PERIODS}, **(extra or {})},
+                         index=close.columns)
+    frame["趨勢"] = alignment_vector(price, mas, consolidation_threshold)
+    for key, values in scores.items():
+        frame[key] = values
+    frame.index.name = "股票代號"
+    return frame
+
+
+def close_matrix_from_series(closes: Dict[str, pd.Series], rows: int = max(MA_PERIODS),
+                             valid: Optional[Dict[str, pd.Series]] = None) -> pd.DataFrame:
+    """
+    把 {代號: 收盤價序列} 各自取最後 rows 個有效值，靠右對齊成一個矩陣。
+    各檔交易日不同也沒關係，引擎只看每檔自己的最後幾根 K 棒。
+    valid 指定 {代號: 布林遮罩} 時改以遮罩選列、保留其中的缺值，
+    例如以收盤價的有效列選出成交量，讓兩個矩陣的每一列是同一根 K 棒。
+    """
+    codes = list(closes)
+    matrix = np.full((rows, len(codes)), np.nan)
+    for j, code in enumerate(codes):
+        series = closes[code] if valid is None else closes[code][valid[code]]
+        values = (series.dropna() if valid is None else series).to_numpy(dtype=float)[-rows:]
+        if len(values):
+            matrix[rows - len(values):, j] = values
+    return pd.DataFrame(matrix, columns=codes)
+
+
+def frame_to_results(frame: pd.DataFrame) -> Dict[str, Tuple[Dict[str, Union[str, float]], str, Dict[str, Any]]]:
+    """把 score_close_matrix 的結果轉回單檔函式的格式：{代號: (MA 字典, 排列狀態, 買點分數)}。"""
+    results = {}
+    score_cols = {"現價", "趨勢", "MA買點分數", "D240", "D60", "D20", "買點判斷"}
+    # MA 與額外指標都放進 MA 字典
+    ma_cols = [c for c in frame.columns if c not in score_cols]
+    for code, row in zip(frame.index, frame.to_dict("records")):
+        ma_data = {"股票代號": code, "現價": row["現價"], **{c: row[c] for c in ma_cols}}
+        if pd.isna(row["現價"]):
+            scores = {"MA買點分數": 0, "D240": np.nan, "D60": np.nan, "D20": np.nan, "買點判斷": "數據缺失"}
+        else:
+            scores = {
+                "MA買點分數": int(row["MA買點分數"]),
+                "D240": row["D240"],
+                "D60": row["D60"],
+                "D20": row["D20"],
+                "買點判斷": row["買點判斷"],
+                "現價": row["現價"],
+            }
+        results[code] = (ma_data, row["趨勢"], scores)
+    return results
+
+
+# ================== 回測：逐日的歷史分數 ==================
+HISTORY_CHUNK = 256
+DEFAULT_HORIZONS = (5, 20, 60)
+
+
+def _compact_order(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把每一欄的有效值往下靠齊（NaN 移到上方），回傳 (靠齊後的矩陣, 排列順序)。
+    靠齊後第 p 列對應原矩陣的 order[p] 列，可用 np.put_along_axis 放回原位置。
+    """
+    order = np.argsort(~np.isnan(values), axis=0, kind="stable")
+    return np.take_along_axis(values, order, axis=0), order
+
+
+def _scatter(order: np.ndarray, compacted: np.ndarray) -> np.ndarray:
+    out = np.empty(compacted.shape, dtype=compacted.dtype)
+    np.put_along_axis(out, order, compacted, axis=0)
+    return out
+
+
+def rolling_moving_averages(values: np.ndarray, periods: Sequence[int] = MA_PERIODS) -> Dict[int, np.ndarray]:
+    """
+    對已靠齊的 日期 × 股票 收盤價矩陣，算出每一列當天的各期 MA（已四捨五入到兩位）。
+
+    與 latest_moving_averages 相同使用 pandas rolling mean，而 rolling 只看當天以前的值，
+    所以第 t 列的 MA 與只拿前 t 根 K 棒呼叫 latest_moving_averages 的結果逐位元一致。
+    """
+    frame = pd.DataFrame(values)
+    return {n: _round2(frame.rolling(n).mean().to_numpy()) for n in periods}
+
+
+def score_history(close: pd.DataFrame, consolidation_threshold: float = 0.02,
+                  chunk: int = HISTORY_CHUNK) -> Dict[str, pd.DataFrame]:
+    """
+    回測用：輸入 日期 × 股票 的收盤價矩陣，一次算出每一天的現價、MA5–MA240、
+    排列狀態、買點分數與偏離度，回傳 {欄位名稱: 日期 × 股票 的 DataFrame}。
+
+    每檔只看自己有收盤價的 K 棒：第 t 根的結果等同於拿前 t 根呼叫
+    get_ma_position_data / get_ma_alignment_from_data / calculate_ma_scores。
+    當天沒有收盤價的格子為 NaN / 數據缺失。股票依 chunk 檔一組計算，限制記憶體用量。
+    """
+    values = close.to_numpy(dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    keys = ["現價"] + [f"MA{n}" for n in MA_PERIODS] + ["趨勢", "MA買點分數", "D240", "D60", "D20", "買點判斷"]
+    parts: Dict[str, List[np.ndarray]] = {key: [] for key in keys}
+
+    for start in range(0, max(values.shape[1], 1), chunk):
+        compacted, order = _compact_order(values[:, start:start + chunk])
+        mas = rolling_moving_averages(compacted, MA_PERIODS)
+        columns = {"現價": compacted, **{f"MA{n}": mas[n] for n in MA_PERIODS}}
+        columns["趨勢"] = alignment_vector(compacted, mas, consolidation_threshold)
+        columns.update(score_vectors(compacted, mas))
+        for key in keys:
+            parts[key].append(_scatter(order, columns[key]))
+
+    history = {}
+    for key in keys:
+        matrix = np.concatenate(parts[key], axis=1)
+        # 狀態欄位維持 object，避免 pandas 逐欄推斷字串型別
+        history[key] = pd.DataFrame(matrix, index=close.index, columns=close.columns,
+                                    dtype=object if matrix.dtype == object else None)
+    return history
+
+
+def forward_returns(close: pd.DataFrame, horizons: Sequence[int] = DEFAULT_HORIZONS) -> Dict[int, pd.DataFrame]:
+    """每一天往後 h 根 K 棒（以該檔自己的交易日計）的報酬率，回傳 {h: 日期 × 股票 的 DataFrame}。"""
+    values = close.to_numpy(dtype=float)
+    compacted, order = _compact_order(values)
+    results = {}
+    for h in horizons:
+        future = np.full(compacted.shape, np.nan)
+        future[:-h] = compacted[h:]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ret = future / compacted - 1
+        results[h] = pd.DataFrame(_scatter(order, ret), index=close.index, columns=close.columns)
+    return results
+
+
+def forward_return_stats(history: Dict[str, pd.DataFrame], returns: Dict[int, pd.DataFrame],
+                         by: str = "MA買點分數") -> pd.DataFrame:
+    """
+    依分數（或 by 指定的其他欄位，例如 買點判斷、趨勢）分組，統計各持有天數的未來報酬：
+    樣本數、平均、中位數、勝率（報酬 > 0 的比例）。回傳以 (持有天數, 分組) 為索引的 DataFrame。
+    """
+    buckets = history[by].to_numpy().ravel()
+    valid_price = ~np.isnan(history["現價"].to_numpy(dtype=float).ravel())
+    frames = []
+    for h, ret in returns.items():
+        values = ret.to_numpy(dtype=float).ravel()
+        mask = valid_price & ~np.isnan(values)
+        sample = pd.DataFrame({by: buckets[mask], "報酬": values[mask], "獲利": values[mask] > 0})
+        grouped = sample.groupby(by)
+        stats = pd.DataFrame({
+            "樣本數": grouped["報酬"].size(),
+            "平均報酬": grouped["報酬"].mean(),
+            "中位數報酬": grouped["報酬"].median(),
+            "勝率": grouped["獲利"].mean(),
+        })
+        stats.index = pd.MultiIndex.from_product([[h], stats.index], names=["持有天數", by])
+        frames.append(stats)
+    if not frames:
+        return pd.DataFrame(columns=["樣本數", "平均報酬", "中位數報酬", "勝率"])
+    return pd.concat(frames)
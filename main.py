@@ -1,16 +1,32 @@
 import os
+import numpy as np
 import pandas as pd
-from io import BytesIO
+import tempfile
 from pyrogram import Client, filters, enums
 from pyrogram.types import Message
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import asyncio
 import logging
-from get_stock_position import get_ma_position_data, get_ma_alignment_from_data, calculate_ma_scores
+from get_stock_position import analysis_cache, analyze_stock, analyze_stocks_batch, get_closes_batch, get_latest_prices
+from ma_cache import is_trading_hours, last_trading_session
+from monitor import MONITOR_INTERVAL, Monitor, format_alert
+from concurrency import SingleFlight, run_blocking
+from fetch_guard import fetch_guard
+from broadcast import broadcast, broadcast_edit, broadcast_status, split_message
+from subscribers import SubscriberStore, apply_command, group_by_predicate, parse_command, plan_candidates
+from metrics import (EXCEL_INGEST_ROWS, EXCEL_INGEST_SECONDS, QUERIES, QUERY_SECONDS, REGISTRY, SCAN_SECONDS, SCANS,
+                     SNAPSHOT_BUILD_SECONDS, scan_progress)
+from universe_scan import load_universe, score_universe, top_candidates
+from score_snapshot import ScoreSnapshot, build_snapshot_frame, load_snapshot, save_snapshot
+from scan_checkpoint import SCAN_RESUME_MAX_HOURS, ScanCheckpoint, new_scan_id
+from report_sheet import (DATE_COLUMN, GROWTH_COLUMNS, LATEST_COLUMN, SHEET_COLUMNS, SUMMARY_COLUMN,
+                          ReportIndex, diff_report_sheets, eps_values, growth_values, ingest_sheet, load_sheet,
+                          load_summaries, prepare_report_sheet, select_candidates)
 from dotenv import load_dotenv
 import os
 import time
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 import uvicorn
 import os
 from threading import Thread
@@ -21,6 +37,22 @@ app_fastapi = FastAPI()
 async def root():
     return {"message": "股票機器人活著喔！", "status": "running"}
 
+@app_fastapi.get("/metrics")
+async def metrics():
+    """Prometheus 格式的各階段耗時與計數。"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app_fastapi.get("/status")
+async def status():
+    """目前（或上一次）掃描的進度、報告表版本與分析快取狀態。"""
+    return {
+        "scan": scan_progress.snapshot(),
+        "excel": {"version": latest_version, "rows": 0 if latest_df is None else len(latest_df)},
+        "analysis_cache": analysis_cache.stats(),
+        "score_snapshot": None if latest_snapshot is None else latest_snapshot.info(),
+        "fetch": fetch_guard.info(),
+    }
+
 async def run_web():
     """啟動 Uvicorn 伺服器，並使用 Server 類而非 run 函式以避免阻塞"""
     port = int(os.environ.get("PORT", 10000))
@@ -42,9 +74,39 @@ ALL_ID = list(map(int, os.getenv("ALL_ID").split(",")))   # 你的 Telegram ID
 # MY_CHAT_ID = int(os.getenv("MY_CHAT_ID"))    # 你的 Telegram ID，例如 1350443089
 # PETER_CHAT_ID = int(os.getenv("PETER_CHAT_ID"))    # 你的 Telegram ID，例如 1350443089
 PORT = int(os.getenv("PORT")) 
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "50"))   # 每次批次查價的股票檔數
+MIN_GROWTH_26 = float(os.getenv("MIN_GROWTH_26", "15"))      # daily_job 條件 1：26成長率門檻 (%)
+MIN_FILLED_GROWTH = float(os.getenv("MIN_FILLED_GROWTH", "0"))  # daily_job 條件 2：有填的成長率門檻 (%)
+UNIVERSE_MIN_SCORE = int(os.getenv("UNIVERSE_MIN_SCORE", "8"))   # 全市場掃描：通知的最低 MA買點分數
+UNIVERSE_TOP = int(os.getenv("UNIVERSE_TOP", "30"))              # 全市場掃描：最多通知幾檔
+SNAPSHOT_TIME = os.getenv("SNAPSHOT_TIME", "14:30")              # 收盤後建立分數快照的時間（台灣時間）
+SCAN_STREAM_ENTRIES = int(os.getenv("SCAN_STREAM_ENTRIES", "10"))      # 掃描中累積幾筆符合條件的股票就先送出
+SCAN_STREAM_SECONDS = float(os.getenv("SCAN_STREAM_SECONDS", "15"))   # 或距離第一筆待送出的結果超過幾秒就先送出
+NOTIFY_NEW_REPORTS = int(os.getenv("NOTIFY_NEW_REPORTS", "0"))    # 1：上傳 Excel 後立即通知新增且符合條件的報告
 print(ALL_ID)
 # 全域儲存最新的 DataFrame
 latest_df: pd.DataFrame | None = None
+# latest_df 的查詢索引，隨 Excel 上傳一起更新
+latest_index: ReportIndex | None = None
+# latest_df 對應的快照版本代號
+latest_version: str | None = None
+# 收盤後預先算好的分數快照，查詢與排程掃描優先使用
+latest_snapshot: ScoreSnapshot | None = None
+
+# 合併並行的重複工作：同一檔股票的查價、以及重疊的整批掃描
+analysis_flight = SingleFlight()
+scan_flight = SingleFlight()
+
+# 盤中監控的均線狀態（MONITOR_INTERVAL > 0 時啟用）
+monitor = Monitor()
+
+# daily_job 的檢查點：程序在掃描途中重啟時，啟動後從中斷處接續
+scan_checkpoint = ScanCheckpoint()
+# 在背景執行的工作（例如啟動時接續的掃描）：保留參考避免被回收，結束時記錄例外
+background_tasks: set[asyncio.Task] = set()
+
+# 每位訂閱者的通知條件；ALL_ID 沒有設定時使用預設條件（同原本的全域門檻）
+subscriber_store = SubscriberStore(default_ids=ALL_ID, min_growth_26=MIN_GROWTH_26, min_filled_growth=MIN_FILLED_GROWTH)
 
 # 建立 Pyrogram 客戶端
 app = Client(
@@ -57,31 +119,58 @@ app = Client(
 
 
 
-async def board_cast(text, message_type = 0):
-    for i in ALL_ID:
-        if message_type == 0:
-            await app.send_message(i, text)
-        elif message_type ==1:
-            await app.send_message(
-                    i, 
-                    text, 
-                    parse_mode=enums.ParseMode.HTML, # <--- 將字串替換為 enums.ParseMode.HTML
-                    disable_web_page_preview=True
-                )
-            
+async def board_cast(text, message_type = 0, chat_ids = None):
+    """
+    發送給所有訂閱者（預設為 ALL_ID 加上用指令訂閱的人）：所有收件人同時發送並共用限速器，
+    text 可以是單一字串（超過 Telegram 上限會自動切開）或已切好的多則訊息。
+    """
+    chunks = text if isinstance(text, list) else split_message([text])
+    kwargs = {}
+    if message_type == 1:
+        kwargs = {
+            "parse_mode": enums.ParseMode.HTML, # <--- 將字串替換為 enums.ParseMode.HTML
+            "disable_web_page_preview": True,
+        }
+    await broadcast(app, subscriber_store.chat_ids() if chat_ids is None else chat_ids, chunks, **kwargs)
+
+
+async def board_cast_status(text, chat_ids):
+    """每位收件人各送一則之後會被編輯的訊息（HTML），回傳 {chat_id: 訊息 id}。"""
+    return await broadcast_status(app, chat_ids, text, parse_mode=enums.ParseMode.HTML,
+                                  disable_web_page_preview=True)
+
+
+async def board_cast_edit(message_ids, chunks):
+    """把 chunks 的第一則編輯進 board_cast_status 送出的訊息，其餘接著發送。"""
+    await broadcast_edit(app, message_ids, chunks, parse_mode=enums.ParseMode.HTML, disable_web_page_preview=True)
+
 
 
 # ==================== 加上這段：文字指令觸發更新 ====================
 @app.on_message(filters.private & filters.text& ~filters.me)
 async def manual_trigger(client: Client, message: Message):
     """只要你傳「update」就立刻執行一次 daily_job"""
+    command = parse_command(message.text)
+    if command is not None:
+        # 訂閱與個人通知條件的設定
+        await message.reply(await run_blocking(apply_command, subscriber_store, message.chat.id, *command))
+        return
     if message.text.strip().lower() in ["update", "更新", "跑一次", "執行"]:
-        await message.reply("收到指令，正在執行每日通知...")
+        if scan_flight.in_flight("daily_job"):
+            await message.reply("目前已有掃描進行中，完成後會一併通知。")
+        else:
+            await message.reply("收到指令，正在執行每日通知...")
         await daily_job()
+    elif message.text.strip().lower() in ["全市場", "universe"]:
+        if scan_flight.in_flight("universe"):
+            await message.reply("目前已有全市場掃描進行中，完成後會一併通知。")
+        else:
+            await message.reply("收到指令，正在掃描上市櫃全部股票...")
+        await universe_job()
     else :
         if message.text.strip().lower() in ["update", "更新", "跑一次", "執行"]:
             return # 確保不處理 manual_trigger 應該處理的關鍵字
-        global latest_df
+        global latest_df, latest_index
         query = message.text.strip().upper() # 轉換成大寫方便比對
 
         if latest_df is None or latest_df.empty:
@@ -91,20 +180,25 @@ async def manual_trigger(client: Client, message: Message):
         # 判斷輸入是否為純數字的股票代號（例如：2330, 2454）
         is_ticker_query = query.isdigit()
         
-        # 根據股票代號或公司名稱來過濾資料
+        # 根據股票代號或公司名稱來過濾資料（使用上傳時建立的索引，不必每次掃描整張表）
+        if latest_index is None:
+            latest_index = ReportIndex(latest_df)
         if is_ticker_query:
             # 股票代號比對
-            matched_rows = latest_df[latest_df['股票代號'].astype(str).str.strip() == query]
+            matched_rows = latest_df.iloc[latest_index.lookup_code(query)]
         else:
-            # 公司名稱包含比對
-            matched_rows = latest_df[latest_df['公司名稱'].astype(str).str.contains(query, case=False, na=False)]
+            # 公司名稱包含比對（完全相符、開頭相符的排在前面）
+            matched_rows = latest_df.iloc[latest_index.lookup_name(query)]
 
         if matched_rows.empty:
+            QUERIES.inc(result="not_found")
             await message.reply(f"找不到關於「{query}」的資料。")
             return
 
+        QUERIES.inc(result="found")
         await message.reply(f"找到 {len(matched_rows)} 筆關於「{query}」的報告，正在整理...")
-        await handle_stock_query(client, message, query,matched_rows)
+        with QUERY_SECONDS.time():
+            await handle_stock_query(client, message, query,matched_rows)
     return
         # 如果你有「前一天」版本，也可以加另一個指令
         # elif message.text.strip().lower() == "prev":
@@ -112,21 +206,88 @@ async def manual_trigger(client: Client, message: Message):
 # ================== 收到 Excel 時自動更新 ==================
 @app.on_message(filters.private & filters.document)
 async def receive_excel(client: Client, message: Message):
-    global latest_df
+    global latest_df, latest_index, latest_version
     if message.document.file_name and message.document.file_name.lower().endswith(('.xlsx', '.xls')):
         await message.reply("收到 Excel，正在讀取...")
-        file = await message.download(in_memory=True)
+        # 下載到暫存檔再串流讀取，不把整個檔案放在記憶體中
+        suffix = os.path.splitext(message.document.file_name)[1].lower()
+        path = os.path.join(tempfile.gettempdir(), f"upload-{message.id}{suffix}")
         try:
-            latest_df = pd.read_excel(BytesIO(file.getbuffer()))
+            path = await message.download(file_name=path)
+            previous_df = latest_df
+            with EXCEL_INGEST_SECONDS.time():
+                # 逐段讀入需要的欄位並同時寫成快照（重啟後不必重新上傳），報告摘要只留在快照檔中；
+                # 型別轉換與篩選旗標在上傳時一次算好，通過後才成為新版本
+                version, prepared, header = await run_blocking(ingest_sheet, path,
+                                                               source_name=message.document.file_name)
+            # 與上一版比對，找出新增或內容有變動的報告（換上新表之前）
+            diff = await run_blocking(diff_report_sheets, previous_df, prepared)
+            latest_version, latest_df = version, prepared
+            latest_index = ReportIndex(latest_df)
             rows = len(latest_df)
-            cols = len(latest_df.columns)
-            await message.reply(f"Excel 更新成功！\n共 {rows} 筆資料，{cols} 個欄位")
-            logging.info(f"Excel 已更新，{rows} 行")
+            cols = len(header)
+            EXCEL_INGEST_ROWS.inc(rows)
+            await message.reply(f"Excel 更新成功！\n共 {rows} 筆資料，{cols} 個欄位\n與上一版相比：{diff.summary()}")
+            logging.info(f"Excel 已更新，{rows} 行（{diff.summary()}）")
         except Exception as e:
             await message.reply(f"讀取失敗：{str(e)}")
             logging.error(f"讀 Excel 失敗: {e}")
+            return
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if previous_df is not None and len(diff.rows):
+            try:
+                await process_sheet_delta(latest_df, diff)
+            except Exception as e:
+                logging.error(f"新報告計分失敗: {e}")
     return
 
+
+async def process_sheet_delta(df, diff):
+    """
+    只處理新增或變動的報告：依訂閱者條件挑出其中的候選，只對涉及的股票查價計分
+    （結果進入 analysis_cache，下一次掃描與查詢直接沿用），
+    NOTIFY_NEW_REPORTS 開啟時立即通知符合條件的新報告。
+    """
+    subs = subscriber_store.all()
+    changed_rows = set(diff.rows)
+    candidates, growth_rows = await run_blocking(_scan_candidates, df, subs)
+    candidates = [c for c in candidates if c["列"] in changed_rows]
+    tickers = list(dict.fromkeys(c["代號"] for c in candidates))
+    if not tickers:
+        return
+
+    analysis = snapshot_results(tickers)
+    pending = [t for t in tickers if t not in analysis]
+    print(f"🔄 新報告 {len(diff.rows)} 筆，其中 {len(candidates)} 筆為候選（{len(tickers)} 檔，待查價 {len(pending)} 檔）")
+    batches = [pending[i:i + SCAN_BATCH_SIZE] for i in range(0, len(pending), SCAN_BATCH_SIZE)]
+    batch_results = await asyncio.gather(
+        *(analysis_flight.do_many(batch, _analyze_batch) for batch in batches),
+        return_exceptions=True,
+    )
+    for batch, batch_result in zip(batches, batch_results):
+        if isinstance(batch_result, Exception):
+            print(f"批次查價失敗 ({len(batch)} 檔): {batch_result}")
+            continue
+        analysis.update(batch_result)
+    if not NOTIFY_NEW_REPORTS:
+        return
+
+    results = _scan_results(candidates, analysis)
+    footer = f"更新時間：{pd.Timestamp('now').tz_localize('Asia/Taipei').strftime('%Y-%m-%d %H:%M')}"
+    rendered = {}
+    for group in group_by_predicate(subs).values():
+        final_results = _select_for_group(results, group[0], growth_rows)
+        # 新報告沒有符合這組條件的就不打擾
+        if not final_results:
+            continue
+        header = f"📬 新報告：{len(final_results)} 檔符合條件\n\n"
+        text = split_message(_render_entries(final_results, rendered), header=header, footer=footer)
+        await board_cast(text, 1, chat_ids=[s.chat_id for s in group])
+
 # ----------------------------------------------------
 # 2. 新增訊息處理函式：處理用戶輸入的股票代號/名稱
 # ----------------------------------------------------
@@ -142,46 +303,48 @@ async def handle_stock_query(client: Client, message: Message, query, matched_ro
     # *** 這裡採用一個簡化方式，直接對 matched_rows 進行去重和資訊提取
     
     temp_results = []
+
+    # 同一檔股票只查價一次，並丟到執行緒池執行，避免卡住 event loop
+    # 只處理同 (代號, 券商) 日期最新的報告
+    matched_rows = matched_rows[matched_rows[LATEST_COLUMN]]
+    tickers = list(dict.fromkeys(matched_rows['股票代號']))
+    # 收盤後的分數快照有的直接使用，其餘才即時查價
+    analysis = snapshot_results(tickers)
+    live = [t for t in tickers if t not in analysis]
+    # 同一檔若已有人（或排程掃描）正在查價，直接等待那一次的結果
+    analyses = await asyncio.gather(
+        *(analysis_flight.do(t, lambda t=t: run_blocking(analyze_stock, t, consolidation_threshold=0.02))
+          for t in live),
+        return_exceptions=True,
+    )
+    analysis.update(zip(live, analyses))
     
     # 這裡需要您將 daily_job 迴圈中，獲取 MA 資訊和計算分數的邏輯複製到這裡，
     # 才能確保 r.get('MA買點分數', 0) 等鍵是存在的。
     # 由於這些函式 (get_ma_position_data, get_ma_alignment_from_data, calculate_ma_scores)
     # 不在提供的程式碼中，我們假設您會補上，這裡只寫核心邏輯。
     
-    for idx, row in matched_rows.iterrows():
+    # 欄位已在上傳時轉好型別，這裡只讀取預先計算的結果
+    for row_id, row in zip(matched_rows.index, matched_rows.to_dict("records")):
+        ticker = row['股票代號']
         try:
-            ticker = str(row['股票代號']).strip()
-            name = str(row['公司名稱']).strip()
-            broker = str(row['券商']).strip()
-            date = str(row['日期']).strip()
-            eps_24 = float(row['EPS24'])
-            eps_25 = float(row['EPS25'])
-            eps_26 = float(row['EPS26'])
-            eps_27 = float(row['EPS27'])
-            growth_25 = float(row['EPS25成長率(%)'])
-            growth_26 = float(row['EPS26成長率(%)'])
-            growth_27 = float(row['EPS27成長率(%)'])
-            target = str(row['目標價']).strip()
-            abstract = str(row['報告摘要']).strip()
-            
-            # --- 模擬 growth_values 和 valid_count 的計算 (用於顯示) ---
-            # --- 模擬 MA 資訊獲取（重要：這裡需要您確保這部分能運行） ---
-            ma_data = get_ma_position_data(ticker, period="max")
-            stock_status = get_ma_alignment_from_data(ma_data, consolidation_threshold=0.02)
-            ma_scores = calculate_ma_scores(ma_data)
+            if isinstance(analysis[ticker], Exception):
+                raise analysis[ticker]
+            ma_data, stock_status, ma_scores = analysis[ticker]
             # print(ma_data)
 
             result = {
                 "代號": ticker,
-                "名稱": name,
-                "目標價": target,
-                "EPS": [eps_24, eps_25, eps_26, eps_27],
-                "成長率": [growth_25, growth_26, growth_27],
+                "名稱": row['公司名稱'],
+                "目標價": row['目標價'],
+                "EPS": eps_values(row),
+                "成長率": [row[col] for col in GROWTH_COLUMNS],
                 "趨勢":stock_status,
                 **ma_scores,
-                "報告摘要":abstract,
-                "日期": date,
-                "券商":broker,
+                "日期": row['日期'],
+                "日期時間": row[DATE_COLUMN],
+                "券商": row['券商'],
+                "列": row_id,
             }
             temp_results.append(result)
         except Exception as e:
@@ -194,6 +357,10 @@ async def handle_stock_query(client: Client, message: Message, query, matched_ro
     # 如果您堅持單獨查詢也必須 MA買點分數 > 5，請改用 filter_and_deduplicate_results
 
     final_results = filter_and_deduplicate_results(temp_results, 0)
+    # 報告摘要不在記憶體中，只為要顯示的報告從快照檔讀出
+    summaries = await run_blocking(_report_summaries, [r["列"] for r in final_results])
+    for r in final_results:
+        r["報告摘要"] = summaries.get(r["列"], "")
 
             
     # final_query_results = [item['data'] for item in unique_latest_results.values()]
@@ -204,7 +371,8 @@ async def handle_stock_query(client: Client, message: Message, query, matched_ro
         await message.reply(f"找到關於「**{query}**」的報告，但處理後沒有有效的最新資料可顯示。")
         return
         
-    response_text = f"🔍 找到關於「{query}」的最新報告：\n\n"
+    header = f"🔍 找到關於「{query}」的最新報告：\n\n"
+    entries = []
     
     # 根據 MA 買點分數降序排序，分數高的先顯示
     # final_results.sort(key=lambda x: x.get('MA買點分數', 0), reverse=True)
@@ -216,7 +384,7 @@ async def handle_stock_query(client: Client, message: Message, query, matched_ro
         # print(r)
         BIAS = (float(r['目標價'])-float(r['現價']))/(float(r['現價']))+0.01
 
-        response_text += (f"<code>{stock_code}</code> {stock_name}\n"
+        entries.append(f"<code>{stock_code}</code> {stock_name}\n"
                           f"  ├ 現價： {r['現價']}\n"
                           f"  ├ 目標價： {r['目標價']}\n"
                           f"  ├ 潛在漲幅： {BIAS}%\n"
@@ -228,13 +396,30 @@ async def handle_stock_query(client: Client, message: Message, query, matched_ro
                           f"  └ 技術分析： <a href='{stock_link}'>點此查看 K 線</a>\n\n"
                           )
 
-    await message.reply(
-        response_text,
-        parse_mode=enums.ParseMode.HTML,
-        disable_web_page_preview=True
-    )
+    # 報告很多時依條目切成多則，避免超過 Telegram 的字數上限
+    for chunk in split_message(entries, header=header):
+        await message.reply(
+            chunk,
+            parse_mode=enums.ParseMode.HTML,
+            disable_web_page_preview=True
+        )
     logging.info(f"已回覆用戶查詢: {query}")
 
+def _report_summaries(rows):
+    """{列位置: 報告摘要}：latest_df 仍帶著摘要欄位時直接讀，否則從目前版本的快照檔讀出這幾列。"""
+    if not rows:
+        return {}
+    if SUMMARY_COLUMN in latest_df.columns:
+        return {row: str(latest_df.at[row, SUMMARY_COLUMN]).strip() for row in rows}
+    if latest_version is None:
+        return {}
+    try:
+        return dict(zip(rows, load_summaries(latest_version, rows)))
+    except Exception as e:
+        logging.error(f"讀取報告摘要失敗: {e}")
+        return {}
+
+
 def filter_and_deduplicate_results(results_list, score):
     """
     對結果列表進行去重（同股票代號+同券商只保留日期最新的一筆）
@@ -252,13 +437,17 @@ def filter_and_deduplicate_results(results_list, score):
         # 由於您在 daily_job 裡將 Excel 的 '日期' 欄位存入 r['日期']
         current_date_str = r.get('日期', '1970/01/01 00:00:00 AM')
 
-        # 嘗試將日期字串轉換為 datetime 物件進行比較
-        try:
-            # 根據您的範例日期格式 '2025/11/12 12:00:00 AM'
-            # 這裡假設 r['日期'] 已經包含了正確的日期字串
-            current_date = datetime.datetime.strptime(current_date_str, '%Y/%m/%d %I:%M:%S %p')
-        except ValueError:
-            current_date = datetime.datetime.min
+        # 上傳時已解析好的日期直接使用，沒有才現場轉換
+        current_date = r.get('日期時間')
+        if current_date is not None and not pd.isna(current_date):
+            current_date = current_date.to_pydatetime()
+        else:
+            try:
+                # 根據您的範例日期格式 '2025/11/12 12:00:00 AM'
+                # 這裡假設 r['日期'] 已經包含了正確的日期字串
+                current_date = datetime.datetime.strptime(current_date_str, '%Y/%m/%d %I:%M:%S %p')
+            except ValueError:
+                current_date = datetime.datetime.min
             
         # 檢查這個組合是否已存在，或當前的日期是否更新
         if key not in unique_results or current_date > unique_results[key]['date_obj']:
@@ -273,6 +462,63 @@ def filter_and_deduplicate_results(results_list, score):
 
 # ================== 每日定時發送通知 ==================
 async def daily_job():
+    """執行一次完整掃描；已有掃描進行中時（排程或手動）直接加入那一次，不重複掃描。"""
+    return await scan_flight.do("daily_job", _run_daily_job)
+
+
+async def _run_daily_job(resume: dict | None = None):
+    """
+    包一層計時、進度與檢查點紀錄，實際掃描在 _scan_and_notify。
+    resume 為 scan_checkpoint.interrupted() 讀回的中斷掃描，會沿用它的掃描代號與已完成的結果。
+    """
+    scan_id = resume["scan_id"] if resume else new_scan_id()
+    scan_progress.start(scan_id=scan_id)
+    start = time.perf_counter()
+    # 這次掃描期間的查價成功、重試、失敗次數（同時進行的查詢也會算進來）
+    fetch_before = fetch_guard.stats()
+    try:
+        await _scan_and_notify(scan_id, resume)
+    except Exception as e:
+        SCANS.inc(result="failed")
+        scan_progress.finish(error=e)
+        await run_blocking(scan_checkpoint.finish, scan_id, "failed")
+        raise
+    except BaseException as e:
+        # 被取消（例如程序關閉）時保留檢查點，下次啟動接續
+        SCANS.inc(result="failed")
+        scan_progress.finish(error=e)
+        raise
+    finally:
+        SCAN_SECONDS.observe(time.perf_counter() - start)
+        scan_progress.update(fetch=fetch_guard.stats_since(fetch_before))
+    SCANS.inc(result="ok")
+    scan_progress.finish()
+    await run_blocking(scan_checkpoint.finish, scan_id)
+
+
+async def resume_interrupted_scan():
+    """
+    啟動時檢查上一次是否有掃描做到一半：同一版報告表、且中斷不超過 SCAN_RESUME_MAX_HOURS 的，
+    從檢查點接續（已計分的股票不重新查價）；其餘標記為放棄，等下一次排程重新掃描。
+    """
+    try:
+        pending = await run_blocking(scan_checkpoint.interrupted)
+    except Exception as e:
+        logging.error(f"讀取掃描檢查點失敗: {e}")
+        return
+    if pending is None:
+        return
+    age = datetime.datetime.now() - pending["started_at"]
+    if pending["sheet_version"] != latest_version or age > datetime.timedelta(hours=SCAN_RESUME_MAX_HOURS):
+        print(f"⚠️ 放棄中斷的掃描 {pending['scan_id']}（報告表已更新或中斷過久）")
+        await run_blocking(scan_checkpoint.abandon_running)
+        return
+    print(f"🔄 接續中斷的掃描 {pending['scan_id']}："
+          f"已完成 {len(pending['results'])}/{len(pending['tickers'])} 檔")
+    await scan_flight.do("daily_job", lambda: _run_daily_job(resume=pending))
+
+
+async def _scan_and_notify(scan_id: str, resume: dict | None = None):
     global latest_df
     if latest_df is None or latest_df.empty:
         text = "今日通知\n目前還沒有收到 Excel 檔案，請傳給我～"
@@ -280,8 +526,6 @@ async def daily_job():
         # await app.send_message(PETER_CHAT_ID, text)
         return
 
-    results = []
-
     # 取得 Excel 全部欄位名稱（保留給你後面用）
     all_columns = latest_df.columns.tolist()
     tt = f"Excel 欄位總共 {len(all_columns)} 個：{all_columns}"
@@ -296,113 +540,471 @@ async def daily_job():
         # await app.send_message(PETER_CHAT_ID, "Excel 缺少「股票代號」或「公司名稱」欄位")
         return
     
-    for idx, row in latest_df.iterrows():
-        ticker = str(row['股票代號']).strip()
-        name   = str(row['公司名稱']).strip()
-        broker   = str(row['券商']).strip()
-        date = str(row['日期']).strip()
-        target = str(row['目標價']).strip()
-        # abstract = str(row['報告摘要']).strip()
-        # await app.send_message(MY_CHAT_ID, ticker)
-        # === 條件 1：26成長率 > 15% ===
+    # === 條件 1：26成長率 > 門檻；條件 2：EPS25/26/27成長率(%) 有填的欄位皆 > 0 ===
+    # 每位訂閱者的條件可以不同：相同的成長率條件只篩一次，取聯集後每檔股票只查價、計分一次
+    subs = subscriber_store.all()
+    candidates, growth_rows = _scan_candidates(latest_df, subs)
+
+    if resume is not None:
+        # 接續中斷的掃描：沿用檢查點中的候選清單與已完成的結果（resume_interrupted_scan 已確認報告表版本相同），
+        # 中斷後訂閱者改過條件也不會讓接續的掃描換成另一份候選清單，和已送出的條目對不上
+        candidates = resume["candidates"]
+        tickers = resume["tickers"]
+        analysis = dict(resume["results"])
+        sheet_version = resume["sheet_version"]
+    else:
+        tickers = list(dict.fromkeys(c["代號"] for c in candidates))
+        analysis = {}
+        sheet_version = latest_version
         try:
-            growth_26 = float(row['EPS26成長率(%)'])
-            if growth_26 <= 15:
-                continue
-        except:
-            continue  # 轉換失敗就跳過
-        print(ticker)
-        # # === 條件 2：EPS25成長率(%)、EPS26成長率(%)、EPS27成長率(%) 都 > 0 ===
-        growth_cols = ['EPS25成長率(%)', 'EPS26成長率(%)', 'EPS27成長率(%)']
-        growth_values = []
-        valid_count = 0
-
-        if idx % 5 == 0 and idx != 0: # 例如：每處理 10 檔股票，暫停 2 秒
-             print("--- 暫停 3 秒，避免頻繁查價被鎖定 ---")
-             time.sleep(3)
-
-        for col in growth_cols:
-            if col not in row or pd.isna(row[col]) or row[col] == '':
-                continue  # 空值直接跳過，不中斷
-            try:
-                val = float(row[col])
-                if val > 0:
-                    valid_count += 1
-                growth_values.append(val)
-            except:
-                continue
+            await run_blocking(scan_checkpoint.start, scan_id, sheet_version, candidates, tickers)
+        except Exception as e:
+            logging.error(f"掃描檢查點寫入失敗: {e}")
+
+    # 收盤後的分數快照有的直接使用，不必查價
+    analysis.update(snapshot_results([t for t in tickers if t not in analysis]))
+
+    # === 兩條件都通過，批次下載並計算 MA 位置 ===
+    # 每個批次丟到執行緒池平行執行，event loop 不會被查價卡住；已在檢查點中的股票不再查價
+    pending = [t for t in tickers if t not in analysis]
+    print(f"共 {len(candidates)} 筆通過成長率條件（{len(tickers)} 檔，待查價 {len(pending)} 檔），開始批次查價...")
+    scan_progress.update(stage="fetch", sheet_version=sheet_version, candidates=len(candidates),
+                         tickers_total=len(tickers), tickers_done=len(analysis), resumed=len(analysis))
+    batches = [pending[i:i + SCAN_BATCH_SIZE] for i in range(0, len(pending), SCAN_BATCH_SIZE)]
 
-        # 至少要有 1 個 >0 才算（你說「都>0」，但若有缺值只看有資料的）
-        # 如果你嚴格要求「有填的欄位全部必須 >0」，改成下面這行：
-        if valid_count == 0 or valid_count < len([v for v in growth_values if not pd.isna(v)]):
+    # 查價失敗的股票（不是查無資料）；有的話這次掃描不算完成，不送出「沒有股票」的總結
+    failed = set()
+
+    async def tracked_batch(batch):
+        try:
+            result = await analysis_flight.do_many(batch, _analyze_batch)
+        except Exception:
+            failed.update(batch)
+            raise
+        finally:
+            scan_progress.advance(len(batch))
+        failed.update(t for t in batch if t not in result)
+        # 每完成一批就寫入檢查點；查價失敗的不寫，接續時會再試一次
+        done = {code: r for code, r in result.items() if not pd.isna(r[0]["現價"])}
+        try:
+            await run_blocking(scan_checkpoint.save_results, scan_id, done)
+        except Exception as e:
+            logging.error(f"掃描檢查點寫入失敗: {e}")
+        return result
+
+    groups = [_GroupStream(key, group) for key, group in group_by_predicate(subs).items()]
+    scan_progress.update(subscribers=len(subs), subscriber_groups=len(groups))
+    # 每組先送出一則進度訊息，掃描結束後編輯成依分數排序的總結；
+    # 接續中斷的掃描時沿用當時的進度訊息，已送出的條目不再重送
+    streamed = resume.get("streams", {}) if resume is not None else {}
+    status_text = f"🔄 今日掃描開始：共 {len(tickers)} 檔，符合條件的股票會陸續送出"
+    for stream in groups:
+        saved = streamed.get(stream.key)
+        if saved is not None:
+            stream.status_ids = saved["status_ids"]
+            stream.sent = set(saved["sent"])
             continue
+        stream.status_ids = await board_cast_status(status_text, stream.chat_ids)
+        await _save_stream(scan_id, stream)
+
+    by_ticker = {}
+    for position, c in enumerate(candidates):
+        by_ticker.setdefault(c["代號"], []).append(c)
+        c["順位"] = position
+    # 每筆結果只排版一次，多組訂閱者共用
+    rendered = {}
+    done = 0
+    # 每批查價完成就篩選、排版；累積到 SCAN_STREAM_ENTRIES 筆或超過 SCAN_STREAM_SECONDS 就先送出
+    async for part in _stream_analysis(analysis, batches, tracked_batch):
+        done += len(part)
+        ready = [c for ticker in part for c in by_ticker.get(ticker, [])]
+        results = _scan_results(ready, part)
+        for stream in groups:
+            stream.add(_select_for_group(results, stream.sub, growth_rows))
+            if stream.due():
+                await stream.flush(rendered, f"（掃描中 {done}/{len(tickers)} 檔）")
+                await _save_stream(scan_id, stream)
+
+    scan_progress.update(stage="notify")
+    footer = f"更新時間：{pd.Timestamp('now').tz_localize('Asia/Taipei').strftime('%Y-%m-%d %H:%M')}"
+    sent = 0
+    for stream in groups:
+        await stream.flush(rendered, "")
+        await _save_stream(scan_id, stream)
+        sent += len(stream.results)
+        await board_cast_edit(stream.status_ids, stream.summary(footer, failed=len(failed)))
+
+    scan_progress.update(results=sent, fetch_failed=len(failed))
+    if failed:
+        # 價格來源中斷：檢查點標記為 failed（_run_daily_job），等下一次排程重新掃描
+        raise RuntimeError(f"{len(failed)}/{len(tickers)} 檔查價失敗，掃描未完成")
+    print(f"通知已發送，共 {len(groups)} 組條件、{len(subs)} 位訂閱者")
+
 
-        # === 兩條件都通過，開始計算 MA 位置 ===
+async def _stream_analysis(analysis, batches, tracked_batch):
+    """
+    依完成順序逐批交出 {代號: 分析結果}：先交出已有的結果（檢查點、快照），
+    其餘批次同時查價，哪一批先完成就先交出，失敗的批次略過。
+    """
+    if analysis:
+        yield dict(analysis)
+
+    async def run(batch):
         try:
-            print(f"正在分析 {ticker} {name}...")
-            ma_data = get_ma_position_data(ticker, period="max")
-            stock_status = get_ma_alignment_from_data(ma_data, consolidation_threshold=0.02)
-            ma_scores = calculate_ma_scores(ma_data)
+            return batch, await tracked_batch(batch)
+        except Exception as e:
+            return batch, e
+
+    # 與同時進行中的查詢合併：正在被查價的股票不重複下載
+    tasks = [asyncio.ensure_future(run(batch)) for batch in batches]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            batch, batch_result = await next_done
+            if isinstance(batch_result, Exception):
+                print(f"批次查價失敗 ({len(batch)} 檔): {batch_result}")
+                continue
+            yield batch_result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class _GroupStream:
+    """一組條件相同的訂閱者在一次掃描中的串流通知狀態：待送出的條目、已送出的結果與進度訊息。"""
+
+    def __init__(self, key, group):
+        # 檢查點中以條件的 repr 對應同一組訂閱者
+        self.key = repr(key)
+        self.sub = group[0]
+        self.chat_ids = [s.chat_id for s in group]
+        self.status_ids = {}
+        self.pending = []
+        self.results = []
+        # 已送出的條目鍵 (代號, 列)，接續中斷的掃描時由檢查點讀回
+        self.sent = set()
+        self.first_pending_at = None
+
+    def add(self, selected):
+        # 中斷前已送出的條目只計入總結，不再發送
+        self.results.extend(r for r in selected if _entry_key(r) in self.sent)
+        selected = [r for r in selected if _entry_key(r) not in self.sent]
+        if selected and not self.pending:
+            self.first_pending_at = time.monotonic()
+        self.pending.extend(selected)
+
+    def due(self):
+        return bool(self.pending) and (len(self.pending) >= SCAN_STREAM_ENTRIES
+                                       or time.monotonic() - self.first_pending_at >= SCAN_STREAM_SECONDS)
+
+    async def flush(self, rendered, progress):
+        if not self.pending:
+            return
+        batch = sorted(self.pending, key=_rank_key)
+        self.pending = []
+        self.results.extend(batch)
+        header = f"找到 {len(batch)} 檔位置不錯的股票{progress}\n\n"
+        # 依條目切成多則訊息，每則都在 Telegram 的字數上限內
+        await board_cast(split_message(_render_entries(batch, rendered), header=header), 1, chat_ids=self.chat_ids)
+        self.sent.update(_entry_key(r) for r in batch)
+
+    def summary(self, footer, failed=0):
+        """
+        掃描結束後的總結：全部送出的股票依 MA買點分數排序；沒有時說明條件。
+        有 failed 檔查價失敗時說明掃描未完成，不說「沒有股票」。
+        """
+        sub = self.sub
+        if failed:
+            header = (f"⚠️ 今日掃描未完成：{failed} 檔查價失敗（價格來源暫時無法連線），下次排程會重新掃描\n"
+                      f"目前已找到 {len(self.results)} 位置不錯的股票\n\n")
+            ranked = sorted(self.results, key=_rank_key)
+            lines = [f"{i}. <code>{r['代號']}</code> {r['名稱']}｜分數 {r['MA買點分數']}（{r['買點判斷']}）\n"
+                     for i, r in enumerate(ranked, 1)]
+            return split_message(lines, header=header, footer="\n" + footer)
+        if not self.results:
+            return ["今日掃描完成\n"
+                    "沒有股票同時滿足：\n"
+                    f"• MA買點分數 ≥ {sub.min_score}\n"
+                    f"• 26成長率 > {sub.min_growth_26:g}%\n"
+                    f"• EPS近三年成長率(%) 有填的欄位皆 > {sub.min_filled_growth:g}%"]
+        ranked = sorted(self.results, key=_rank_key)
+        header = f"今日掃描完成，找到 {len(ranked)} 位置不錯的股票！（依 MA買點分數排序）\n\n"
+        lines = [f"{i}. <code>{r['代號']}</code> {r['名稱']}｜分數 {r['MA買點分數']}（{r['買點判斷']}）\n"
+                 for i, r in enumerate(ranked, 1)]
+        return split_message(lines, header=header, footer="\n" + footer)
+
+
+async def _save_stream(scan_id, stream):
+    """把一組訂閱者的進度訊息與已送出的條目寫入檢查點。"""
+    try:
+        await run_blocking(scan_checkpoint.save_stream, scan_id, stream.key, stream.status_ids, stream.sent)
+    except Exception as e:
+        logging.error(f"掃描檢查點寫入失敗: {e}")
+
+
+def _entry_key(r):
+    return r["代號"], r["列"]
+
+
+def _rank_key(r):
+    # 分數高的在前，同分依候選清單的順序，與送出的先後無關
+    return -r.get('MA買點分數', 0), r.get("順位", 0)
+
+
+def _scan_candidates(df, subs):
+    """
+    依所有訂閱者的條件整理出要查價的報告列（格式同檢查點中的候選清單），
+    回傳 (候選清單, {成長率條件: 通過的列})。
+    """
+    candidate_rows, growth_rows, watch_missing = plan_candidates(df, subs)
+    candidates = []
+    for index, row in zip(candidate_rows.index, candidate_rows.to_dict("records")):
+        candidates.append({
+            "列": index,
+            "代號": row['股票代號'],
+            "名稱": row['公司名稱'],
+            "目標價": row['目標價'],
+            "26成長率": row['EPS26成長率(%)'],
+            "成長率明細": growth_values(row),
+            "日期": row['日期'],
+            "日期時間": row[DATE_COLUMN],
+            "券商": row['券商'],
+            "最新": bool(row[LATEST_COLUMN]),
+        })
+    # 有人關注、但報告表中沒有的股票，只顯示技術面
+    for code in watch_missing:
+        candidates.append({"列": None, "代號": code, "名稱": "", "目標價": "", "26成長率": np.nan, "成長率明細": [],
+                           "日期": "", "日期時間": pd.NaT, "券商": "", "最新": True})
+    return candidates, growth_rows
+
+
+async def _analyze_batch(batch):
+    failed = set()
+    results = await run_blocking(analyze_stocks_batch, batch, batch_size=SCAN_BATCH_SIZE, failed=failed)
+    # 查價失敗（斷路、連線中斷）的代號不放進結果：SingleFlight 會對這些代號回報錯誤，
+    # 呼叫端看到缺少的代號就知道是查價失敗，而不是查無資料
+    return {code: r for code, r in results.items() if code not in failed}
+
+
+def _scan_results(candidates, analysis):
+    """把每筆候選與其股票的分析結果合併，依 MA買點分數由高到低排序。"""
+    results = []
+    for c in candidates:
+        ticker = c["代號"]
+        try:
+            print(f"正在分析 {ticker} {c['名稱']}...")
+            ma_data, stock_status, ma_scores = analysis[ticker]
             result = {
-                "代號": ticker,
-                "名稱": name,
-                "目標價": target,
-                "26成長率": growth_26,
-                # "EPS成長率正向數": valid_count,
-                "成長率明細": growth_values,
+                **c,
+                "現價": ma_data["現價"],
                 "趨勢":stock_status,
                 **ma_scores,  # 展開分數與偏離度資料
-                "日期": date,
-                "券商":broker,
             }
             results.append(result)
-            print(f"加入清單：{ticker} {name}")
+            print(f"加入清單：{ticker} {c['名稱']}")
 
         except Exception as e:
             print(f"{ticker} 計算失敗: {e}")
 
+    # 依分數排序一次；各組訂閱者只需要看分數門檻以上的前段
     results.sort(key=lambda x: x.get('MA買點分數', 0), reverse=True)
-    filtered_results = [r for r in results if r.get('MA買點分數', 0) > 5]
+    return results
 
-    
-    final_results = filter_and_deduplicate_results(filtered_results,1)
-    # === 產生最終通知 ===
-    if not final_results:
-        text = ("今日掃描完成\n"
-                "沒有股票同時滿足：\n"
-                "• 26成長率 > 15%\n"
-                "• EPS近三年成長率(%) 有填的欄位皆 > 0%")
-    else:
-        text = f"找到 {len(final_results)} 位置不錯的股票！\n\n"
-        for i, r in enumerate(final_results):
-            stock_code = r['代號']
-            stock_link = f"https://tw.stock.yahoo.com/quote/{stock_code}.TW/technical-analysis"
-            text += (f"• <code>{r['代號']}</code> {r['名稱']}\n"
-                     f"  ├ 現價： {r['現價']}\n"
-                     f"  ├ 目標價：{r['目標價']}\n"
-                     f"  ├ 26成長率：{r['26成長率']:.1f}%\n"
-                     f"  ├ k線趨勢：{r['趨勢']}\n"
-                     f"  ├ D240/D60/D20 偏離度：\n{r['D240']:.2f}% / {r['D60']:.2f}% / {r['D20']:.2f}%\n"
-                     f"  ├ K線：<a href='{stock_link}'><code>{stock_code}</code> {r['名稱']}</a>\n"                     
-                     f"  └ 券商：{r['券商']}\n"
-                    )
-            
-            if i / 5 ==1: 
-                await board_cast(text,1)
-                text = ""
-                    
 
-        text += f"更新時間：{pd.Timestamp('now').tz_localize('Asia/Taipei').strftime('%Y-%m-%d %H:%M')}"
+def _select_for_group(results, sub, growth_rows):
+    """從已排序的結果中取出這組訂閱者要收到的股票（分數門檻以上、符合成長率條件或在關注清單中）。"""
+    growth = growth_rows.get(sub.growth_key(), set())
+    watch = set(sub.watchlist)
+    selected = []
+    for r in results:
+        if r.get('MA買點分數', 0) < sub.min_score:
+            break
+        if (r["代號"] in watch and r["最新"]) or (not sub.watch_only and r["列"] in growth):
+            selected.append(r)
+    return filter_and_deduplicate_results(selected, 0)
 
-    await board_cast(text,1)
 
-    print(f"通知已發送，共 {len(results)} 檔符合條件")
+def _render_entries(final_results, rendered):
+    """排版通知條目；rendered 是跨組共用的快取，每筆結果只排版一次。"""
+    entries = []
+    for r in final_results:
+        key = _entry_key(r)
+        if key not in rendered:
+            rendered[key] = _format_scan_entry(r)
+        entries.append(rendered[key])
+    return entries
+
+
+def _format_scan_entry(r):
+    stock_code = r['代號']
+    stock_link = f"https://tw.stock.yahoo.com/quote/{stock_code}.TW/technical-analysis"
+    if not r['券商']:
+        # 關注清單中沒有券商報告的股票
+        return (f"• <code>{stock_code}</code>（關注）\n"
+                f"  ├ 現價： {r['現價']}\n"
+                f"  ├ 分數： {r['MA買點分數']}（{r['買點判斷']}）\n"
+                f"  ├ k線趨勢：{r['趨勢']}\n"
+                f"  ├ D240/D60/D20 偏離度：\n{r['D240']:.2f}% / {r['D60']:.2f}% / {r['D20']:.2f}%\n"
+                f"  └ K線：<a href='{stock_link}'><code>{stock_code}</code></a>\n")
+    return (f"• <code>{r['代號']}</code> {r['名稱']}\n"
+            f"  ├ 現價： {r['現價']}\n"
+            f"  ├ 目標價：{r['目標價']}\n"
+            f"  ├ 26成長率：{r['26成長率']:.1f}%\n"
+            f"  ├ k線趨勢：{r['趨勢']}\n"
+            f"  ├ D240/D60/D20 偏離度：\n{r['D240']:.2f}% / {r['D60']:.2f}% / {r['D20']:.2f}%\n"
+            f"  ├ K線：<a href='{stock_link}'><code>{stock_code}</code> {r['名稱']}</a>\n"
+            f"  └ 券商：{r['券商']}\n")
+
+
+# ================== 收盤後分數快照 ==================
+def snapshot_results(tickers, consolidation_threshold=0.02):
+    """從分數快照取出 tickers 的分析結果；快照過期或沒有的股票不回傳，由呼叫端即時計算。"""
+    if latest_snapshot is None:
+        return {}
+    return latest_snapshot.results(tickers, consolidation_threshold=consolidation_threshold)
+
+
+async def snapshot_job():
+    """收盤後把報告表中每一檔股票算好存成快照；盤中不建立（當天的 K 棒還沒收盤）。"""
+    if latest_df is None or latest_df.empty or is_trading_hours():
+        return
+    return await scan_flight.do("snapshot", _build_snapshot)
+
+
+async def _build_snapshot():
+    global latest_snapshot
+    tickers = list(dict.fromkeys(latest_df["股票代號"]))
+    sheet_version = latest_version
+    trading_day = last_trading_session()
+    print(f"建立分數快照：{trading_day}，共 {len(tickers)} 檔")
+    start = time.perf_counter()
+    batches = [tickers[i:i + SCAN_BATCH_SIZE] for i in range(0, len(tickers), SCAN_BATCH_SIZE)]
+    frames = await asyncio.gather(
+        *(run_blocking(build_snapshot_frame, batch, batch_size=SCAN_BATCH_SIZE) for batch in batches)
+    )
+    frame = pd.concat(frames) if frames else pd.DataFrame()
+    latest_snapshot = await run_blocking(save_snapshot, frame, trading_day, sheet_version=sheet_version)
+    SNAPSHOT_BUILD_SECONDS.observe(time.perf_counter() - start)
+    print(f"✅ 分數快照 {latest_snapshot.version} 已建立，"
+          f"有資料 {int(frame['現價'].notna().sum()) if len(frame) else 0} 檔")
+
+
+def restore_latest_snapshot():
+    """啟動時讀回最後一次的分數快照（過期的仍會載入，使用時會自動改回即時計算）。"""
+    global latest_snapshot
+    try:
+        latest_snapshot = load_snapshot()
+    except Exception as e:
+        logging.error(f"讀取分數快照失敗: {e}")
+        return
+    if latest_snapshot is not None:
+        state = "有效" if latest_snapshot.is_fresh() else "已過期"
+        print(f"已載入分數快照 {latest_snapshot.version}（{latest_snapshot.trading_day}，{state}）")
+
+
+# ================== 全市場掃描 ==================
+async def universe_job():
+    """掃描上市櫃全部股票；已有全市場掃描進行中時直接加入那一次。"""
+    return await scan_flight.do("universe", _run_universe_job)
+
+
+async def _run_universe_job():
+    """以多個行程平行查價計分全部代號（見 universe_scan），通知分數最高的幾檔。"""
+    universe = await run_blocking(load_universe)
+    if universe.empty:
+        await board_cast("全市場掃描\n找不到上市櫃清單，請設定 SYMBOL_LISTING_PATH")
+        return
+    print(f"全市場掃描：共 {len(universe)} 檔，開始平行查價...")
+    frame = await run_blocking(score_universe, universe["代號"].tolist(), batch_size=SCAN_BATCH_SIZE)
+    picked = top_candidates(frame, UNIVERSE_MIN_SCORE, UNIVERSE_TOP)
+    if picked.empty:
+        await board_cast(f"全市場掃描完成（{len(frame)} 檔）\n沒有 MA買點分數 ≥ {UNIVERSE_MIN_SCORE} 的股票")
+        return
+
+    names = dict(zip(universe["代號"], universe["名稱"]))
+    header = f"全市場 {len(frame)} 檔中，找到 {len(picked)} 檔 MA買點分數 ≥ {UNIVERSE_MIN_SCORE} 的股票！\n\n"
+    entries = []
+    for code, r in zip(picked.index, picked.to_dict("records")):
+        stock_link = f"https://tw.stock.yahoo.com/quote/{code}.TW/technical-analysis"
+        entries.append(f"• <code>{code}</code> {names.get(code, '')}\n"
+                       f"  ├ 現價： {r['現價']}\n"
+                       f"  ├ 分數： {r['MA買點分數']}（{r['買點判斷']}）\n"
+                       f"  ├ k線趨勢：{r['趨勢']}\n"
+                       f"  ├ D240/D60/D20 偏離度：\n{r['D240']:.2f}% / {r['D60']:.2f}% / {r['D20']:.2f}%\n"
+                       f"  └ K線：<a href='{stock_link}'>點此查看</a>\n")
+    footer = f"更新時間：{pd.Timestamp('now').tz_localize('Asia/Taipei').strftime('%Y-%m-%d %H:%M')}"
+    await board_cast(split_message(entries, header=header, footer=footer), 1)
+
+
+# ================== 盤中監控 ==================
+async def monitor_job():
+    """
+    盤中定時執行：監控清單為目前通過成長率篩選的股票，第一次（或清單變動時）以歷史收盤價建立均線狀態，
+    之後每次只抓最新報價做 O(1) 更新，分數跨過門檻或狀態改變才通知。
+    """
+    if latest_df is None or latest_df.empty or not is_trading_hours():
+        return
+    _, tickers = select_candidates(latest_df, min_growth_26=MIN_GROWTH_26, min_filled_growth=MIN_FILLED_GROWTH)
+    missing = monitor.retain(tickers)
+    if missing:
+        closes = await run_blocking(get_closes_batch, missing, batch_size=SCAN_BATCH_SIZE)
+        monitor.seed(closes)
+        print(f"盤中監控：新增 {len(missing)} 檔，目前監控 {len(monitor.codes())} 檔")
+
+    prices = await run_blocking(get_latest_prices, monitor.codes(), batch_size=SCAN_BATCH_SIZE)
+    alerts = []
+    for code, (at, price) in prices.items():
+        alert = monitor.update(code, price, at)
+        if alert is not None:
+            alerts.append(alert)
+    if not alerts:
+        return
+
+    names = dict(zip(latest_df["股票代號"], latest_df["公司名稱"]))
+    header = f"📈 盤中提醒：{len(alerts)} 檔股票的均線位置有變化\n\n"
+    entries = [format_alert(a, names.get(a["代號"], "")) for a in alerts]
+    await board_cast(split_message(entries, header=header), 1)
 
-    
 
 # ================== 主程式啟動 ==================
+def spawn_background(coro, name):
+    """在背景執行 coro；失敗時記錄錯誤，而不是等到被回收時才默默丟掉例外。"""
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(_on_background_done)
+    return task
+
+
+def _on_background_done(task):
+    background_tasks.discard(task)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        logging.error(f"背景工作 {task.get_name()} 失敗: {error}", exc_info=error)
+
+
+def restore_latest_sheet():
+    """啟動時讀回最後一次上傳的報告表快照。"""
+    global latest_df, latest_index, latest_version
+    try:
+        restored = load_sheet(columns=SHEET_COLUMNS)
+        if restored is None:
+            print("沒有找到 Excel 快照，請上傳檔案")
+            return
+        version, raw_df = restored
+        prepared = prepare_report_sheet(raw_df)
+    except Exception as e:
+        logging.error(f"讀取 Excel 快照失敗: {e}")
+        return
+    latest_version, latest_df = version, prepared
+    latest_index = ReportIndex(latest_df)
+    print(f"已載入 Excel 快照 {latest_version}，共 {len(latest_df)} 筆資料")
+
+
 async def main():
     print("股票機器人啟動中...")
+    restore_latest_sheet()
+    restore_latest_snapshot()
     await app.start()
     print("機器人上線！可以開始傳 Excel 給我了")
 
@@ -410,9 +1012,17 @@ async def main():
     scheduler = AsyncIOScheduler(timezone="Asia/Taipei")
     scheduler.add_job(daily_job, "cron", hour=12, minute=0)
     scheduler.add_job(daily_job, "cron", hour=22, minute=0)
+    # 收盤後預先算好分數快照，之後的查詢與掃描直接讀取
+    snapshot_hour, snapshot_minute = map(int, SNAPSHOT_TIME.split(":"))
+    scheduler.add_job(snapshot_job, "cron", day_of_week="mon-fri", hour=snapshot_hour, minute=snapshot_minute)
     scheduler.start()
 
-    print("排程已啟動：每天 12:00 和 22:00 發送通知")
+    print(f"排程已啟動：每天 12:00 和 22:00 發送通知，平日 {SNAPSHOT_TIME} 建立分數快照")
+    # 上次在掃描途中重啟的話，從檢查點接續
+    spawn_background(resume_interrupted_scan(), "resume_interrupted_scan")
+    if MONITOR_INTERVAL > 0:
+        scheduler.add_job(monitor_job, "interval", seconds=MONITOR_INTERVAL, max_instances=1, coalesce=True)
+        print(f"盤中監控已啟動：每 {MONITOR_INTERVAL} 秒更新一次")
     # 保持運行
     await asyncio.gather(
         run_web(),       # 啟動 Web 服務並監聽 Port
@@ -0,0 +1,201 @@
+import time
+import bisect
+import threading
+import contextlib
+import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """只會增加的計數器。"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}_total{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """累積分布的直方圖，用來記錄耗時。"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """以 with 區塊量測耗時。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._key(labels), []))
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key in sorted(self._counts):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), self._counts[key]):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {self._sums[key]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """輸出 Prometheus text exposition format。"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# ================== 各階段的指標 ==================
+FETCH_SECONDS = histogram("stock_fetch_seconds", "查價耗時（single 為每檔，batch 與 latest 為每次請求）", ["mode"])
+FETCH_TICKERS = counter("stock_fetch_tickers", "查價的股票檔數", ["mode"])
+FETCH_SUFFIX_FALLBACK = counter("stock_fetch_suffix_fallback", "第一個後綴查不到、改試另一個市場的次數")
+FETCH_EMPTY = counter("stock_fetch_empty", "兩個市場都查不到資料的次數")
+FETCH_ERRORS = counter("stock_fetch_errors", "查價請求拋出例外的次數", ["mode"])
+FETCH_ATTEMPTS = counter("stock_fetch_attempts", "經過 fetch_guard 的查價請求結果（ok / retry / throttled / failed / rejected）", ["result"])
+FETCH_BREAKER_OPEN = counter("stock_fetch_breaker_open", "價格來源連續失敗而斷路的次數")
+INDICATOR_SECONDS = histogram("indicator_compute_seconds", "均線、排列與分數計算耗時", ["mode"])
+EXCEL_INGEST_SECONDS = histogram("excel_ingest_seconds", "Excel 讀取與預先計算耗時")
+EXCEL_INGEST_ROWS = counter("excel_ingest_rows", "讀入的 Excel 筆數")
+QUERY_SECONDS = histogram("query_seconds", "使用者查詢的處理耗時")
+QUERIES = counter("queries", "使用者查詢次數", ["result"])
+BROADCAST_SEND_SECONDS = histogram("broadcast_send_seconds", "單則 Telegram 訊息的發送耗時")
+BROADCAST_MESSAGES = counter("broadcast_messages", "發送的 Telegram 訊息數", ["result"])
+BROADCAST_FLOODWAIT = counter("broadcast_floodwait", "遇到 FloodWait 的次數")
+SNAPSHOT_BUILD_SECONDS = histogram("score_snapshot_build_seconds", "收盤後分數快照的建立耗時")
+SNAPSHOT_LOOKUPS = counter("score_snapshot_lookups", "從分數快照取結果的檔數（hit / miss / stale）", ["result"])
+SCAN_SECONDS = histogram("scan_seconds", "daily_job 整體耗時")
+SCANS = counter("scans", "daily_job 執行次數", ["result"])
+
+
+# ================== 掃描進度 ==================
+class ScanProgress:
+    """記錄目前（或上一次）daily_job 的進度，提供 /status 使用。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {"state": "idle"}
+
+    def start(self, scan_id: Optional[str] = None) -> None:
+        with self._lock:
+            self._state = {
+                "state": "running",
+                "scan_id": scan_id,
+                "stage": "starting",
+                "started_at": datetime.datetime.now().astimezone().isoformat(),
+                "finished_at": None,
+                "candidates": 0,
+                "tickers_total": 0,
+                "tickers_done": 0,
+                "results": 0,
+                "error": None,
+            }
+
+    def update(self, **fields) -> None:
+        with self._lock:
+            self._state.update(fields)
+
+    def advance(self, tickers: int) -> None:
+        with self._lock:
+            self._state["tickers_done"] = self._state.get("tickers_done", 0) + tickers
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._state["state"] = "failed" if error else "finished"
+            self._state["stage"] = "done"
+            self._state["finished_at"] = datetime.datetime.now().astimezone().isoformat()
+            self._state["error"] = repr(error) if error else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = dict(self._state)
+        total = snapshot.get("tickers_total") or 0
+        if total:
+            snapshot["progress"] = round(snapshot.get("tickers_done", 0) / total, 4)
+        return snapshot
+
+
+scan_progress = ScanProgress()
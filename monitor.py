@@ -0,0 +1,259 @@
+"""
+盤中監控：每檔股票保留最近 239 根已收盤 K 棒的滾動和，新報價進來時 O(1) 更新 MA5–MA240，
+重新判斷排列與買點分數，只有跨過分數門檻或狀態改變時才發出提醒。
+
+可用本地的逐筆報價 CSV（欄位：時間, 股票代號, 價格）重播測試：
+
+    python monitor.py ticks.csv                     # 以本地價格庫的歷史建立初始狀態
+    python monitor.py ticks.csv --speed 60          # 依報價時間以 60 倍速重播
+"""
+import os
+import bisect
+import asyncio
+import argparse
+import inspect
+import datetime
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from get_stock_position import calculate_ma_scores, get_ma_alignment_from_data
+from ma_engine import MA_PERIODS
+
+# 盤中監控的輪詢間隔（秒），0 代表不啟用
+MONITOR_INTERVAL = int(os.getenv("MONITOR_INTERVAL", "0"))
+# 分數跨過這些門檻時提醒（預設與 買點判斷 的 潛力觀察 / 強勁買點 一致）
+MONITOR_SCORE_LEVELS = [float(x) for x in os.getenv("MONITOR_SCORE_LEVELS", "5,8").split(",") if x.strip()]
+# 每累積這麼多根收盤 K 棒就從緩衝區重新加總一次，避免滾動加減的浮點誤差累積
+RESYNC_BARS = 240
+
+
+class StreamingMA:
+    """
+    單檔股票的滾動均線狀態。
+
+    最新一根（盤中尚未收盤）K 棒的價格隨報價變動，其餘為已收盤 K 棒；
+    sums[n] 保存最近 n-1 根已收盤 K 棒的和，所以 MA_n = (sums[n] + 最新價) / n，每次報價只需 O(1)。
+    收盤 K 棒進來時，每個週期加上新值、減掉滑出視窗的舊值，同樣是 O(1)。
+    """
+
+    def __init__(self, periods: Sequence[int] = MA_PERIODS):
+        self.periods = list(periods)
+        self.closed: deque = deque(maxlen=max(self.periods) - 1)
+        self.sums: Dict[int, float] = {n: 0.0 for n in self.periods}
+        self._since_resync = 0
+
+    def seed(self, closes: Iterable[float]) -> None:
+        """以歷史收盤價（由舊到新，不含最新一根）建立初始狀態。"""
+        self.closed.clear()
+        self.closed.extend(float(c) for c in closes)
+        self.resync()
+
+    def resync(self) -> None:
+        history = list(self.closed)
+        for n in self.periods:
+            self.sums[n] = float(sum(history[max(0, len(history) - (n - 1)):])) if n > 1 else 0.0
+        self._since_resync = 0
+
+    def commit(self, close: float) -> None:
+        """一根 K 棒收盤，移入已收盤的視窗。"""
+        size = len(self.closed)
+        for n in self.periods:
+            if n == 1:
+                continue
+            self.sums[n] += close
+            if size >= n - 1:
+                self.sums[n] -= self.closed[size - (n - 1)]
+        self.closed.append(close)
+        self._since_resync += 1
+        if self._since_resync >= RESYNC_BARS:
+            self.resync()
+
+    def values(self, price: float) -> Dict[int, float]:
+        """以 price 作為最新一根 K 棒的收盤價，回傳各期 MA（K 棒不足的為 NaN）。"""
+        count = len(self.closed) + 1
+        return {n: (self.sums[n] + price) / n if count >= n else np.nan for n in self.periods}
+
+
+class TickerState:
+    """單檔股票的監控狀態：滾動均線、目前這根 K 棒的日期與價格，以及上一次的評估結果。"""
+
+    def __init__(self, code: str, consolidation_threshold: float = 0.02):
+        self.code = code
+        self.consolidation_threshold = consolidation_threshold
+        self.ma = StreamingMA()
+        self.bar_date: Optional[datetime.date] = None
+        self.price = np.nan
+        self.evaluation: Optional[Dict[str, Any]] = None
+
+    def seed(self, closes: pd.Series) -> None:
+        """以歷史收盤價建立狀態；最後一根視為目前這根 K 棒，同一天的報價會覆蓋它。"""
+        closes = closes.dropna()
+        if closes.empty:
+            return
+        self.ma.seed(closes.to_numpy(dtype=float)[:-1])
+        self.bar_date = pd.Timestamp(closes.index[-1]).date()
+        self.price = float(closes.iloc[-1])
+        self.evaluation = self.evaluate()
+
+    def on_price(self, price: float, at: datetime.datetime) -> Dict[str, Any]:
+        """收到一筆報價：換日時先把上一根 K 棒收盤，再以新價格重新評估。"""
+        day = pd.Timestamp(at).date()
+        if self.bar_date is not None and day > self.bar_date and not pd.isna(self.price):
+            self.ma.commit(self.price)
+        if self.bar_date is None or day >= self.bar_date:
+            self.bar_date = day
+            self.price = float(price)
+        self.evaluation = self.evaluate()
+        return self.evaluation
+
+    def evaluate(self) -> Dict[str, Any]:
+        """以目前價格與滾動均線，套用與排程掃描相同的排列與計分規則。"""
+        ma_data: Dict[str, Any] = {"股票代號": self.code, "現價": self.price}
+        for n, value in self.ma.values(self.price).items():
+            ma_data[f"MA{n}"] = round(value, 2)
+        status = get_ma_alignment_from_data(ma_data, consolidation_threshold=self.consolidation_threshold)
+        scores = calculate_ma_scores(ma_data)
+        return {"ma_data": ma_data, "趨勢": status, **scores}
+
+
+def score_band(score: float, levels: Sequence[float] = MONITOR_SCORE_LEVELS) -> int:
+    """分數落在第幾個門檻區間。"""
+    return bisect.bisect_right(sorted(levels), score)
+
+
+class Monitor:
+    """一組監控中的股票；update 只在分數跨過門檻、買點判斷或排列狀態改變時回傳提醒。"""
+
+    def __init__(self, consolidation_threshold: float = 0.02, levels: Sequence[float] = MONITOR_SCORE_LEVELS):
+        self.consolidation_threshold = consolidation_threshold
+        self.levels = sorted(levels)
+        self.states: Dict[str, TickerState] = {}
+
+    def codes(self) -> List[str]:
+        return list(self.states)
+
+    def seed(self, closes: Dict[str, pd.Series]) -> None:
+        """以 {代號: 歷史收盤價} 建立（或重建）各檔的狀態，沒有資料的略過。"""
+        for code, series in closes.items():
+            state = TickerState(code, self.consolidation_threshold)
+            state.seed(series)
+            if state.evaluation is not None:
+                self.states[code] = state
+
+    def retain(self, codes: Iterable[str]) -> List[str]:
+        """只保留 codes 中的股票，回傳尚未建立狀態、需要 seed 的代號。"""
+        wanted = list(dict.fromkeys(codes))
+        for code in list(self.states):
+            if code not in wanted:
+                del self.states[code]
+        return [code for code in wanted if code not in self.states]
+
+    def update(self, code: str, price: float, at: datetime.datetime) -> Optional[Dict[str, Any]]:
+        state = self.states.get(code)
+        if state is None or pd.isna(price):
+            return None
+        before = state.evaluation
+        after = state.on_price(price, at)
+        if before is None:
+            return None
+
+        changes = []
+        old_band = score_band(before["MA買點分數"], self.levels)
+        new_band = score_band(after["MA買點分數"], self.levels)
+        if old_band != new_band:
+            changes.append("分數" + ("升破" if new_band > old_band else "跌破") + "門檻")
+        if before["買點判斷"] != after["買點判斷"]:
+            changes.append("買點判斷")
+        if before["趨勢"] != after["趨勢"]:
+            changes.append("趨勢")
+        if not changes:
+            return None
+        return {"代號": code, "時間": pd.Timestamp(at), "變化": changes, "前": before, "後": after}
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {code: state.evaluation for code, state in self.states.items()}
+
+
+def format_alert(alert: Dict[str, Any], name: str = "") -> str:
+    before, after = alert["前"], alert["後"]
+    code = alert["代號"]
+    stock_link = f"https://tw.stock.yahoo.com/quote/{code}.TW/technical-analysis"
+    title = f"{name} " if name else ""
+    return (f"• <code>{code}</code> {title}{'、'.join(alert['變化'])}（{alert['時間']:%H:%M}）\n"
+            f"  ├ 現價： {after['現價']}\n"
+            f"  ├ 分數： {before['MA買點分數']} → {after['MA買點分數']}\n"
+            f"  ├ 買點判斷： {before['買點判斷']} → {after['買點判斷']}\n"
+            f"  ├ k線趨勢： {before['趨勢']} → {after['趨勢']}\n"
+            f"  └ K線：<a href='{stock_link}'>點此查看</a>\n")
+
+
+# ================== 報價來源 ==================
+Tick = Tuple[pd.Timestamp, str, float]
+
+
+def load_tick_feed(path: str) -> List[Tick]:
+    """讀取本地的逐筆報價 CSV（欄位：時間, 股票代號, 價格），依時間排序。"""
+    feed = pd.read_csv(path, dtype={"股票代號": str})
+    feed["時間"] = pd.to_datetime(feed["時間"])
+    feed = feed.sort_values("時間", kind="stable")
+    return list(zip(feed["時間"], feed["股票代號"].str.strip(), feed["價格"].astype(float)))
+
+
+async def replay(monitor: Monitor, ticks: Iterable[Tick],
+                 on_alert: Callable[[Dict[str, Any]], Union[None, Awaitable[None]]], speed: float = 0.0) -> int:
+    """
+    依序把報價餵給 monitor，有提醒時呼叫 on_alert（可為 async 函式）。
+    speed > 0 時依報價之間的時間差以 speed 倍速等待，0 則不等待。回傳提醒數。
+    """
+    alerts = 0
+    previous: Optional[pd.Timestamp] = None
+    for at, code, price in ticks:
+        if speed > 0 and previous is not None and at > previous:
+            await asyncio.sleep((at - previous).total_seconds() / speed)
+        previous = at
+        alert = monitor.update(code, price, at)
+        if alert is None:
+            continue
+        alerts += 1
+        result = on_alert(alert)
+        if inspect.isawaitable(result):
+            await result
+    return alerts
+
+
+def _seed_from_store(monitor: Monitor, codes: List[str], db_path: str) -> None:
+    from price_store import SUFFIXES, PriceStore
+    store = PriceStore(db_path)
+    try:
+        closes = {}
+        for code in codes:
+            entry = store.get_symbol(code)
+            suffixes = [entry[0]] if entry is not None and entry[0] else SUFFIXES
+            for suffix in suffixes:
+                series = store.load(code + suffix, tail=max(MA_PERIODS))["Close"]
+                if not series.empty:
+                    closes[code] = series
+                    break
+        monitor.seed(closes)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    from price_store import DEFAULT_DB_PATH
+
+    parser = argparse.ArgumentParser(description="以本地逐筆報價重播盤中監控")
+    parser.add_argument("feed", help="逐筆報價 CSV（欄位：時間, 股票代號, 價格）")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="用來建立初始狀態的本地價格庫")
+    parser.add_argument("--speed", type=float, default=0.0, help="重播倍速，0 代表不等待")
+    args = parser.parse_args()
+
+    ticks = load_tick_feed(args.feed)
+    monitor = Monitor()
+    _seed_from_store(monitor, list(dict.fromkeys(code for _, code, _ in ticks)), args.db)
+    print(f"監控 {len(monitor.codes())} 檔，共 {len(ticks)} 筆報價")
+    count = asyncio.run(replay(monitor, ticks, lambda alert: print(format_alert(alert)), speed=args.speed))
+    print(f"重播完成，共 {count} 則提醒")
@@ -0,0 +1,328 @@
+import os
+import sqlite3
+import threading
+import pandas as pd
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 預設存放位置，可用環境變數 PRICE_DB_PATH 覆寫（Render 上可指向 persistent disk）
+DEFAULT_DB_PATH = os.getenv("PRICE_DB_PATH", os.path.join("data", "prices.sqlite"))
+
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# 判斷還原權值是否變動的容許誤差（相對誤差）
+ADJUSTMENT_TOLERANCE = 1e-4
+
+SUFFIXES = [".TW", ".TWO"]
+
+# 已解析的後綴，若最新 K 棒超過這麼多天沒更新，代表可能已轉上市櫃或下市，需要重新解析
+SUFFIX_STALE_DAYS = int(os.getenv("SUFFIX_STALE_DAYS", "14"))
+# 兩種後綴都抓不到的代號，隔多久才再試一次
+SUFFIX_RETRY_DAYS = int(os.getenv("SUFFIX_RETRY_DAYS", "1"))
+
+
+class PriceStore:
+    """
+    以 SQLite 保存每檔股票的日 K（OHLCV），讓後續查價只需要補抓最新幾根 K 棒。
+
+    資料表以 (ticker, date) 為主鍵，重複寫入同一天會覆蓋，
+    因此盤中抓到的未收盤 K 棒在下一次同步時會被正式收盤價取代。
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # 全市場掃描時多個行程會同時寫入：WAL 讓讀寫不互相阻擋，寫入衝突時等待而不是立刻失敗
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS prices (
+                ticker TEXT NOT NULL,
+                date   TEXT NOT NULL,
+                open   REAL,
+                high   REAL,
+                low    REAL,
+                close  REAL,
+                volume REAL,
+                PRIMARY KEY (ticker, date)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS symbols (
+                code        TEXT PRIMARY KEY,
+                suffix      TEXT,
+                resolved_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_symbol(self, code: str) -> Optional[Tuple[Optional[str], pd.Timestamp]]:
+        """回傳 (後綴, 解析時間)；後綴為 None 代表兩個市場都查不到，沒有紀錄則回傳 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT suffix, resolved_at FROM symbols WHERE code = ?", (code,)).fetchone()
+        if row is None:
+            return None
+        return row[0], pd.Timestamp(row[1])
+
+    def set_symbols(self, mapping: Dict[str, Optional[str]]) -> None:
+        """批次寫入 {代號: 後綴} 對照，後綴為 None 表示目前無法解析。"""
+        now = pd.Timestamp.now().isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO symbols VALUES (?, ?, ?)",
+                [(code, suffix, now) for code, suffix in mapping.items()],
+            )
+            self._conn.commit()
+
+    def resolved_codes(self) -> List[str]:
+        """對照表中已解析出市場的所有代號。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT code FROM symbols WHERE suffix IS NOT NULL ORDER BY code").fetchall()
+        return [r[0] for r in rows]
+
+    def suffix_order(self, code: str) -> List[str]:
+        """
+        依對照表決定這個代號要嘗試的後綴順序：
+        已解析的後綴排第一（另一個只在資料過期時才會用到），
+        未解析過的依 .TW → .TWO，近期確認查不到的回傳空列表。
+        """
+        entry = self.get_symbol(code)
+        if entry is None:
+            return list(SUFFIXES)
+        suffix, resolved_at = entry
+        if suffix is None:
+            if pd.Timestamp.now() - resolved_at < pd.Timedelta(days=SUFFIX_RETRY_DAYS):
+                return []
+            return list(SUFFIXES)
+        return [suffix] + [s for s in SUFFIXES if s != suffix]
+
+    def last_dates(self, ticker: str, n: int = 2) -> List[pd.Timestamp]:
+        """回傳該 ticker 最新的 n 個交易日（由舊到新），沒有資料時為空列表。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date FROM prices WHERE ticker = ? ORDER BY date DESC LIMIT ?", (ticker, n)
+            ).fetchall()
+        return [pd.Timestamp(r[0]) for r in reversed(rows)]
+
+    def load(self, ticker: str, tail: Optional[int] = None) -> pd.DataFrame:
+        """讀取本地 K 線，tail 指定時只讀最新的 tail 根。"""
+        query = "SELECT date, open, high, low, close, volume FROM prices WHERE ticker = ? ORDER BY date DESC"
+        params: tuple = (ticker,)
+        if tail is not None:
+            query += " LIMIT ?"
+            params = (ticker, int(tail))
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        df = pd.DataFrame(rows[::-1], columns=["Date"] + OHLCV_COLUMNS)
+        df["Date"] = pd.to_datetime(df["Date"], format="%Y-%m-%d")
+        return df.set_index("Date")
+
+    def tickers(self) -> List[str]:
+        """本地價格庫中有資料的所有 ticker。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT ticker FROM prices ORDER BY ticker").fetchall()
+        return [r[0] for r in rows]
+
+    def close_matrix(self, tickers: Optional[List[str]] = None) -> pd.DataFrame:
+        """一次讀出多檔的收盤價，回傳 日期 × ticker 的矩陣（預設為全部 ticker），供回測使用。"""
+        query = "SELECT ticker, date, close FROM prices"
+        params: tuple = ()
+        if tickers is not None:
+            if not tickers:
+                return pd.DataFrame(dtype=float)
+            query += f" WHERE ticker IN ({','.join('?' * len(tickers))})"
+            params = tuple(tickers)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        df = pd.DataFrame(rows, columns=["ticker", "Date", "Close"])
+        df["Date"] = pd.to_datetime(df["Date"], format="%Y-%m-%d")
+        matrix = df.pivot(index="Date", columns="ticker", values="Close").sort_index()
+        matrix.columns.name = None
+        return matrix
+
+    def upsert(self, ticker: str, df: pd.DataFrame, replace: bool = False) -> int:
+        """寫入（或覆蓋）K 線；replace=True 時先清掉該 ticker 的舊資料。回傳寫入筆數。"""
+        df = _normalize_ohlcv(df)
+        # 整欄一次轉成 Python 數值；SQLite 會把 NaN 存成 NULL，不必逐格判斷
+        columns = [df[col].to_numpy(dtype=float).tolist() for col in OHLCV_COLUMNS]
+        dates = df.index.strftime("%Y-%m-%d").tolist()
+        records = list(zip([ticker] * len(dates), dates, *columns))
+        with self._lock:
+            if replace:
+                self._conn.execute("DELETE FROM prices WHERE ticker = ?", (ticker,))
+            self._conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+            self._conn.commit()
+        return len(records)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _normalize_ohlcv(df: pd.DataFrame) -> pd.DataFrame:
+    """把 yf.download 的結果整理成單層欄位的 OHLCV，並去掉沒有收盤價的列。"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=OHLCV_COLUMNS)
+    if isinstance(df.columns, pd.MultiIndex):
+        # 單檔下載時新版 yfinance 仍會回傳 (Price, Ticker) 兩層欄位
+        df = df.copy()
+        df.columns = df.columns.get_level_values(0)
+    df = df.reindex(columns=OHLCV_COLUMNS)
+    index = df.index if isinstance(df.index, pd.DatetimeIndex) else pd.to_datetime(df.index)
+    df.index = index.tz_localize(None) if index.tz is not None else index
+    return df.dropna(subset=["Close"])
+
+
+def _adjustment_changed(store: PriceStore, ticker: str, check_date: pd.Timestamp, fresh: pd.DataFrame) -> bool:
+    """比對重疊那一根 K 棒的收盤價；不一致代表除權息後還原價已整段改寫，需要全量重抓。"""
+    stored = store.load(ticker, tail=2)
+    if check_date not in stored.index or check_date not in fresh.index:
+        return False
+    old = stored.at[check_date, "Close"]
+    new = fresh.at[check_date, "Close"]
+    if pd.isna(old) or pd.isna(new) or old == 0:
+        return False
+    return abs(new - old) / abs(old) > ADJUSTMENT_TOLERANCE
+
+
+def sync_history(store: PriceStore, ticker: str, download: Callable[..., pd.DataFrame],
+                 period: str = "max", **download_kwargs) -> bool:
+    """
+    同步單一 ticker 的本地 K 線：第一次抓完整歷史，之後只補抓最後儲存日期之後的 K 棒。
+
+    補抓時會從倒數第二根已儲存的日期開始請求，一方面覆蓋可能是盤中價的最後一根，
+    另一方面用倒數第二根（已收盤）檢查還原權值是否變動。
+    回傳本地是否有這檔的資料。
+    """
+    known = store.last_dates(ticker, n=2)
+    if not known:
+        df = _normalize_ohlcv(download(ticker, period=period, **download_kwargs))
+        if df.empty:
+            return False
+        store.upsert(ticker, df, replace=True)
+        return True
+
+    check_date = known[0]
+    try:
+        df = _normalize_ohlcv(download(ticker, start=check_date.strftime("%Y-%m-%d"), **download_kwargs))
+    except Exception as e:
+        # 補抓失敗時沿用本地資料，不影響後續計算
+        print(f"⚠️ {ticker} 增量更新失敗，沿用本地資料: {e}")
+        return True
+    if df.empty:
+        return True
+    if _adjustment_changed(store, ticker, check_date, df):
+        _resync_full(store, ticker, download, period, **download_kwargs)
+        return True
+    store.upsert(ticker, df)
+    return True
+
+
+def _resync_full(store: PriceStore, ticker: str, download: Callable[..., pd.DataFrame], period: str,
+                 **download_kwargs) -> None:
+    """還原權值變動後全量重抓；失敗時保留本地資料，等下次同步再檢查。"""
+    try:
+        full = _normalize_ohlcv(download(ticker, period=period, **download_kwargs))
+    except Exception as e:
+        print(f"⚠️ {ticker} 還原權值變動，全量重抓失敗，沿用本地資料: {e}")
+        return
+    if not full.empty:
+        store.upsert(ticker, full, replace=True)
+
+
+def sync_history_batch(store: PriceStore, tickers: List[str], download: Callable[..., pd.DataFrame],
+                       period: str = "max", **download_kwargs) -> Dict[str, Optional[bool]]:
+    """
+    多檔版的 sync_history：沒有本地資料的 ticker 一起抓完整歷史，
+    已有資料的 ticker 一起從最早的補抓起點請求，兩種情況各只發一次請求。
+    回傳 {ticker: 本地是否有資料}；沒有本地資料且下載失敗的 ticker 為 None（不是查無資料）。
+    已有本地資料的 ticker 在補抓或全量重抓失敗時沿用本地資料，不受其他 ticker 影響。
+    """
+    fresh, stale = [], []
+    check_dates: Dict[str, pd.Timestamp] = {}
+    for ticker in tickers:
+        known = store.last_dates(ticker, n=2)
+        if known:
+            stale.append(ticker)
+            check_dates[ticker] = known[0]
+        else:
+            fresh.append(ticker)
+
+    available: Dict[str, Optional[bool]] = {}
+    if fresh:
+        try:
+            df = download(fresh, period=period, group_by="ticker", **download_kwargs)
+        except Exception as e:
+            print(f"⚠️ 批次下載新股票失敗 ({len(fresh)} 檔): {e}")
+            available.update({ticker: None for ticker in fresh})
+            fresh = []
+        for ticker in fresh:
+            part = split_ticker(df, ticker, single=len(fresh) == 1)
+            if part.empty:
+                available[ticker] = False
+                continue
+            store.upsert(ticker, part, replace=True)
+            available[ticker] = True
+
+    if stale:
+        start = min(check_dates.values()).strftime("%Y-%m-%d")
+        try:
+            df = download(stale, start=start, group_by="ticker", **download_kwargs)
+        except Exception as e:
+            print(f"⚠️ 批次增量更新失敗 ({len(stale)} 檔)，沿用本地資料: {e}")
+            df = None
+        for ticker in stale:
+            available[ticker] = True
+            part = split_ticker(df, ticker, single=len(stale) == 1)
+            if part.empty:
+                continue
+            if _adjustment_changed(store, ticker, check_dates[ticker], part):
+                _resync_full(store, ticker, download, period, **download_kwargs)
+                continue
+            store.upsert(ticker, part)
+
+    return available
+
+
+def split_ticker(df: pd.DataFrame, ticker: str, single: bool) -> pd.DataFrame:
+    """從多檔下載結果中切出單一 ticker 的 OHLCV。"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=OHLCV_COLUMNS)
+    if isinstance(df.columns, pd.MultiIndex):
+        if ticker in df.columns.get_level_values(0):
+            return _normalize_ohlcv(df[ticker])
+        if ticker in df.columns.get_level_values(-1):
+            return _normalize_ohlcv(df.xs(ticker, axis=1, level=-1))
+        return pd.DataFrame(columns=OHLCV_COLUMNS)
+    if single:
+        return _normalize_ohlcv(df)
+    return pd.DataFrame(columns=OHLCV_COLUMNS)
+
+
+def is_stale(close: pd.Series, stale_days: int = SUFFIX_STALE_DAYS) -> bool:
+    """最新 K 棒是否已經超過 stale_days 天沒有更新。"""
+    if close.empty:
+        return True
+    return pd.Timestamp(close.index[-1]) < pd.Timestamp.now().normalize() - pd.Timedelta(days=stale_days)
+
+
+def load_symbol_listing(store: PriceStore, path: str) -> int:
+    """
+    用上市櫃清單預先建立後綴對照表，CSV 需有「代號」與「市場」兩欄，
+    市場可填 上市/上櫃、TW/TWO 或 .TW/.TWO。回傳寫入筆數。
+    """
+    listing = pd.read_csv(path, dtype=str)
+    market_map = {"上市": ".TW", "TW": ".TW", ".TW": ".TW", "上櫃": ".TWO", "TWO": ".TWO", ".TWO": ".TWO"}
+    mapping = {}
+    for code, market in zip(listing["代號"], listing["市場"]):
+        suffix = market_map.get(str(market).strip().upper())
+        if suffix and isinstance(code, str) and code.strip():
+            mapping[code.strip()] = suffix
+    store.set_symbols(mapping)
+    return len(mapping)
@@ -0,0 +1,164 @@
+import time
+import asyncio
+import threading
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    非同步 token bucket：平均每秒最多 rate 次，可瞬間消耗 capacity 次。
+    多個協程共用同一個 bucket 時，會依序排隊取得 token。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """暫停發放 token（例如收到 FloodWait 時，讓所有共用者一起等待）。"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """等到有足夠的 token 才返回。"""
+        async with self._lock:
+            while True:
+                paused = self._paused_until - time.monotonic()
+                if paused > 0:
+                    await asyncio.sleep(paused)
+                    continue
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class AdaptiveRateLimiter:
+    """
+    執行緒安全（阻塞式）的 token bucket，給在執行緒池中跑的查價使用。
+    速率依每次請求的結果調整（AIMD）：正常且延遲低於 target_latency 時每次加 increase，
+    延遲過高時降為 slow_factor 倍，被限流時降為 throttle_factor 倍，範圍在 [min_rate, max_rate]。
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, target_latency: float,
+                 capacity: Optional[float] = None, increase: float = 0.1,
+                 slow_factor: float = 0.8, throttle_factor: float = 0.5):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.target_latency = float(target_latency)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.increase = increase
+        self.slow_factor = slow_factor
+        self.throttle_factor = throttle_factor
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """暫停發放 token（例如供應商要求等待時，讓所有執行緒一起等）。"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """等到有足夠的 token 才返回，回傳等待的秒數。"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return waited
+                    wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def record(self, latency: float, throttled: bool = False) -> None:
+        """回報一次請求的延遲與是否被限流，據此調整速率。"""
+        with self._lock:
+            if throttled:
+                self.rate = max(self.min_rate, self.rate * self.throttle_factor)
+            elif latency > self.target_latency:
+                self.rate = max(self.min_rate, self.rate * self.slow_factor)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class CircuitBreaker:
+    """
+    連續失敗 failure_threshold 次後斷路（open），cooldown 秒內 allow() 一律回傳 False，呼叫端直接放棄、不佔住執行緒；
+    cooldown 結束後進入 half_open，只放行一個呼叫端試探（其他呼叫端仍被拒絕），
+    試探成功即恢復（closed），失敗則重新斷路、cooldown 加倍（上限 max_cooldown）。
+    """
+
+    def __init__(self, failure_threshold: int, cooldown: float, max_cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = float(cooldown)
+        self.max_cooldown = float(max_cooldown)
+        self.cooldown = float(cooldown)
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """這次呼叫可否送出；half_open 時只有取得試探權的呼叫端會得到 True。"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() < self._open_until:
+                    return False
+                self.state = "half_open"
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self) -> float:
+        """距離可以試探還有幾秒。"""
+        with self._lock:
+            return max(self._open_until - time.monotonic(), 0.0) if self.state == "open" else 0.0
+
+    def release(self) -> None:
+        """試探的呼叫以無關供應商狀態的錯誤結束時交還試探權，讓下一個呼叫端試探。"""
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """記錄一次失敗，這次失敗造成斷路時回傳 True。"""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open":
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._probing = False
+            elif self.state == "open" or self.failures < self.failure_threshold:
+                return False
+            self.state = "open"
+            self.opened += 1
+            self._open_until = time.monotonic() + self.cooldown
+            return True
@@ -0,0 +1,501 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from pandas.api.types import union_categoricals
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from version_manifest import find_version, new_version, read_manifest, register_version
+
+# 上傳過的報告表存放位置（Render 上可指向 persistent disk）
+SHEET_DIR = os.getenv("SHEET_DIR", os.path.join("data", "sheets"))
+# 最多保留幾個歷史版本
+SHEET_HISTORY_LIMIT = int(os.getenv("SHEET_HISTORY_LIMIT", "30"))
+# 上傳時每次轉換、寫入的列數（一次只有這麼多列的原始值在記憶體中）
+SHEET_CHUNK_ROWS = int(os.getenv("SHEET_CHUNK_ROWS", "5000"))
+
+EPS_COLUMNS = ["EPS24", "EPS25", "EPS26", "EPS27"]
+GROWTH_COLUMNS = ["EPS25成長率(%)", "EPS26成長率(%)", "EPS27成長率(%)"]
+REQUIRED_COLUMNS = ["股票代號", "公司名稱"]
+TEXT_COLUMNS = ["股票代號", "公司名稱", "券商", "日期", "目標價"]
+# 重複值很多的文字欄位以 category 保存
+CATEGORY_COLUMNS = ["公司名稱", "券商"]
+# 掃描與查詢會用到的欄位；其餘欄位上傳時不讀進記憶體
+SHEET_COLUMNS = TEXT_COLUMNS + EPS_COLUMNS + GROWTH_COLUMNS
+# 長文字的報告摘要只存在快照檔中，查詢顯示時才讀出
+SUMMARY_COLUMN = "報告摘要"
+# 券商報告的日期格式，例如 '2025/11/12 12:00:00 AM'
+REPORT_DATE_FORMAT = "%Y/%m/%d %I:%M:%S %p"
+
+# daily_job 成長率篩選的預設門檻
+DEFAULT_MIN_GROWTH_26 = 15.0
+DEFAULT_MIN_FILLED_GROWTH = 0.0
+
+# 以下為 prepare_report_sheet 產生的預先計算欄位
+DATE_COLUMN = "日期時間"          # 解析後的報告日期（無法解析為 NaT）
+TARGET_COLUMN = "目標價數值"      # 目標價轉成數值（無法轉換為 NaN）
+GROWTH_MASK_COLUMN = "成長篩選"   # 是否通過 daily_job 的成長率條件
+LATEST_COLUMN = "最新報告"        # 是否為同 (代號, 券商) 日期最新的一筆
+CANDIDATE_COLUMN = "候選報告"     # 通過成長率條件的列中，同 (代號, 券商) 日期最新的一筆
+DERIVED_COLUMNS = [DATE_COLUMN, TARGET_COLUMN, GROWTH_MASK_COLUMN, LATEST_COLUMN, CANDIDATE_COLUMN]
+
+# 比對新舊報告表時，用來辨識「同一份報告」的欄位
+SHEET_KEY = ["股票代號", "券商", "日期"]
+
+
+class ReportIndex:
+    """
+    上傳報告表的查詢索引，在 receive_excel 讀入表格時建立一次。
+
+    - 股票代號：雜湊表 {代號: 列位置}，查詢 O(1)。
+    - 公司名稱：以字元 bigram（單字查詢用 unigram）建立反向索引，
+      查詢時只比對候選名稱，不必每次把整欄轉成字串再掃描。
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.size = len(df)
+        self.code_positions: Dict[str, np.ndarray] = {}
+        self.name_positions: Dict[str, np.ndarray] = {}
+        self.names: List[str] = []
+        self.gram_postings: Dict[str, Set[int]] = {}
+
+        if "股票代號" in df.columns:
+            codes = df["股票代號"].astype(str).str.strip()
+            self.code_positions = {code: np.asarray(pos) for code, pos in codes.groupby(codes).indices.items()}
+
+        if "公司名稱" in df.columns:
+            # 原本的比對不分大小寫，這裡統一轉大寫後建索引
+            names = df["公司名稱"].astype(str).str.upper()
+            self.name_positions = {name: np.asarray(pos) for name, pos in names.groupby(names).indices.items()}
+            self.names = list(self.name_positions)
+            for name_id, name in enumerate(self.names):
+                for gram in _grams(name):
+                    self.gram_postings.setdefault(gram, set()).add(name_id)
+
+    def lookup_code(self, code: str) -> np.ndarray:
+        """依股票代號精確查詢，回傳列位置；代號與上傳時相同方式正規化（例如 50 → 0050）。"""
+        return self.code_positions.get(normalize_code(code), np.array([], dtype=int))
+
+    def search_names(self, query: str) -> List[str]:
+        """
+        回傳包含 query 的公司名稱（大寫），依 完全相符 → 開頭相符 → 其他包含 排序，
+        同一等級內較短的名稱排在前面。
+        """
+        query = query.strip().upper()
+        if not query:
+            return []
+        grams = _query_grams(query)
+        postings = sorted((self.gram_postings.get(g, set()) for g in grams), key=len)
+        if not postings or not postings[0]:
+            return []
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                return []
+        matched = [self.names[i] for i in candidates if query in self.names[i]]
+        matched.sort(key=lambda name: (name != query, not name.startswith(query), len(name), name))
+        return matched
+
+    def lookup_name(self, query: str) -> np.ndarray:
+        """依公司名稱包含比對，回傳列位置（名稱排序同 search_names）。"""
+        names = self.search_names(query)
+        if not names:
+            return np.array([], dtype=int)
+        return np.concatenate([self.name_positions[name] for name in names])
+
+    def lookup(self, query: str) -> np.ndarray:
+        """純數字視為股票代號，其餘視為公司名稱，與 manual_trigger 原本的判斷一致。"""
+        query = query.strip().upper()
+        if query.isdigit():
+            return self.lookup_code(query)
+        return self.lookup_name(query)
+
+
+def _grams(text: str) -> Set[str]:
+    """名稱的所有 unigram 與 bigram。"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _query_grams(query: str) -> Set[str]:
+    """查詢字串用到的 gram：兩個字以上用 bigram，單字用 unigram。"""
+    if len(query) == 1:
+        return {query}
+    return {query[i:i + 2] for i in range(len(query) - 1)}
+
+
+# ================== 報告表快照（Feather） ==================
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Excel 讀進來的欄位常混雜數字與文字（例如目標價填「-」），Arrow 無法直接寫入，
+    這類欄位改存成字串；其餘欄位維持原本型別。
+    """
+    df = df.reset_index(drop=True)
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v))
+    return df
+
+
+def save_sheet(df: pd.DataFrame, source_name: Optional[str] = None, directory: str = SHEET_DIR) -> str:
+    """
+    把上傳的報告表存成未壓縮的 Feather 檔（可 memory-map 讀回），並記錄到版本清單。
+    超過 SHEET_HISTORY_LIMIT 的舊版本會被刪除。回傳版本代號。
+    """
+    os.makedirs(directory, exist_ok=True)
+    saved_at, version = new_version()
+    filename = f"{version}.feather"
+    tmp = os.path.join(directory, filename + ".tmp")
+    feather.write_feather(_arrow_safe(df), tmp, compression="uncompressed")
+    os.replace(tmp, os.path.join(directory, filename))
+    _register_version(directory, version, filename, saved_at, len(df), source_name)
+    return version
+
+
+def _register_version(directory: str, version: str, filename: str, saved_at: pd.Timestamp, rows: int,
+                      source_name: Optional[str]) -> None:
+    """把新版本記錄到版本清單，並刪除超過 SHEET_HISTORY_LIMIT 的舊版本。"""
+    register_version(directory, {
+        "version": version,
+        "file": filename,
+        "saved_at": saved_at.isoformat(),
+        "rows": rows,
+        "source": source_name,
+    }, SHEET_HISTORY_LIMIT)
+
+
+def list_sheet_versions(directory: str = SHEET_DIR) -> List[Dict[str, Any]]:
+    """列出保存中的報告表版本（由舊到新）。"""
+    return read_manifest(directory)
+
+
+def load_sheet(version: Optional[str] = None, directory: str = SHEET_DIR,
+               columns: Optional[List[str]] = None) -> Optional[Tuple[str, pd.DataFrame]]:
+    """
+    讀回指定版本（預設最新一版）的報告表，回傳 (版本代號, DataFrame)；沒有任何版本時回傳 None。
+    使用 memory-map 讀取，啟動時不必重新解析 Excel。columns 指定時只讀出其中存在的欄位。
+    """
+    entry = find_version(directory, version)
+    if entry is None:
+        return None
+    path = os.path.join(directory, entry["file"])
+    if columns is not None:
+        with pa.memory_map(path) as source:
+            names = pa.ipc.open_file(source).schema.names
+        columns = [c for c in columns if c in names]
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    return entry["version"], table.to_pandas()
+
+
+def load_summaries(version: str, rows: List[int], directory: str = SHEET_DIR) -> List[str]:
+    """
+    從報告表快照中只讀出指定列（列位置）的報告摘要；記憶體中的報告表不保留這個長文字欄位。
+    快照以 memory-map 開啟，只會讀到用到的那幾列。沒有摘要的列回傳空字串。
+    """
+    entry = find_version(directory, version)
+    if entry is None:
+        return [""] * len(rows)
+    path = os.path.join(directory, entry["file"])
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        if SUMMARY_COLUMN not in reader.schema.names:
+            return [""] * len(rows)
+        column = reader.read_all().column(SUMMARY_COLUMN)
+        values = column.take(pa.array(rows, type=pa.int64())).to_pylist()
+    return ["" if v is None else str(v).strip() for v in values]
+
+
+# ================== 串流讀取上傳的 Excel ==================
+def _sheet_schema(columns: List[str]) -> pa.Schema:
+    """快照檔的欄位型別：EPS 存成 float32、成長率 float64，其餘為文字。"""
+    types = {col: pa.float32() for col in EPS_COLUMNS}
+    types.update({col: pa.float64() for col in GROWTH_COLUMNS})
+    return pa.schema([(col, types.get(col, pa.string())) for col in columns])
+
+
+def iter_excel_chunks(path: str, columns: List[str], chunk_rows: int = SHEET_CHUNK_ROWS,
+                      required: List[str] = ()) -> Tuple[List[str], Iterator[pd.DataFrame]]:
+    """
+    以 openpyxl 唯讀模式逐列讀取第一個工作表，只取 columns 中有的欄位，
+    回傳 (表頭全部欄位名稱, 每 chunk_rows 列一個 DataFrame 的迭代器)；值維持原樣、尚未轉型。
+    表頭缺少 required 中的欄位時關閉檔案並拋出 ValueError，不讀任何資料列。
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    header = ["" if h is None else str(h).strip() for h in next(rows, None) or ()]
+    try:
+        _require_columns(header, required)
+    except ValueError:
+        workbook.close()
+        raise
+    positions: Dict[str, int] = {}
+    for i, name in enumerate(header):
+        if name in columns:
+            positions.setdefault(name, i)
+    names = list(positions)
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        try:
+            chunk = []
+            for row in rows:
+                values = tuple(row[i] if i < len(row) else None for i in positions.values())
+                if all(v is None for v in values):
+                    continue
+                chunk.append(values)
+                if len(chunk) >= chunk_rows:
+                    yield pd.DataFrame(chunk, columns=names, dtype=object)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame(chunk, columns=names, dtype=object)
+        finally:
+            workbook.close()
+
+    return [h for h in header if h], chunks()
+
+
+def _compact_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """一段原始列轉成快照檔的型別：文字去空白、EPS 轉 float32、成長率轉 float64。"""
+    chunk = chunk.copy()
+    for col in chunk.columns:
+        if col in EPS_COLUMNS:
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce").astype(np.float32)
+        elif col in GROWTH_COLUMNS:
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce").astype(np.float64)
+        elif col == "股票代號":
+            chunk[col] = chunk[col].map(lambda v: None if v is None else normalize_code(v))
+        else:
+            chunk[col] = chunk[col].map(lambda v: None if v is None or pd.isna(v) else str(v).strip())
+    return chunk
+
+
+def _concat_chunks(chunks: List[pd.DataFrame], columns: List[str]) -> pd.DataFrame:
+    """合併各段，category 欄位以 union_categoricals 合併，不會退回成一般文字欄位。"""
+    if not chunks:
+        return pd.DataFrame({col: pd.Series(dtype=object) for col in columns})
+    categories = [col for col in CATEGORY_COLUMNS if col in columns]
+    frame = pd.concat([c.drop(columns=categories) for c in chunks], ignore_index=True)
+    for col in categories:
+        frame[col] = union_categoricals([c[col] for c in chunks])
+    return frame[columns]
+
+
+def ingest_sheet(path: str, source_name: Optional[str] = None, directory: str = SHEET_DIR,
+                 chunk_rows: int = SHEET_CHUNK_ROWS) -> Tuple[str, pd.DataFrame, List[str]]:
+    """
+    串流讀入上傳的 Excel 並存成快照：每 chunk_rows 列轉型後直接寫進 Feather 暫存檔，
+    記憶體中只留下掃描與查詢需要的欄位（公司名稱、券商為 category，EPS 為 float32），
+    報告摘要只寫進快照檔（見 load_summaries）。.xls 舊格式改用 pd.read_excel，但同樣只讀需要的欄位。
+    表頭缺少必要欄位時在寫入前就拋出 ValueError；報告表通過 prepare_report_sheet 後
+    才換名並記錄成新版本，讀取或轉換失敗時最新版本仍是上一份報告表。
+    回傳 (版本代號, 經過 prepare_report_sheet 的報告表, 表頭全部欄位名稱)。
+    """
+    wanted = SHEET_COLUMNS + [SUMMARY_COLUMN]
+    if path.lower().endswith(".xls"):
+        raw = pd.read_excel(path, usecols=lambda c: str(c).strip() in wanted, dtype=object)
+        raw.columns = [str(c).strip() for c in raw.columns]
+        raw = raw.loc[:, ~raw.columns.duplicated()].astype(object).where(raw.notna(), None)
+        header = list(raw.columns)
+        chunks: Iterator[pd.DataFrame] = (raw.iloc[start:start + chunk_rows] for start in range(0, len(raw), chunk_rows))
+    else:
+        header, chunks = iter_excel_chunks(path, wanted, chunk_rows, required=REQUIRED_COLUMNS)
+    _require_columns(header)
+    columns = [col for col in wanted if col in header]
+    kept = [col for col in columns if col != SUMMARY_COLUMN]
+
+    os.makedirs(directory, exist_ok=True)
+    saved_at, version = new_version()
+    filename = f"{version}.feather"
+    tmp = os.path.join(directory, filename + ".tmp")
+    schema = _sheet_schema(columns)
+    parts: List[pd.DataFrame] = []
+    try:
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for chunk in chunks:
+                chunk = _compact_chunk(chunk[columns])
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                part = chunk[kept]
+                for col in CATEGORY_COLUMNS:
+                    if col in part.columns:
+                        part[col] = part[col].astype("category")
+                parts.append(part)
+        frame = prepare_report_sheet(_concat_chunks(parts, kept))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, os.path.join(directory, filename))
+    _register_version(directory, version, filename, saved_at, len(frame), source_name)
+    return version, frame, header
+
+
+# ================== 上傳時的正規化與預先計算 ==================
+def normalize_code(value: Any) -> str:
+    """股票代號轉成字串：Excel 讀成 2330.0 的轉回 2330，被吃掉前導 0 的補回 4 碼（例如 50 → 0050）。"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    code = str(value).strip()
+    if code.isdigit() and len(code) < 4:
+        code = code.zfill(4)
+    return code
+
+
+def _require_columns(columns: Any, required: List[str] = REQUIRED_COLUMNS) -> None:
+    """columns 缺少 required 任一欄位時拋出 ValueError。"""
+    missing = [col for col in required if col not in columns]
+    if missing:
+        raise ValueError(f"Excel 缺少「{'」「'.join(missing)}」欄位")
+
+
+def _latest_flags(df: pd.DataFrame, mask: pd.Series) -> pd.Series:
+    """在 mask 為 True 的列中，標記每組 (代號, 券商) 日期最新的一筆；日期相同時保留較前面的列。"""
+    flags = pd.Series(False, index=df.index)
+    subset = df.loc[mask, ["股票代號", "券商"]].copy()
+    if subset.empty:
+        return flags
+    # 無法解析的日期視為最舊，與原本 filter_and_deduplicate_results 的 datetime.min 一致
+    subset["_date"] = df.loc[mask, DATE_COLUMN].fillna(pd.Timestamp.min)
+    latest_idx = subset.groupby(["股票代號", "券商"], sort=False)["_date"].idxmax()
+    flags.loc[latest_idx.values] = True
+    return flags
+
+
+def prepare_report_sheet(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    上傳報告表時執行一次的正規化：
+    文字欄位去空白、EPS 與成長率轉成數值、日期解析成 datetime，
+    並以向量化方式算好成長率篩選與「同 (代號, 券商) 最新報告」旗標，
+    之後的排程掃描與查詢只需要讀這些欄位。
+    """
+    _require_columns(df.columns)
+
+    df = df.reset_index(drop=True).copy()
+
+    for col in TEXT_COLUMNS:
+        if col not in df.columns:
+            df[col] = ""
+    df["股票代號"] = df["股票代號"].map(normalize_code)
+    for col in ["公司名稱", "券商", "日期", "目標價"]:
+        df[col] = df[col].astype(str).str.strip()
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype("category")
+
+    for col in EPS_COLUMNS + GROWTH_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+        else:
+            df[col] = np.nan
+    # EPS 只用於顯示，以 float32 保存；成長率要和門檻比較，維持 float64
+    df[EPS_COLUMNS] = df[EPS_COLUMNS].astype(np.float32)
+
+    df[DATE_COLUMN] = pd.to_datetime(df["日期"], format=REPORT_DATE_FORMAT, errors="coerce")
+    df[TARGET_COLUMN] = pd.to_numeric(df["目標價"], errors="coerce")
+
+    df[GROWTH_MASK_COLUMN] = growth_filter_mask(df)
+
+    df[LATEST_COLUMN] = _latest_flags(df, pd.Series(True, index=df.index))
+    df[CANDIDATE_COLUMN] = _latest_flags(df, df[GROWTH_MASK_COLUMN])
+    return df
+
+
+def growth_filter_mask(df: pd.DataFrame, min_growth_26: float = DEFAULT_MIN_GROWTH_26,
+                       min_filled_growth: float = DEFAULT_MIN_FILLED_GROWTH) -> pd.Series:
+    """
+    daily_job 的成長率篩選（向量化）：
+    條件 1：EPS26成長率(%) > min_growth_26；
+    條件 2：EPS25/26/27成長率(%) 有填的欄位皆 > min_filled_growth（空值不算）。
+    """
+    growth = df[GROWTH_COLUMNS].apply(pd.to_numeric, errors="coerce")
+    all_filled_ok = ((growth > min_filled_growth) | growth.isna()).all(axis=1)
+    return (growth["EPS26成長率(%)"] > min_growth_26) & all_filled_ok
+
+
+def select_candidates(df: pd.DataFrame, min_growth_26: float = DEFAULT_MIN_GROWTH_26,
+                      min_filled_growth: float = DEFAULT_MIN_FILLED_GROWTH) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    一次取得掃描候選：回傳 (通過篩選且同 (代號, 券商) 日期最新的報告列, 不重複的股票代號)。
+    同一檔被多家券商涵蓋時只會出現在代號清單一次，查價與計分也只做一次。
+    df 需先經過 prepare_report_sheet；門檻與預設相同時直接使用上傳時算好的旗標。
+    """
+    if min_growth_26 == DEFAULT_MIN_GROWTH_26 and min_filled_growth == DEFAULT_MIN_FILLED_GROWTH:
+        flags = df[CANDIDATE_COLUMN]
+    else:
+        flags = _latest_flags(df, growth_filter_mask(df, min_growth_26, min_filled_growth))
+    rows = df[flags]
+    return rows, list(dict.fromkeys(rows["股票代號"]))
+
+
+def eps_values(row: Dict[str, Any]) -> List[float]:
+    """一列資料的逐年 EPS（float32 轉回最短的十進位表示，顯示時不會多出尾數）。"""
+    return [float(str(np.float32(row[col]))) for col in EPS_COLUMNS]
+
+
+def growth_values(row: Dict[str, Any]) -> List[float]:
+    """一列資料中有填的成長率數值（依 25、26、27 年順序）。"""
+    return [row[col] for col in GROWTH_COLUMNS if not pd.isna(row[col])]
+
+
+# ================== 新舊報告表比對 ==================
+class SheetDiff:
+    """
+    兩版報告表的差異（以 (股票代號, 券商, 日期) 辨識同一份報告）：
+    added / changed 為新表中新增或內容有變動的列，removed 為舊表中已不存在的報告數，
+    tickers 為新增或變動的報告涉及的股票代號。
+    """
+
+    def __init__(self, added: pd.Index, changed: pd.Index, removed: int, tickers: List[str]):
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+        self.tickers = tickers
+
+    @property
+    def rows(self) -> pd.Index:
+        """新增與變動的列（依新表順序）。"""
+        return self.added.union(self.changed).sort_values()
+
+    def summary(self) -> str:
+        return (f"新增 {len(self.added)} 筆、更新 {len(self.changed)} 筆、移除 {self.removed} 筆"
+                f"（涉及 {len(self.tickers)} 檔）")
+
+
+def _keyed_hashes(df: pd.DataFrame, columns: List[str]) -> pd.Series:
+    """
+    每一列內容的雜湊，索引為 (股票代號, 券商, 日期, 第幾筆)；
+    同一組鍵重複出現時依出現順序編號，才能一對一比對。
+    """
+    keys = df[SHEET_KEY].astype(str)
+    occurrence = keys.groupby(SHEET_KEY, sort=False).cumcount()
+    content = df.reindex(columns=columns).astype(str)
+    hashes = pd.util.hash_pandas_object(content, index=False)
+    hashes.index = pd.MultiIndex.from_arrays([keys[c] for c in SHEET_KEY] + [occurrence])
+    return hashes
+
+
+def diff_report_sheets(old: Optional[pd.DataFrame], new: pd.DataFrame) -> SheetDiff:
+    """
+    比對兩版經過 prepare_report_sheet 的報告表，全部以向量化完成。
+    內容比對使用兩版共有的原始欄位（不含預先計算的欄位），欄位增減不算變動。
+    """
+    if old is None or old.empty:
+        return SheetDiff(new.index, new.index[:0], 0, list(dict.fromkeys(new["股票代號"])))
+    columns = [c for c in new.columns if c in old.columns and c not in DERIVED_COLUMNS]
+    old_hashes = _keyed_hashes(old, columns)
+    new_hashes = _keyed_hashes(new, columns)
+
+    matched = new_hashes.index.isin(old_hashes.index)
+    added = new.index[~matched]
+    previous = old_hashes.reindex(new_hashes.index[matched])
+    changed = new.index[matched][previous.to_numpy() != new_hashes[matched].to_numpy()]
+    removed = int((~old_hashes.index.isin(new_hashes.index)).sum())
+    rows = added.union(changed)
+    return SheetDiff(added, changed, removed, list(dict.fromkeys(new.loc[rows.sort_values(), "股票代號"])))
@@ -0,0 +1,177 @@
+import os
+import pickle
+import sqlite3
+import datetime
+import threading
+from typing import Any, Dict, List, Optional
+
+# 掃描檢查點的存放位置（Render 上可指向 persistent disk）
+DEFAULT_CHECKPOINT_PATH = os.getenv("SCAN_CHECKPOINT_PATH", os.path.join("data", "scans.sqlite"))
+# 中斷超過這麼多小時的掃描不再接續（價格已過時，等下一次排程重新掃描）
+SCAN_RESUME_MAX_HOURS = float(os.getenv("SCAN_RESUME_MAX_HOURS", "6"))
+# 最多保留幾次掃描的檢查點
+SCAN_CHECKPOINT_KEEP = int(os.getenv("SCAN_CHECKPOINT_KEEP", "10"))
+
+
+def new_scan_id() -> str:
+    return datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+class ScanCheckpoint:
+    """
+    以 SQLite 保存 daily_job 的進度：掃描代號、對應的報告表版本、候選清單，
+    以及每檔股票已算好的 (MA 字典, 排列狀態, 買點分數)。
+
+    每個批次完成就寫入一次；程序重啟後可讀回中斷的掃描，已計分的股票不再重新查價。
+    串流通知的進度（每組訂閱者的進度訊息 id 與已送出的條目）也一併保存，接續時不重複發送。
+    結果以 pickle 保存，接續後的通知內容與一次跑完完全相同。
+    """
+
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scans (
+                scan_id       TEXT PRIMARY KEY,
+                sheet_version TEXT,
+                state         TEXT NOT NULL,
+                candidates    BLOB,
+                tickers       BLOB,
+                started_at    TEXT NOT NULL,
+                finished_at   TEXT
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scan_results (
+                scan_id TEXT NOT NULL,
+                ticker  TEXT NOT NULL,
+                result  BLOB NOT NULL,
+                PRIMARY KEY (scan_id, ticker)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scan_streams (
+                scan_id    TEXT NOT NULL,
+                group_key  TEXT NOT NULL,
+                status_ids BLOB NOT NULL,
+                sent       BLOB NOT NULL,
+                PRIMARY KEY (scan_id, group_key)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def start(self, scan_id: str, sheet_version: Optional[str], candidates: List[Dict[str, Any]],
+              tickers: List[str]) -> None:
+        """記錄一次新掃描的候選清單；其他仍是 running 的掃描視為被取代，標記為 abandoned。"""
+        now = datetime.datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute("UPDATE scans SET state = 'abandoned', finished_at = ? WHERE state = 'running'",
+                               (now,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scans VALUES (?, ?, 'running', ?, ?, ?, NULL)",
+                (scan_id, sheet_version, pickle.dumps(candidates), pickle.dumps(tickers), now),
+            )
+            self._conn.commit()
+        self.prune()
+
+    def save_results(self, scan_id: str, results: Dict[str, Any]) -> None:
+        """批次寫入 {股票代號: 分析結果}。"""
+        if not results:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scan_results VALUES (?, ?, ?)",
+                [(scan_id, ticker, pickle.dumps(result)) for ticker, result in results.items()],
+            )
+            self._conn.commit()
+
+    def load_results(self, scan_id: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ticker, result FROM scan_results WHERE scan_id = ?", (scan_id,)
+            ).fetchall()
+        return {ticker: pickle.loads(blob) for ticker, blob in rows}
+
+    def save_stream(self, scan_id: str, group_key: str, status_ids: Dict[int, int], sent: List[Any]) -> None:
+        """記錄一組訂閱者的串流進度：進度訊息 {chat_id: 訊息 id} 與已送出的條目鍵。"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scan_streams VALUES (?, ?, ?, ?)",
+                (scan_id, group_key, pickle.dumps(status_ids), pickle.dumps(list(sent))),
+            )
+            self._conn.commit()
+
+    def load_streams(self, scan_id: str) -> Dict[str, Dict[str, Any]]:
+        """回傳 {group_key: {"status_ids": ..., "sent": [...]}}。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT group_key, status_ids, sent FROM scan_streams WHERE scan_id = ?", (scan_id,)
+            ).fetchall()
+        return {key: {"status_ids": pickle.loads(ids), "sent": pickle.loads(sent)} for key, ids, sent in rows}
+
+    def finish(self, scan_id: str, state: str = "finished") -> None:
+        """標記掃描結束（finished / failed / abandoned），之後不會再被接續。"""
+        now = datetime.datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute("UPDATE scans SET state = ?, finished_at = ? WHERE scan_id = ?",
+                               (state, now, scan_id))
+            self._conn.commit()
+
+    def interrupted(self) -> Optional[Dict[str, Any]]:
+        """
+        回傳最近一次仍是 running 的掃描（程序在掃描途中結束），沒有則回傳 None。
+        內容包含 scan_id、sheet_version、started_at、candidates、tickers、已完成的 results
+        與各組訂閱者的串流進度 streams（見 load_streams）。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT scan_id, sheet_version, candidates, tickers, started_at FROM scans "
+                "WHERE state = 'running' ORDER BY started_at DESC LIMIT 1"
+            ).fetchone()
+        if row is None:
+            return None
+        scan_id, sheet_version, candidates, tickers, started_at = row
+        return {
+            "scan_id": scan_id,
+            "sheet_version": sheet_version,
+            "started_at": datetime.datetime.fromisoformat(started_at),
+            "candidates": pickle.loads(candidates),
+            "tickers": pickle.loads(tickers),
+            "results": self.load_results(scan_id),
+            "streams": self.load_streams(scan_id),
+        }
+
+    def abandon_running(self) -> None:
+        """把所有仍是 running 的掃描標記為 abandoned。"""
+        now = datetime.datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute("UPDATE scans SET state = 'abandoned', finished_at = ? WHERE state = 'running'",
+                               (now,))
+            self._conn.commit()
+
+    def prune(self, keep: int = SCAN_CHECKPOINT_KEEP) -> None:
+        """只保留最近 keep 次掃描的檢查點。"""
+        with self._lock:
+            expired = [r[0] for r in self._conn.execute(
+                "SELECT scan_id FROM scans ORDER BY started_at DESC LIMIT -1 OFFSET ?", (keep,)
+            ).fetchall()]
+            if expired:
+                marks = ",".join("?" * len(expired))
+                self._conn.execute(f"DELETE FROM scan_results WHERE scan_id IN ({marks})", expired)
+                self._conn.execute(f"DELETE FROM scan_streams WHERE scan_id IN ({marks})", expired)
+                self._conn.execute(f"DELETE FROM scans WHERE scan_id IN ({marks})", expired)
+                self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,107 @@
+import os
+import datetime
+import pandas as pd
+import pyarrow.feather as feather
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from get_stock_position import get_bars_batch, score_bars
+from ma_cache import last_trading_session
+from ma_engine import frame_to_results
+from metrics import SNAPSHOT_LOOKUPS
+from version_manifest import find_version, new_version, register_version
+
+# 分數快照存放位置（Render 上可指向 persistent disk）
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join("data", "snapshots"))
+# 最多保留幾個歷史版本
+SNAPSHOT_HISTORY_LIMIT = int(os.getenv("SNAPSHOT_HISTORY_LIMIT", "10"))
+
+
+class ScoreSnapshot:
+    """
+    收盤後預先算好的分數快照：每檔股票的現價、MA、偏離度、買點分數、買點判斷與排列狀態
+    （格式同 ma_engine.score_close_matrix），並記錄資料所屬的交易日與報告表版本。
+
+    快照只在資料所屬的交易日仍是 last_trading_session() 時有效；下一次收盤後即視為過期，
+    查詢與排程掃描會改回即時計算。
+    """
+
+    def __init__(self, frame: pd.DataFrame, version: str, trading_day: datetime.date,
+                 sheet_version: Optional[str] = None, consolidation_threshold: float = 0.02):
+        self.frame = frame
+        self.version = version
+        self.trading_day = trading_day
+        self.sheet_version = sheet_version
+        self.consolidation_threshold = consolidation_threshold
+
+    def is_fresh(self, now: Optional[datetime.datetime] = None) -> bool:
+        return self.trading_day == last_trading_session(now)
+
+    def results(self, codes: Iterable[str], consolidation_threshold: float = 0.02
+                ) -> Dict[str, Tuple[Dict[str, Union[str, float]], str, Dict[str, Any]]]:
+        """
+        取出 codes 的 {代號: (MA 字典, 排列狀態, 買點分數)}，格式同 analyze_stocks_batch。
+        快照過期、門檻不同、沒有該檔或當時查價失敗的不回傳，由呼叫端即時計算。
+        """
+        codes = list(dict.fromkeys(codes))
+        if not self.is_fresh() or consolidation_threshold != self.consolidation_threshold:
+            SNAPSHOT_LOOKUPS.inc(len(codes), result="stale")
+            return {}
+        found = [code for code in codes if code in self.frame.index]
+        rows = self.frame.loc[found]
+        rows = rows[rows["現價"].notna()]
+        SNAPSHOT_LOOKUPS.inc(len(rows), result="hit")
+        SNAPSHOT_LOOKUPS.inc(len(codes) - len(rows), result="miss")
+        return frame_to_results(rows)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "trading_day": self.trading_day.isoformat(),
+            "sheet_version": self.sheet_version,
+            "rows": len(self.frame),
+            "fresh": self.is_fresh(),
+        }
+
+
+def build_snapshot_frame(codes: List[str], batch_size: int = 50, batch_pause: float = 0.0,
+                         consolidation_threshold: float = 0.02) -> pd.DataFrame:
+    """查價並計分一批代號，回傳依 codes 順序的 score_close_matrix 格式結果。"""
+    bars = get_bars_batch(codes, batch_size=batch_size, batch_pause=batch_pause)
+    return score_bars(bars, consolidation_threshold=consolidation_threshold).reindex(codes)
+
+
+# ================== 版本化儲存（Feather） ==================
+def save_snapshot(frame: pd.DataFrame, trading_day: datetime.date, sheet_version: Optional[str] = None,
+                  consolidation_threshold: float = 0.02, directory: str = SNAPSHOT_DIR) -> ScoreSnapshot:
+    """
+    把分數快照存成 Feather 檔並記錄到版本清單，超過 SNAPSHOT_HISTORY_LIMIT 的舊版本會被刪除。
+    回傳對應的 ScoreSnapshot。
+    """
+    os.makedirs(directory, exist_ok=True)
+    saved_at, version = new_version()
+    filename = f"{version}.feather"
+    tmp = os.path.join(directory, filename + ".tmp")
+    feather.write_feather(frame.reset_index(), tmp, compression="uncompressed")
+    os.replace(tmp, os.path.join(directory, filename))
+
+    register_version(directory, {
+        "version": version,
+        "file": filename,
+        "saved_at": saved_at.isoformat(),
+        "trading_day": trading_day.isoformat(),
+        "sheet_version": sheet_version,
+        "consolidation_threshold": consolidation_threshold,
+        "rows": len(frame),
+    }, SNAPSHOT_HISTORY_LIMIT)
+    return ScoreSnapshot(frame, version, trading_day, sheet_version, consolidation_threshold)
+
+
+def load_snapshot(version: Optional[str] = None, directory: str = SNAPSHOT_DIR) -> Optional[ScoreSnapshot]:
+    """讀回指定版本（預設最新一版）的分數快照，沒有任何版本時回傳 None。"""
+    entry = find_version(directory, version)
+    if entry is None:
+        return None
+    frame = feather.read_table(os.path.join(directory, entry["file"]), memory_map=True).to_pandas()
+    frame = frame.set_index("股票代號")
+    return ScoreSnapshot(frame, entry["version"], datetime.date.fromisoformat(entry["trading_day"]),
+                         entry.get("sheet_version"), entry.get("consolidation_threshold", 0.02))
@@ -0,0 +1,255 @@
+import os
+import json
+import sqlite3
+import threading
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from price_store import SUFFIXES
+from report_sheet import (DEFAULT_MIN_FILLED_GROWTH, DEFAULT_MIN_GROWTH_26, LATEST_COLUMN, normalize_code,
+                          select_candidates)
+
+# 訂閱設定的存放位置（Render 上可指向 persistent disk）
+DEFAULT_SUBSCRIBER_DB_PATH = os.getenv("SUBSCRIBER_DB_PATH", os.path.join("data", "subscribers.sqlite"))
+# 預設的通知門檻：MA買點分數 ≥ 這個值（與原本 filter_and_deduplicate_results 的「> 7」相同）
+DEFAULT_MIN_SCORE = int(os.getenv("SUBSCRIBER_MIN_SCORE", "8"))
+# 每人最多關注幾檔
+WATCHLIST_LIMIT = int(os.getenv("WATCHLIST_LIMIT", "200"))
+# 除了 ALL_ID 之外，允許用指令訂閱的聊天室（逗號分隔）；OPEN_SUBSCRIPTION=1 時任何私訊都可以訂閱
+SUBSCRIBER_ALLOW_IDS = [int(x) for x in os.getenv("SUBSCRIBER_ALLOW_IDS", "").split(",") if x.strip()]
+OPEN_SUBSCRIPTION = os.getenv("OPEN_SUBSCRIPTION", "0") == "1"
+
+
+class Subscription:
+    """
+    一位訂閱者的通知條件：
+    MA買點分數 ≥ min_score，且通過自己的成長率條件（26成長率 > min_growth_26、有填的成長率皆 > min_filled_growth）；
+    關注清單中的股票不看成長率條件，watch_only 時只通知關注清單。
+    """
+
+    def __init__(self, chat_id: int, min_score: int = DEFAULT_MIN_SCORE,
+                 min_growth_26: float = DEFAULT_MIN_GROWTH_26, min_filled_growth: float = DEFAULT_MIN_FILLED_GROWTH,
+                 watchlist: Optional[List[str]] = None, watch_only: bool = False, active: bool = True):
+        self.chat_id = chat_id
+        self.min_score = min_score
+        self.min_growth_26 = min_growth_26
+        self.min_filled_growth = min_filled_growth
+        self.watchlist = list(dict.fromkeys(watchlist or []))
+        self.watch_only = watch_only
+        self.active = active
+
+    def growth_key(self) -> Tuple[float, float]:
+        return (self.min_growth_26, self.min_filled_growth)
+
+    def predicate_key(self) -> Tuple:
+        """條件相同的訂閱者共用同一份篩選結果與訊息。"""
+        return (self.min_score, self.growth_key(), tuple(sorted(self.watchlist)), self.watch_only)
+
+    def describe(self) -> str:
+        watch = "、".join(self.watchlist) if self.watchlist else "（無）"
+        return (f"目前設定：\n"
+                f"• 通知：{'開啟' if self.active else '關閉'}\n"
+                f"• MA買點分數 ≥ {self.min_score}\n"
+                f"• 26成長率 > {self.min_growth_26:g}%\n"
+                f"• 有填的成長率皆 > {self.min_filled_growth:g}%\n"
+                f"• 關注清單：{watch}\n"
+                f"• 只看關注清單：{'是' if self.watch_only else '否'}")
+
+
+class SubscriberStore:
+    """
+    以 SQLite 保存每位訂閱者的通知條件；ALL_ID 中的聊天室沒有設定時使用預設條件。
+    只有 ALL_ID 與 allowed_ids 中的聊天室可以訂閱（open_subscription 時不限制）。
+    """
+
+    def __init__(self, path: str = DEFAULT_SUBSCRIBER_DB_PATH, default_ids: Iterable[int] = (),
+                 min_score: int = DEFAULT_MIN_SCORE, min_growth_26: float = DEFAULT_MIN_GROWTH_26,
+                 min_filled_growth: float = DEFAULT_MIN_FILLED_GROWTH,
+                 allowed_ids: Iterable[int] = SUBSCRIBER_ALLOW_IDS, open_subscription: bool = OPEN_SUBSCRIPTION):
+        self.path = path
+        self.default_ids = list(default_ids)
+        self.allowed_ids = set(allowed_ids)
+        self.open_subscription = open_subscription
+        self.defaults = {"min_score": min_score, "min_growth_26": min_growth_26,
+                         "min_filled_growth": min_filled_growth}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS subscribers (
+                chat_id           INTEGER PRIMARY KEY,
+                min_score         INTEGER NOT NULL,
+                min_growth_26     REAL NOT NULL,
+                min_filled_growth REAL NOT NULL,
+                watchlist         TEXT NOT NULL,
+                watch_only        INTEGER NOT NULL,
+                active            INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def is_allowed(self, chat_id: int) -> bool:
+        return self.open_subscription or chat_id in self.default_ids or chat_id in self.allowed_ids
+
+    def _default(self, chat_id: int) -> Subscription:
+        return Subscription(chat_id, active=chat_id in self.default_ids, **self.defaults)
+
+    @staticmethod
+    def _from_row(row: tuple) -> Subscription:
+        chat_id, min_score, min_growth_26, min_filled_growth, watchlist, watch_only, active = row
+        # 舊版保存的關注清單可能是原樣輸入的代號，讀出時一併正規化
+        codes = [normalize_watch_code(code) for code in json.loads(watchlist)]
+        return Subscription(chat_id, min_score, min_growth_26, min_filled_growth, codes, bool(watch_only), bool(active))
+
+    def get(self, chat_id: int) -> Subscription:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM subscribers WHERE chat_id = ?", (chat_id,)).fetchone()
+        return self._from_row(row) if row is not None else self._default(chat_id)
+
+    def save(self, sub: Subscription) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO subscribers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sub.chat_id, sub.min_score, sub.min_growth_26, sub.min_filled_growth,
+                 json.dumps(sub.watchlist), int(sub.watch_only), int(sub.active)),
+            )
+            self._conn.commit()
+
+    def all(self) -> List[Subscription]:
+        """所有開啟通知的訂閱者：有設定的依設定，ALL_ID 中沒有設定的使用預設條件。"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM subscribers ORDER BY chat_id").fetchall()
+        stored = {row[0]: self._from_row(row) for row in rows}
+        subs = [stored.pop(chat_id, None) or self._default(chat_id) for chat_id in self.default_ids]
+        subs.extend(stored.values())
+        # 已不在允許名單中的聊天室即使先前訂閱過也不再發送
+        return [sub for sub in subs if sub.active and self.is_allowed(sub.chat_id)]
+
+    def chat_ids(self) -> List[int]:
+        return [sub.chat_id for sub in self.all()]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def group_by_predicate(subs: Iterable[Subscription]) -> Dict[Tuple, List[Subscription]]:
+    """把條件相同的訂閱者歸成一組，每組只需篩選、排版一次。"""
+    groups: Dict[Tuple, List[Subscription]] = {}
+    for sub in subs:
+        groups.setdefault(sub.predicate_key(), []).append(sub)
+    return groups
+
+
+def plan_candidates(df: pd.DataFrame, subs: Iterable[Subscription]
+                    ) -> Tuple[pd.DataFrame, Dict[Tuple[float, float], Set[int]], List[str]]:
+    """
+    一次掃描要處理的報告列：所有訂閱者成長率條件的聯集（相同條件只篩一次），
+    加上關注清單中股票的最新報告。每檔股票之後只查價、計分一次，再依各組條件分送。
+    回傳 (報告列（依表格順序）, {成長率條件: 通過的列}, 有人關注但報告表中沒有的代號)。
+    """
+    subs = list(subs)
+    growth_rows: Dict[Tuple[float, float], Set[int]] = {}
+    for key in dict.fromkeys(sub.growth_key() for sub in subs if not sub.watch_only):
+        rows, _ = select_candidates(df, min_growth_26=key[0], min_filled_growth=key[1])
+        growth_rows[key] = set(rows.index)
+    watched = {code for sub in subs for code in sub.watchlist}
+    watch_rows = set(df.index[df[LATEST_COLUMN] & df["股票代號"].isin(watched)])
+    index = sorted(set().union(watch_rows, *growth_rows.values()))
+    missing = sorted(watched - set(df["股票代號"]))
+    return df.loc[index], growth_rows, missing
+
+
+# ================== 指令 ==================
+COMMANDS = {
+    "/subscribe": "subscribe", "訂閱": "subscribe",
+    "/unsubscribe": "unsubscribe", "取消訂閱": "unsubscribe",
+    "/settings": "settings", "設定": "settings",
+    "/score": "score", "分數": "score",
+    "/growth": "growth", "成長率": "growth",
+    "/watch": "watch", "關注": "watch",
+    "/unwatch": "unwatch", "取消關注": "unwatch",
+    "/watchonly": "watchonly", "只看關注": "watchonly",
+    "/reset": "reset", "重設": "reset",
+}
+
+HELP_TEXT = ("可用指令：\n"
+             "• 訂閱 / 取消訂閱\n"
+             "• 設定：查看目前條件\n"
+             "• 分數 8：MA買點分數 ≥ 8 才通知\n"
+             "• 成長率 15 0：26成長率 > 15%、有填的成長率皆 > 0%\n"
+             "• 關注 2330 2317 / 取消關注 2330（或 全部）\n"
+             "• 只看關注 開 / 關\n"
+             "• 重設：回到預設條件")
+
+_ON = {"on", "開", "是", "1", "true"}
+_OFF = {"off", "關", "否", "0", "false"}
+
+
+def parse_command(text: str) -> Optional[Tuple[str, List[str]]]:
+    """不是訂閱指令時回傳 None，否則回傳 (指令, 參數)。"""
+    parts = text.strip().split()
+    if not parts:
+        return None
+    command = COMMANDS.get(parts[0].lower().split("@")[0])
+    if command is None:
+        return None
+    return command, parts[1:]
+
+
+def normalize_watch_code(text: str) -> str:
+    """關注清單的代號與報告表一致：去掉 .TW / .TWO 後綴，被省略的前導 0 補回（例如 50 → 0050）。"""
+    code = text.strip().upper()
+    for suffix in sorted(SUFFIXES, key=len, reverse=True):
+        if code.endswith(suffix):
+            code = code[:-len(suffix)]
+            break
+    return normalize_code(code)
+
+
+def apply_command(store: SubscriberStore, chat_id: int, command: str, args: List[str]) -> str:
+    """執行訂閱指令並儲存，回傳要回覆給使用者的文字；參數錯誤或沒有訂閱權限時回傳說明。"""
+    if not store.is_allowed(chat_id):
+        return "此機器人目前不開放訂閱，請聯絡管理員。"
+    sub = store.get(chat_id)
+    try:
+        if command == "subscribe":
+            sub.active = True
+        elif command == "unsubscribe":
+            sub.active = False
+        elif command == "settings":
+            return sub.describe() + "\n\n" + HELP_TEXT
+        elif command == "score":
+            sub.min_score = int(args[0])
+        elif command == "growth":
+            sub.min_growth_26 = float(args[0])
+            if len(args) > 1:
+                sub.min_filled_growth = float(args[1])
+        elif command == "watch":
+            codes = [normalize_watch_code(code) for code in args if code.strip()]
+            if not codes:
+                return sub.describe()
+            sub.watchlist = list(dict.fromkeys(sub.watchlist + codes))
+            if len(sub.watchlist) > WATCHLIST_LIMIT:
+                return f"關注清單最多 {WATCHLIST_LIMIT} 檔"
+        elif command == "unwatch":
+            if not args or args[0].lower() in ("all", "全部"):
+                sub.watchlist = []
+            else:
+                removed = {normalize_watch_code(code) for code in args if code.strip()}
+                sub.watchlist = [code for code in sub.watchlist if code not in removed]
+        elif command == "watchonly":
+            value = args[0].lower()
+            if value not in _ON | _OFF:
+                raise ValueError(value)
+            sub.watch_only = value in _ON
+        elif command == "reset":
+            sub = Subscription(chat_id, **store.defaults)
+    except (IndexError, ValueError):
+        return "參數格式不正確\n\n" + HELP_TEXT
+    store.save(sub)
+    return "✅ 已更新\n" + sub.describe()
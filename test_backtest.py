@@ -0,0 +1,49 @@
+# test_backtest.py
+import numpy as np
+import pandas as pd
+
+from ma_engine import MA_PERIODS, forward_returns, score_close_matrix, score_history
+
+
+def _closes(tickers: int = 6, days: int = 400, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    steps = rng.integers(-4, 5, size=(days, tickers)) * 0.05
+    values = np.round(np.maximum(50 + np.cumsum(steps, axis=0), 1.0), 2)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    # 一檔晚上市、一檔中途停牌一段時間
+    values[:150, 0] = np.nan
+    values[200:260, 1] = np.nan
+    index = pd.bdate_range("2020-01-01", periods=days)
+    return pd.DataFrame(values, index=index, columns=[f"{1000 + i}.TW" for i in range(tickers)])
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, float) and np.isnan(a):
+        return isinstance(b, float) and np.isnan(b)
+    return a == b
+
+
+def test_score_history_matches_per_day_scoring():
+    close = _closes()
+    history = score_history(close, chunk=4)
+    keys = ["現價"] + [f"MA{n}" for n in MA_PERIODS] + ["趨勢", "MA買點分數", "D240", "D60", "D20", "買點判斷"]
+    for t in range(0, len(close), 7):
+        day = close.index[t]
+        # 逐日重算：只拿到當天為止的 K 棒，交給單日的矩陣計分
+        daily = score_close_matrix(close.iloc[:t + 1])
+        for ticker in close.columns:
+            if np.isnan(close.iat[t, close.columns.get_loc(ticker)]):
+                assert np.isnan(history["現價"].at[day, ticker])
+                assert history["買點判斷"].at[day, ticker] == "數據缺失"
+                continue
+            for key in keys:
+                assert _same(history[key].at[day, ticker], daily.at[ticker, key]), (day, ticker, key)
+
+
+def test_forward_returns_skip_missing_bars():
+    close = pd.DataFrame({"A": [10.0, np.nan, 11.0, 12.1]}, index=pd.bdate_range("2024-01-01", periods=4))
+    returns = forward_returns(close, horizons=[1])[1]["A"]
+    assert returns.iloc[0] == 11.0 / 10.0 - 1
+    assert np.isnan(returns.iloc[1])
+    assert returns.iloc[2] == 12.1 / 11.0 - 1
+    assert np.isnan(returns.iloc[3])
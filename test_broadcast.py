@@ -0,0 +1,129 @@
+# test_broadcast.py
+import asyncio
+import random
+from types import SimpleNamespace
+
+from pyrogram.errors import FloodWait
+
+from broadcast import TELEGRAM_MESSAGE_LIMIT, broadcast, broadcast_edit, broadcast_status, split_message
+from rate_limit import TokenBucket
+
+
+class _FakeClient:
+    """記錄每位收件人收到的訊息；flood 指定哪些 chat 第一次發送會收到 FloodWait。"""
+
+    def __init__(self, flood=(), fail_edit=(), delay=0.0):
+        self.sent = {}
+        self.edited = {}
+        self.flood = set(flood)
+        self.fail_edit = set(fail_edit)
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._next_id = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.flood:
+            self.flood.discard(chat_id)
+            raise FloodWait(value=2)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(random.uniform(0, self.delay))
+        self.in_flight -= 1
+        self.sent.setdefault(chat_id, []).append(text)
+        self._next_id += 1
+        return SimpleNamespace(id=self._next_id)
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        if chat_id in self.fail_edit:
+            raise RuntimeError("message to edit not found")
+        self.edited.setdefault(chat_id, []).append((message_id, text))
+        return SimpleNamespace(id=message_id)
+
+
+class _RecordingBucket(TokenBucket):
+    """記錄 pause 的秒數，實際只暫停一下，讓測試不必真的等 FloodWait。"""
+
+    def __init__(self):
+        super().__init__(rate=1000)
+        self.pauses = []
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+        super().pause(0.01)
+
+
+def test_split_message_respects_limit_on_entry_boundaries():
+    entries = [f"{i:04d} " + "x" * 95 + "\n" for i in range(100)]
+    chunks = split_message(entries, header="<b>今日結果</b>\n", footer="-- end --")
+    assert len(chunks) == 3
+    assert all(len(chunk) <= TELEGRAM_MESSAGE_LIMIT for chunk in chunks)
+    assert chunks[0].startswith("<b>今日結果</b>\n")
+    assert chunks[-1].endswith("-- end --")
+    # 每一則都在條目之間切開，串起來與原文相同
+    assert "".join(chunks) == "<b>今日結果</b>\n" + "".join(entries) + "-- end --"
+    for chunk in chunks[1:]:
+        assert chunk[:4].isdigit()
+
+
+def test_split_message_breaks_oversized_entry_on_lines():
+    line = "y" * 99 + "\n"
+    entry = line * 60
+    chunks = split_message([entry], limit=1000)
+    assert [len(chunk) for chunk in chunks] == [1000] * 6
+    assert all(chunk.endswith("\n") for chunk in chunks)
+    assert "".join(chunks) == entry
+
+    # 單行超過上限時才硬切
+    assert split_message(["z" * 2500], limit=1000) == ["z" * 1000, "z" * 1000, "z" * 500]
+
+
+def test_floodwait_pauses_shared_bucket_and_resends():
+    client = _FakeClient(flood={1})
+    bucket = _RecordingBucket()
+    results = asyncio.run(broadcast(client, [1, 2], ["a", "b"], bucket=bucket))
+    assert results == {1: None, 2: None}
+    assert bucket.pauses == [2.0]
+    assert client.sent == {1: ["a", "b"], 2: ["a", "b"]}
+
+
+def test_floodwait_gives_up_after_max_retries():
+    class _AlwaysFlood(_FakeClient):
+        async def send_message(self, chat_id, text, **kwargs):
+            if chat_id == 1:
+                raise FloodWait(value=1)
+            return await super().send_message(chat_id, text, **kwargs)
+
+    client = _AlwaysFlood()
+    bucket = _RecordingBucket()
+    results = asyncio.run(broadcast(client, [1, 2], ["a"], bucket=bucket))
+    assert isinstance(results[1], FloodWait)
+    assert results[2] is None
+    assert client.sent == {2: ["a"]}
+
+
+def test_fan_out_is_concurrent_and_keeps_per_chat_order():
+    random.seed(7)
+    client = _FakeClient(delay=0.005)
+    chunks = [f"part {i}" for i in range(5)]
+    chat_ids = list(range(10))
+    results = asyncio.run(broadcast(client, chat_ids, chunks, bucket=TokenBucket(1000)))
+    assert results == {chat_id: None for chat_id in chat_ids}
+    assert client.sent == {chat_id: chunks for chat_id in chat_ids}
+    assert client.max_in_flight > 1
+
+
+def test_broadcast_edit_falls_back_to_sending_when_edit_fails():
+    client = _FakeClient(fail_edit={2})
+    bucket = TokenBucket(1000)
+
+    async def run():
+        message_ids = await broadcast_status(client, [1, 2], "掃描中…", bucket=bucket)
+        message_ids[3] = None
+        client.sent.clear()
+        return message_ids, await broadcast_edit(client, message_ids, ["first", "second"], bucket=bucket)
+
+    message_ids, results = asyncio.run(run())
+    assert results == {1: None, 2: None, 3: None}
+    assert client.edited == {1: [(message_ids[1], "first")]}
+    assert client.sent == {1: ["second"], 2: ["first", "second"], 3: ["first", "second"]}
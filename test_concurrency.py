@@ -0,0 +1,153 @@
+# test_concurrency.py
+import time
+import asyncio
+import threading
+
+import pytest
+
+import concurrency
+from concurrency import SingleFlight, run_blocking, set_concurrency
+
+
+@pytest.fixture
+def limit():
+    original = concurrency.SCAN_CONCURRENCY
+    yield set_concurrency
+    set_concurrency(original)
+
+
+def test_run_blocking_keeps_event_loop_responsive(limit):
+    limit(2)
+    ticks = []
+
+    def blocking():
+        time.sleep(0.2)
+        return threading.current_thread().name
+
+    async def ticker():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        task = asyncio.ensure_future(ticker())
+        name = await run_blocking(blocking)
+        task.cancel()
+        return name
+
+    name = asyncio.run(run())
+    assert name.startswith("scan")
+    assert name != threading.current_thread().name
+    # 阻塞的工作在執行緒池裡跑時，event loop 仍持續處理其他協程
+    assert len(ticks) >= 5
+
+
+def test_run_blocking_respects_scan_concurrency(limit):
+    limit(3)
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def work(i):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.02)
+        with lock:
+            active -= 1
+        return i * 2
+
+    async def run():
+        return await asyncio.gather(*(run_blocking(work, i) for i in range(12)))
+
+    assert asyncio.run(run()) == [i * 2 for i in range(12)]
+    assert peak == 3
+
+    # 調整上限後改用新的執行緒池
+    limit(1)
+    peak = 0
+    asyncio.run(run())
+    assert peak == 1
+
+
+def test_single_flight_do_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "bars"
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("2330", fetch) for _ in range(5)))
+        return results, flight.in_flight("2330")
+
+    results, still_running = asyncio.run(run())
+    assert results == ["bars"] * 5
+    assert calls == [1]
+    assert not still_running
+
+
+def test_single_flight_do_propagates_errors_to_every_waiter():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("download failed")
+
+    async def run():
+        outcomes = await asyncio.gather(*(flight.do("2330", fetch) for _ in range(3)), return_exceptions=True)
+        # 失敗後不留在 in-flight，下一次呼叫會重新執行
+        retry = await asyncio.gather(flight.do("2330", fetch), return_exceptions=True)
+        return outcomes + retry
+
+    outcomes = asyncio.run(run())
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert calls == [1, 1]
+
+
+def test_single_flight_do_many_shares_overlapping_keys():
+    flight = SingleFlight()
+    batches = []
+
+    async def fetch(keys):
+        batches.append(sorted(keys))
+        await asyncio.sleep(0.01)
+        # 缺少的 key 代表下載失敗
+        return {key: f"bars-{key}" for key in keys if key != "9999"}
+
+    async def run():
+        first = asyncio.ensure_future(flight.do_many(["2330", "2317", "9999"], fetch))
+        await asyncio.sleep(0)
+        second = flight.do_many(["2317", "2454", "9999"], fetch)
+        single = flight.do("2330", lambda: fetch(["2330"]))
+        return await asyncio.gather(first, second, single)
+
+    first, second, single = asyncio.run(run())
+    assert batches == [["2317", "2330", "9999"], ["2454"]]
+    assert first == {"2330": "bars-2330", "2317": "bars-2317"}
+    assert second == {"2317": "bars-2317", "2454": "bars-2454"}
+    assert single == "bars-2330"
+
+
+def test_single_flight_do_many_propagates_batch_errors():
+    flight = SingleFlight()
+
+    async def fail(keys):
+        await asyncio.sleep(0.01)
+        raise ConnectionError("provider down")
+
+    async def run():
+        first = asyncio.ensure_future(flight.do_many(["2330", "2317"], fail))
+        await asyncio.sleep(0)
+        waiter = flight.do("2330", fail)
+        outcomes = await asyncio.gather(first, waiter, return_exceptions=True)
+        return outcomes, flight.in_flight("2330") or flight.in_flight("2317")
+
+    outcomes, still_running = asyncio.run(run())
+    assert all(isinstance(outcome, ConnectionError) for outcome in outcomes)
+    assert not still_running
@@ -0,0 +1,313 @@
+# test_fetch.py
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import get_stock_position as gsp
+from fetch_guard import CircuitOpen, FetchGuard, ProviderThrottled, ProviderUnavailable, raise_for_errors
+from price_store import PriceStore
+from rate_limit import AdaptiveRateLimiter, CircuitBreaker
+
+
+def _bars(days: int = 30) -> pd.DataFrame:
+    index = pd.bdate_range(end=pd.Timestamp.now().normalize(), periods=days)
+    close = np.linspace(100, 110, days)
+    return pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close, "Volume": 1000.0}, index=index)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = PriceStore(str(tmp_path / "prices.sqlite"))
+    monkeypatch.setattr(gsp, "_price_store", store)
+    # 測試不等待：重試不退避、斷路器門檻高到不會觸發
+    guard = FetchGuard(limiter=AdaptiveRateLimiter(1000, 1, 1000, 10, capacity=1000),
+                       breaker=CircuitBreaker(1000, 0, 0), max_retries=1, sleep=lambda _: None)
+    monkeypatch.setattr(gsp, "fetch_guard", guard)
+    monkeypatch.setattr(gsp, "_download", gsp._download)
+    yield store
+    store.close()
+
+
+def test_single_empty_result_is_cached_as_unresolved(store):
+    gsp.set_price_provider(lambda tickers, **kwargs: pd.DataFrame())
+    assert np.isnan(gsp.get_ma_position_data("9999")["現價"])
+    assert store.suffix_order("9999") == []
+
+
+def test_single_download_failure_is_not_cached(store):
+    def provider(tickers, **kwargs):
+        raise ConnectionError("connection reset")
+
+    gsp.set_price_provider(provider)
+    assert np.isnan(gsp.get_ma_position_data("2330")["現價"])
+    assert store.get_symbol("2330") is None
+    assert store.suffix_order("2330") == [".TW", ".TWO"]
+
+
+def test_batch_download_failure_is_not_cached(store):
+    def provider(tickers, **kwargs):
+        if tickers == ["2330.TW", "9999.TW"]:
+            raise ConnectionError("connection reset")
+        return pd.DataFrame()
+
+    gsp.set_price_provider(provider)
+    bars = gsp.get_bars_batch(["2330", "9999"])
+    assert bars["2330"].empty and bars["9999"].empty
+    assert store.get_symbol("2330") is None
+    assert store.get_symbol("9999") is None
+
+
+def test_batch_resolves_found_and_caches_missing(store):
+    def provider(tickers, **kwargs):
+        frames = {t: _bars() for t in tickers if t == "2330.TW"}
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1)
+
+    gsp.set_price_provider(provider)
+    bars = gsp.get_bars_batch(["2330", "9999"])
+    assert not bars["2330"].empty
+    assert store.get_symbol("2330")[0] == ".TW"
+    assert store.suffix_order("9999") == []
+
+
+# ---- yf.download 只記錄、不拋出的錯誤 ----
+yf_logger = logging.getLogger("yfinance")
+
+
+def _log_failures(tickers, error):
+    """模仿 yf.download 結束時的錯誤彙總。"""
+    yf_logger.error(f"\n{len(tickers)} Failed download:")
+    yf_logger.error(f"{list(tickers)}: {error}")
+
+
+def test_raise_for_errors_only_looks_at_requested_tickers():
+    errors = {"2330.TW": "Read timed out", "2317.TW": "YFRateLimitError('Too Many Requests')",
+              "9999.TW": "possibly delisted; no price data found"}
+    raise_for_errors(errors, ["9999.TW", "1101.TW"])
+    with pytest.raises(ProviderUnavailable):
+        raise_for_errors(errors, ["2330.TW"])
+    with pytest.raises(ProviderThrottled):
+        raise_for_errors(errors, ["2330.TW", "2317.TW"])
+
+
+def test_logged_timeout_is_retried_through_fetch_guard(store):
+    calls = []
+
+    def provider(tickers, **kwargs):
+        calls.append(tickers)
+        if len(calls) == 1:
+            _log_failures([tickers], "DNSError('Failed to perform, curl: (6) Could not resolve host')")
+            return pd.DataFrame()
+        return _bars()
+
+    gsp.set_price_provider(provider)
+    data = gsp.get_ma_position_data("2330")
+    assert calls == ["2330.TW", "2330.TW"]
+    assert not np.isnan(data["現價"])
+    assert gsp.fetch_guard.stats()["retries"] == 1
+
+
+def test_persistent_logged_outage_is_not_cached_as_unresolved(store):
+    def provider(tickers, **kwargs):
+        _log_failures([tickers], "Read timed out. (read timeout=10)")
+        return pd.DataFrame()
+
+    gsp.set_price_provider(provider)
+    assert np.isnan(gsp.get_ma_position_data("2330")["現價"])
+    assert store.get_symbol("2330") is None
+    assert gsp.fetch_guard.stats()["failed"] == 2
+
+
+def test_errors_logged_by_other_calls_are_ignored(store):
+    def other_thread():
+        _log_failures(["2330.TW"], "Read timed out")
+
+    def provider(tickers, **kwargs):
+        # 另一個執行緒的下載、以及同一個執行緒中其他 ticker 的錯誤都不影響這次請求
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+        _log_failures(["1101.TW"], "Read timed out")
+        return _bars()
+
+    gsp.set_price_provider(provider)
+    assert not np.isnan(gsp.get_ma_position_data("2330")["現價"])
+    assert gsp.fetch_guard.stats()["retries"] == 0
+
+
+def test_logged_throttle_slows_the_limiter(store):
+    calls = []
+
+    def provider(tickers, **kwargs):
+        calls.append(tickers)
+        if len(calls) == 1:
+            _log_failures([tickers], "YFRateLimitError('Too Many Requests. Rate limited. Try after a while.')")
+            return pd.DataFrame()
+        return _bars()
+
+    gsp.set_price_provider(provider)
+    rate = gsp.fetch_guard.limiter.rate
+    gsp.get_ma_position_data("2330")
+    assert gsp.fetch_guard.stats()["throttled"] == 1
+    assert gsp.fetch_guard.limiter.rate < rate + gsp.fetch_guard.limiter.increase
+
+
+# ---- 斷路器：斷路期間立即放棄，half_open 只放行一個試探 ----
+def _guard(threshold: int = 2, cooldown: float = 0.05, max_retries: int = 0) -> FetchGuard:
+    return FetchGuard(limiter=AdaptiveRateLimiter(1000, 1, 1000, 10, capacity=1000),
+                      breaker=CircuitBreaker(threshold, cooldown, 10 * cooldown),
+                      max_retries=max_retries, sleep=lambda _: None)
+
+
+def _unreachable(*args, **kwargs):
+    raise ConnectionError("connection reset")
+
+
+def test_open_breaker_fails_fast_without_calling_provider():
+    guard = _guard(cooldown=60)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            guard.call(_unreachable)
+    assert guard.breaker.state == "open"
+
+    calls = []
+    started = time.monotonic()
+    with pytest.raises(CircuitOpen):
+        guard.call(lambda: calls.append(1))
+    assert time.monotonic() - started < 1
+    assert calls == []
+    assert guard.stats()["breaker_opened"] == 1
+    assert guard.stats()["breaker_rejected"] == 1
+
+
+def test_breaker_opening_mid_retry_stops_retrying():
+    guard = _guard(threshold=2, max_retries=5)
+    calls = []
+
+    def provider():
+        calls.append(1)
+        raise ConnectionError("connection reset")
+
+    with pytest.raises(CircuitOpen):
+        guard.call(provider)
+    assert len(calls) == 2
+
+
+def test_half_open_lets_a_single_probe_through():
+    guard = _guard()
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            guard.call(_unreachable)
+    time.sleep(0.06)
+
+    probing = threading.Event()
+    finish = threading.Event()
+    calls = []
+
+    def slow_provider():
+        calls.append(threading.current_thread().name)
+        probing.set()
+        finish.wait(5)
+        return "ok"
+
+    probe = threading.Thread(target=lambda: guard.call(slow_provider), name="probe")
+    probe.start()
+    assert probing.wait(5)
+    # 試探還沒有結果時，其他呼叫端一律被拒絕
+    with ThreadPoolExecutor(4) as pool:
+        outcomes = list(pool.map(lambda _: _try(guard, slow_provider), range(4)))
+    assert outcomes == ["rejected"] * 4
+    finish.set()
+    probe.join(5)
+    assert calls == ["probe"]
+    assert guard.breaker.state == "closed"
+    assert guard.call(lambda: "ok") == "ok"
+
+
+def _try(guard: FetchGuard, func) -> str:
+    try:
+        guard.call(func)
+        return "ok"
+    except CircuitOpen:
+        return "rejected"
+
+
+def test_failed_probe_reopens_with_longer_cooldown():
+    guard = _guard()
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            guard.call(_unreachable)
+    time.sleep(0.06)
+    with pytest.raises(ConnectionError):
+        guard.call(_unreachable)
+    assert guard.breaker.state == "open"
+    assert guard.breaker.cooldown == pytest.approx(0.1)
+    with pytest.raises(CircuitOpen):
+        guard.call(lambda: "ok")
+
+
+def test_fatal_probe_error_hands_the_probe_to_the_next_caller():
+    guard = _guard()
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            guard.call(_unreachable)
+    time.sleep(0.06)
+
+    def broken():
+        raise ValueError("bad arguments")
+
+    with pytest.raises(ValueError):
+        guard.call(broken)
+    assert guard.breaker.state == "half_open"
+    assert guard.call(lambda: "ok") == "ok"
+    assert guard.breaker.state == "closed"
+
+
+def test_rejected_ticker_is_not_cached_as_unresolved(store):
+    gsp.fetch_guard.breaker = CircuitBreaker(1, 60, 60)
+    gsp.fetch_guard.breaker.record_failure()
+    calls = []
+    gsp.set_price_provider(lambda tickers, **kwargs: calls.append(tickers) or _bars())
+    assert np.isnan(gsp.get_ma_position_data("2330")["現價"])
+    assert calls == []
+    assert store.get_symbol("2330") is None
+
+
+def test_fresh_batch_failure_is_not_cached_and_stale_still_served(store):
+    store.upsert("2330.TW", _bars())
+    store.set_symbols({"2330": ".TW"})
+
+    def provider(tickers, **kwargs):
+        if "period" in kwargs:
+            raise ConnectionError("connection reset")
+        return pd.concat({t: _bars(3) for t in tickers}, axis=1)
+
+    gsp.set_price_provider(provider)
+    bars = gsp.get_bars_batch(["2330", "9999"])
+    assert not bars["2330"].empty
+    assert bars["9999"].empty
+    assert store.get_symbol("9999") is None
+
+
+def test_analyze_batch_reports_rejected_tickers_as_failed(store):
+    gsp.fetch_guard.breaker = CircuitBreaker(1, 60, 60)
+    gsp.fetch_guard.breaker.record_failure()
+    gsp.set_price_provider(lambda tickers, **kwargs: pytest.fail("斷路中不應送出請求"))
+    failed = set()
+    results = gsp.analyze_stocks_batch(["2330", "2317"], failed=failed)
+    assert failed == {"2330", "2317"}
+    assert np.isnan(results["2330"][0]["現價"])
+
+
+def test_rate_limiter_share_splits_the_configured_budget():
+    import fetch_guard
+    whole, quarter = fetch_guard.rate_limiter(), fetch_guard.rate_limiter(0.25)
+    assert quarter.rate == pytest.approx(whole.rate / 4)
+    assert quarter.max_rate == pytest.approx(whole.max_rate / 4)
+    assert quarter.min_rate == pytest.approx(whole.min_rate / 4)
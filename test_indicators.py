@@ -0,0 +1,99 @@
+# test_indicators.py
+import numpy as np
+import pandas as pd
+
+import get_stock_position as gsp
+import indicators
+
+
+def _bars(days: int = 80, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range("2024-01-01", periods=days)
+    close = np.round(100 + np.cumsum(rng.normal(0, 1, days)), 2)
+    volume = rng.integers(1_000, 50_000, days).astype(float)
+    return pd.DataFrame({"Close": close, "Volume": volume}, index=index)
+
+
+def test_score_bars_aligns_volume_with_close_rows(monkeypatch):
+    monkeypatch.setattr(indicators, "EXTRA_INDICATORS", ["VOL_MA5", "VOL_MA20", "EMA12"])
+    gappy = _bars(seed=1)
+    gappy.iloc[-3, gappy.columns.get_loc("Close")] = np.nan     # 有成交量、沒有收盤價
+    gappy.iloc[-7, gappy.columns.get_loc("Volume")] = np.nan    # 有收盤價、沒有成交量
+    bars = {"2330": gappy, "2317": _bars(seed=2)}
+
+    frame = gsp.score_bars(bars)
+    for code, frame_bars in bars.items():
+        single = gsp._compute_ma_data(code, frame_bars["Close"], frame_bars["Volume"])
+        for name in ("VOL_MA5", "VOL_MA20", "EMA12"):
+            assert frame.at[code, name] == single[name]
+
+
+def test_required_bars_and_history_period():
+    assert indicators.required_bars(["MA5"]) == 5
+    assert indicators.required_bars(["MA240"]) == 240
+    # RSI 多一根用來算第一個漲跌幅；聯集取最長的 lookback
+    assert indicators.required_bars(["RSI14"]) == 12 * 14 + 1
+    assert indicators.required_bars(["MA240", "EMA60", "RSI6"]) == 6 * 60
+    assert indicators.history_period(["MA5"]) == "3mo"
+    assert indicators.history_period(["EMA12", "RSI6"]) == "6mo"
+    assert indicators.history_period(["RSI14"]) == "1y"
+    assert indicators.history_period(["MA240"]) == "2y"
+    assert indicators.history_period(["EMA60"]) == "2y"
+
+
+def test_history_period_covers_required_bars():
+    for name in indicators.INDICATORS:
+        period = indicators.history_period([name])
+        days = dict(indicators._PERIOD_DAYS)[period]
+        assert days / 365 * indicators.TRADING_DAYS_PER_YEAR >= indicators.required_bars([name])
+
+
+def _close_matrix():
+    series = [_bars(500, seed)["Close"] for seed in range(4)]
+    series[1].iloc[[100, 250, 480, 495]] = np.nan   # 中間有缺值
+    series[2].iloc[:490] = np.nan                   # 只有 10 根 K 棒
+    series[3].iloc[:300] = np.nan                   # 上市不久
+    return pd.concat(series, axis=1).to_numpy()
+
+
+def test_compute_latest_ema_matches_pandas_ewm():
+    close = _close_matrix()
+    names = ["EMA12", "EMA26", "EMA60"]
+    latest = indicators.compute_latest(close, names=names)
+    for name in names:
+        ind = indicators.INDICATORS[name]
+        for col in range(close.shape[1]):
+            valid = pd.Series(close[:, col]).dropna()
+            if len(valid) < ind.period:
+                assert np.isnan(latest[name][col])
+                continue
+            expected = valid.tail(ind.lookback).ewm(span=ind.period, adjust=False).mean().iloc[-1]
+            assert abs(latest[name][col] - expected) <= 0.005 + 1e-9
+            # lookback 已足夠：與完整歷史算出的 EMA 在兩位小數內一致
+            full = valid.ewm(span=ind.period, adjust=False).mean().iloc[-1]
+            assert abs(latest[name][col] - full) <= 0.01
+
+
+def test_compute_latest_rsi_matches_pandas_wilder():
+    close = _close_matrix()
+    names = ["RSI6", "RSI14"]
+    latest = indicators.compute_latest(close, names=names)
+    for name in names:
+        ind = indicators.INDICATORS[name]
+        for col in range(close.shape[1]):
+            valid = pd.Series(close[:, col]).dropna()
+            if len(valid) <= ind.period:
+                assert np.isnan(latest[name][col])
+                continue
+            diff = valid.tail(ind.lookback + 1).diff().dropna()
+            gain = diff.clip(lower=0).ewm(alpha=1 / ind.period, adjust=False).mean().iloc[-1]
+            loss = (-diff).clip(lower=0).ewm(alpha=1 / ind.period, adjust=False).mean().iloc[-1]
+            expected = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+            assert abs(latest[name][col] - expected) <= 0.005 + 1e-9
+
+
+def test_compute_latest_without_volume_returns_nan():
+    close = _close_matrix()
+    latest = indicators.compute_latest(close, names=["MA5", "VOL_MA5"])
+    assert np.isnan(latest["VOL_MA5"]).all()
+    assert not np.isnan(latest["MA5"]).any()
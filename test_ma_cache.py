@@ -0,0 +1,80 @@
+# test_ma_cache.py
+import datetime
+
+import pytest
+
+import ma_cache
+from ma_cache import TAIPEI, TradingDayCache, last_trading_session
+
+
+def _at(day, hour, minute=0):
+    # 2026-10-12 是星期一
+    return datetime.datetime(2026, 10, day, hour, minute, tzinfo=TAIPEI)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"value": _at(12, 14)}
+    monkeypatch.setattr(ma_cache, "_now", lambda: now["value"])
+
+    def set_time(value):
+        now["value"] = value
+    return set_time
+
+
+def test_last_trading_session():
+    assert last_trading_session(_at(12, 9)) == datetime.date(2026, 10, 9)    # 週一開盤前 → 上週五
+    assert last_trading_session(_at(12, 13, 30)) == datetime.date(2026, 10, 12)
+    assert last_trading_session(_at(13, 13, 29)) == datetime.date(2026, 10, 12)
+    assert last_trading_session(_at(17, 20)) == datetime.date(2026, 10, 16)  # 週六 → 週五
+
+
+def test_after_close_entry_lives_until_next_close(clock):
+    cache = TradingDayCache(maxsize=8, intraday_ttl=600)
+    clock(_at(12, 14))
+    cache.put("2330", "ma")
+    clock(_at(13, 9, 30))
+    assert cache.get("2330") == "ma"
+    clock(_at(13, 13, 29))
+    assert cache.get("2330") == "ma"
+    # 週二收盤後屬於新的交易日
+    clock(_at(13, 13, 31))
+    assert cache.get("2330") is None
+
+
+def test_friday_entry_survives_the_weekend(clock):
+    cache = TradingDayCache(maxsize=8, intraday_ttl=600)
+    clock(_at(16, 15))
+    cache.put("2330", "ma")
+    for moment in (_at(17, 12), _at(18, 23), _at(19, 10)):
+        clock(moment)
+        assert cache.get("2330") == "ma"
+    clock(_at(19, 13, 30))
+    assert cache.get("2330") is None
+
+
+def test_intraday_entry_expires_after_ttl(clock):
+    cache = TradingDayCache(maxsize=8, intraday_ttl=600)
+    clock(_at(13, 10))
+    cache.put("2330", "ma")
+    clock(_at(13, 10, 9))
+    assert cache.get("2330") == "ma"
+    clock(_at(13, 10, 10))
+    assert cache.get("2330") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_eviction_keeps_recently_used(clock):
+    cache = TradingDayCache(maxsize=2, intraday_ttl=600)
+    cache.put("2330", 1)
+    cache.put("2317", 2)
+    assert cache.get("2330") == 1
+    cache.put("2454", 3)
+    assert cache.get("2317") is None
+    assert cache.get("2330") == 1
+    assert cache.get("2454") == 3
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["size"] == 2
+    assert stats["hit_rate"] == pytest.approx(3 / 4)
@@ -0,0 +1,64 @@
+# test_ma_engine.py
+import numpy as np
+import pandas as pd
+
+import get_stock_position as gsp
+from ma_engine import MA_PERIODS, close_matrix_from_series, score_close_matrix
+
+
+def _random_closes(count: int, seed: int = 0) -> dict:
+    """以 0.05 元跳動的隨機收盤價，含缺值與不足 240 根的短歷史，讓 .xx5 的均值經常出現。"""
+    rng = np.random.default_rng(seed)
+    closes = {}
+    for i in range(count):
+        length = int(rng.integers(1, 320))
+        steps = rng.integers(-4, 5, size=length) * 0.05
+        values = np.round(np.maximum(50 + np.cumsum(steps), 1.0), 2)
+        values[rng.random(length) < 0.05] = np.nan
+        closes[f"{1000 + i}"] = pd.Series(values, index=pd.bdate_range("2020-01-01", periods=length))
+    return closes
+
+
+def _on_rounding_tie(mean: float) -> bool:
+    scaled = mean * 100
+    return abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+
+
+def _scalar_ma(close: pd.Series, n: int) -> float:
+    """原本單檔路徑的算法：去掉缺值後 rolling(n).mean() 的最後一個值，四捨五入到兩位。"""
+    ma_row = close.dropna().rolling(n).mean().dropna().tail(1)
+    return np.nan if ma_row.empty else round(float(ma_row.item()), 2)
+
+
+def test_engine_matches_scalar_rolling_mean_exactly():
+    closes = _random_closes(500)
+    frame = score_close_matrix(close_matrix_from_series(closes, rows=320))
+    ties = 0
+    for code, close in closes.items():
+        ma_data = gsp._compute_ma_data(code, close)
+        row = frame.loc[code]
+        assert row["現價"] == ma_data["現價"] or (np.isnan(row["現價"]) and np.isnan(ma_data["現價"]))
+        for n in MA_PERIODS:
+            expected = _scalar_ma(close, n)
+            for value in (ma_data[f"MA{n}"], row[f"MA{n}"]):
+                assert value == expected or (np.isnan(value) and np.isnan(expected))
+            if not np.isnan(expected):
+                ties += _on_rounding_tie(close.dropna().rolling(n).mean().iloc[-1])
+
+        status = gsp.get_ma_alignment_from_data(ma_data)
+        scores = gsp.calculate_ma_scores(ma_data)
+        assert row["趨勢"] == status
+        assert row["MA買點分數"] == scores["MA買點分數"]
+        assert row["買點判斷"] == scores["買點判斷"]
+        for key in ("D240", "D60", "D20"):
+            assert row[key] == scores[key] or (np.isnan(row[key]) and np.isnan(scores[key]))
+    # 以跳動單位報價時 .xx5 的均值並不罕見，確認測試資料確實涵蓋這些情況
+    assert ties > 0
+
+
+def test_engine_is_independent_of_batch_composition():
+    closes = _random_closes(50, seed=1)
+    together = score_close_matrix(close_matrix_from_series(closes))
+    for code, close in list(closes.items())[:10]:
+        alone = score_close_matrix(close_matrix_from_series({code: close}))
+        pd.testing.assert_series_equal(alone.loc[code], together.loc[code])
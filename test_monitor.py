@@ -0,0 +1,63 @@
+# test_monitor.py
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import monitor
+from ma_engine import MA_PERIODS
+from monitor import StreamingMA, TickerState
+
+
+def _full_recompute(closed, price):
+    values = list(closed) + [price]
+    return {n: float(np.mean(values[-n:])) if len(values) >= n else np.nan for n in MA_PERIODS}
+
+
+def test_streaming_ma_matches_full_recompute_across_resync():
+    rng = np.random.default_rng(0)
+    prices = np.round(100 + np.cumsum(rng.normal(0, 1, 900)), 2)
+    ma = StreamingMA()
+    ma.seed(prices[:100])
+    closed = list(prices[:100])
+    # 跨過數次 RESYNC_BARS 的重新加總，途中每一根都與完整重算比較
+    for close in prices[100:]:
+        for n, value in ma.values(close).items():
+            expected = _full_recompute(closed, close)[n]
+            if np.isnan(expected):
+                assert np.isnan(value)
+            else:
+                assert abs(value - expected) <= 1e-9 * abs(expected), n
+        ma.commit(close)
+        closed.append(close)
+    assert len(prices) - 100 > 3 * monitor.RESYNC_BARS
+
+
+def test_streaming_ma_resync_restores_exact_sums():
+    rng = np.random.default_rng(1)
+    prices = 100 + rng.normal(0, 1, monitor.RESYNC_BARS * 2)
+    ma = StreamingMA()
+    ma.seed(prices[:10])
+    for close in prices[10:monitor.RESYNC_BARS + 10]:
+        ma.commit(close)
+    history = list(ma.closed)
+    for n in MA_PERIODS:
+        assert ma.sums[n] == float(sum(history[len(history) - (n - 1):]))
+
+
+def test_ticker_state_commits_bar_on_new_day():
+    closes = pd.Series(np.linspace(100, 130, 300), index=pd.bdate_range("2023-01-02", periods=300))
+    state = TickerState("2330")
+    state.seed(closes)
+    last_day = closes.index[-1].to_pydatetime()
+
+    # 同一天的報價只覆蓋最新一根
+    state.on_price(131.0, last_day + datetime.timedelta(hours=10))
+    expected = _full_recompute(closes.to_numpy()[:-1], 131.0)
+    assert state.evaluation["ma_data"]["MA5"] == round(expected[5], 2)
+
+    # 換日時先把 131 收盤，再以新價格計算
+    state.on_price(140.0, last_day + datetime.timedelta(days=1, hours=10))
+    expected = _full_recompute(list(closes.to_numpy()[:-1]) + [131.0], 140.0)
+    for n in MA_PERIODS:
+        assert abs(state.evaluation["ma_data"][f"MA{n}"] - expected[n]) <= 0.005 + 1e-9
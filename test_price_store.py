@@ -0,0 +1,71 @@
+# test_price_store.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from price_store import PriceStore, sync_history, sync_history_batch
+
+
+def _ohlcv(start: str, days: int, base: float = 100.0) -> pd.DataFrame:
+    index = pd.bdate_range(start, periods=days)
+    close = base + np.arange(days, dtype=float)
+    return pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close, "Volume": 1000.0},
+                        index=index)
+
+
+def _grouped(frames: dict) -> pd.DataFrame:
+    """模仿 yf.download(group_by="ticker") 的兩層欄位。"""
+    return pd.concat(frames, axis=1)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PriceStore(str(tmp_path / "prices.sqlite"))
+    yield store
+    store.close()
+
+
+def test_fresh_download_failure_still_serves_stale_tickers(store):
+    store.upsert("2330.TW", _ohlcv("2024-01-01", 30))
+
+    def download(tickers, **kwargs):
+        if "period" in kwargs:
+            raise ConnectionError("connection reset")
+        return _grouped({t: _ohlcv("2024-02-08", 5, base=128.0) for t in tickers})
+
+    available = sync_history_batch(store, ["2330.TW", "2317.TW"], download)
+    assert available == {"2317.TW": None, "2330.TW": True}
+    assert len(store.load("2330.TW")) == 33
+
+
+def test_full_resync_failure_keeps_local_data_for_that_ticker_only(store):
+    for ticker in ("2330.TW", "2317.TW"):
+        store.upsert(ticker, _ohlcv("2024-01-01", 30))
+    full_requests = []
+
+    def download(tickers, **kwargs):
+        if isinstance(tickers, str):
+            full_requests.append(tickers)
+            if tickers == "2330.TW":
+                raise ConnectionError("connection reset")
+            return _ohlcv("2024-01-01", 32, base=50.0)
+        # 重疊的 K 棒收盤價不同：還原權值已改寫，需要全量重抓
+        return _grouped({t: _ohlcv("2024-02-08", 4, base=60.0) for t in tickers})
+
+    available = sync_history_batch(store, ["2330.TW", "2317.TW"], download)
+    assert available == {"2330.TW": True, "2317.TW": True}
+    assert full_requests == ["2330.TW", "2317.TW"]
+    assert store.load("2330.TW")["Close"].iloc[0] == 100.0
+    assert store.load("2317.TW")["Close"].iloc[0] == 50.0
+
+
+def test_single_full_resync_failure_keeps_local_data(store):
+    store.upsert("2330.TW", _ohlcv("2024-01-01", 30))
+
+    def download(ticker, **kwargs):
+        if "period" in kwargs:
+            raise ConnectionError("connection reset")
+        return _ohlcv("2024-02-08", 4, base=60.0)
+
+    assert sync_history(store, "2330.TW", download)
+    assert store.load("2330.TW")["Close"].iloc[0] == 100.0
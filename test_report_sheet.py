@@ -0,0 +1,258 @@
+# test_report_sheet.py
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import report_sheet
+from report_sheet import ReportIndex, diff_report_sheets, ingest_sheet, list_sheet_versions, load_sheet, prepare_report_sheet
+
+
+def _sheet(rows):
+    columns = ["股票代號", "公司名稱", "券商", "日期", "目標價", "EPS24", "EPS25", "EPS26", "EPS27",
+               "EPS25成長率(%)", "EPS26成長率(%)", "EPS27成長率(%)"]
+    return prepare_report_sheet(pd.DataFrame(rows, columns=columns))
+
+
+def _row(code, broker, date, target="100", growth=20.0):
+    return [code, f"公司{code}", broker, date, target, 1.0, 2.0, 3.0, 4.0, growth, growth, growth]
+
+
+def test_diff_report_sheets_added_changed_unchanged_removed():
+    old = _sheet([
+        _row("2330", "甲", "2025/11/12 12:00:00 AM"),
+        _row("2317", "甲", "2025/11/12 12:00:00 AM"),
+        _row("2454", "乙", "2025/11/10 12:00:00 AM"),
+    ])
+    new = _sheet([
+        _row("2330", "甲", "2025/11/12 12:00:00 AM"),                 # 不變
+        _row("2317", "甲", "2025/11/12 12:00:00 AM", target="120"),  # 目標價更新
+        _row("2603", "丙", "2025/11/13 12:00:00 AM"),                 # 新增
+    ])
+    diff = diff_report_sheets(old, new)
+    assert list(diff.added) == [2]
+    assert list(diff.changed) == [1]
+    assert list(diff.rows) == [1, 2]
+    assert diff.removed == 1
+    assert diff.tickers == ["2317", "2603"]
+
+
+def test_diff_report_sheets_matches_duplicate_keys_in_order():
+    old = _sheet([_row("2330", "甲", "2025/11/12 12:00:00 AM"), _row("2330", "甲", "2025/11/12 12:00:00 AM")])
+    new = _sheet([_row("2330", "甲", "2025/11/12 12:00:00 AM"), _row("2330", "甲", "2025/11/12 12:00:00 AM"),
+                  _row("2330", "甲", "2025/11/12 12:00:00 AM", growth=30.0)])
+    diff = diff_report_sheets(old, new)
+    assert list(diff.added) == [2]
+    assert len(diff.changed) == 0
+
+
+def test_diff_report_sheets_without_previous_version_adds_everything():
+    new = _sheet([_row("2330", "甲", "2025/11/12 12:00:00 AM"), _row("2317", "乙", "2025/11/12 12:00:00 AM")])
+    diff = diff_report_sheets(None, new)
+    assert list(diff.added) == [0, 1]
+    assert diff.summary().startswith("新增 2 筆、更新 0 筆、移除 0 筆")
+
+
+def test_identical_sheet_has_no_changes():
+    rows = [_row("2330", "甲", "2025/11/12 12:00:00 AM"), _row("2317", "乙", "2025/11/12 12:00:00 AM")]
+    diff = diff_report_sheets(_sheet(rows), _sheet(rows))
+    assert len(diff.rows) == 0 and diff.removed == 0 and diff.tickers == []
+
+
+def test_report_index_normalizes_short_code_queries():
+    sheet = _sheet([_row(50, "甲", "2025/11/12 12:00:00 AM"), _row("2330", "乙", "2025/11/12 12:00:00 AM")])
+    index = ReportIndex(sheet)
+    assert list(index.lookup("50")) == [0]
+    assert list(index.lookup(" 0050 ")) == [0]
+    assert list(index.lookup("2330")) == [1]
+    assert list(index.lookup("2331")) == []
+
+
+# ---- 上傳：壞掉的表格不能取代上一份好的報告表 ----
+_COLUMNS = ["股票代號", "公司名稱", "券商", "日期", "目標價", "EPS24", "EPS25", "EPS26", "EPS27",
+            "EPS25成長率(%)", "EPS26成長率(%)", "EPS27成長率(%)"]
+
+
+def _write_excel(path, rows, columns=_COLUMNS):
+    pd.DataFrame(rows, columns=columns).to_excel(path, index=False)
+    return str(path)
+
+
+def test_ingest_sheet_registers_a_prepared_version(tmp_path):
+    directory = str(tmp_path / "sheets")
+    upload = _write_excel(tmp_path / "good.xlsx", [_row(2330, "甲", "2025/11/12 12:00:00 AM")])
+    version, frame, header = ingest_sheet(upload, source_name="good.xlsx", directory=directory)
+    assert header == _COLUMNS
+    assert frame.at[0, "股票代號"] == "2330"
+    assert report_sheet.CANDIDATE_COLUMN in frame.columns
+    assert [e["version"] for e in list_sheet_versions(directory)] == [version]
+    assert load_sheet(directory=directory)[1].at[0, "股票代號"] == "2330"
+
+
+def test_ingest_sheet_rejects_bad_header_before_writing(tmp_path):
+    directory = str(tmp_path / "sheets")
+    good = _write_excel(tmp_path / "good.xlsx", [_row("2330", "甲", "2025/11/12 12:00:00 AM")])
+    version, _, _ = ingest_sheet(good, directory=directory)
+
+    columns = ["代號"] + _COLUMNS[1:]
+    bad = _write_excel(tmp_path / "bad.xlsx", [_row("2317", "乙", "2025/11/13 12:00:00 AM")], columns)
+    with pytest.raises(ValueError, match="股票代號"):
+        ingest_sheet(bad, directory=directory)
+
+    # 上一份報告表仍是最新版本，目錄裡沒有留下壞檔或暫存檔
+    assert [e["version"] for e in list_sheet_versions(directory)] == [version]
+    restored_version, restored = load_sheet(directory=directory)
+    assert restored_version == version
+    assert list(restored["股票代號"]) == ["2330"]
+    assert sorted(os.listdir(directory)) == sorted([f"{version}.feather", "manifest.json"])
+
+
+def test_ingest_sheet_keeps_previous_version_when_prepare_fails(tmp_path, monkeypatch):
+    directory = str(tmp_path / "sheets")
+    good = _write_excel(tmp_path / "good.xlsx", [_row("2330", "甲", "2025/11/12 12:00:00 AM")])
+    version, _, _ = ingest_sheet(good, directory=directory)
+
+    def broken(df):
+        raise ValueError("無法轉換")
+
+    monkeypatch.setattr(report_sheet, "prepare_report_sheet", broken)
+    second = _write_excel(tmp_path / "second.xlsx", [_row("2317", "乙", "2025/11/13 12:00:00 AM")])
+    with pytest.raises(ValueError):
+        ingest_sheet(second, directory=directory)
+    assert [e["version"] for e in list_sheet_versions(directory)] == [version]
+    assert sorted(os.listdir(directory)) == sorted([f"{version}.feather", "manifest.json"])
+
+
+# ---- 快照保存與啟動時讀回 ----
+def test_saved_sheet_reloads_like_startup(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_sheet, "SHEET_HISTORY_LIMIT", 2)
+    directory = str(tmp_path / "sheets")
+    versions = []
+    for date in ["2025/11/10 12:00:00 AM", "2025/11/11 12:00:00 AM", "2025/11/12 12:00:00 AM"]:
+        sheet = _sheet([_row("2330", "甲", date), _row(50, "乙", date, growth=-5.0)])
+        versions.append(report_sheet.save_sheet(sheet, source_name="upload.xlsx", directory=directory))
+
+    # 只保留最近 SHEET_HISTORY_LIMIT 版，較舊的檔案已刪除
+    entries = list_sheet_versions(directory)
+    assert [e["version"] for e in entries] == versions[1:]
+    assert entries[-1]["rows"] == 2 and entries[-1]["source"] == "upload.xlsx"
+    assert not os.path.exists(os.path.join(directory, f"{versions[0]}.feather"))
+    assert load_sheet(versions[0], directory=directory) is None
+    assert load_sheet(versions[1], directory=directory)[1].at[0, "日期"] == "2025/11/11 12:00:00 AM"
+
+    # 與 restore_latest_sheet 相同：只讀報告表欄位，再重新正規化
+    version, raw = load_sheet(directory=directory, columns=report_sheet.SHEET_COLUMNS + ["不存在的欄位"])
+    assert version == versions[-1]
+    assert list(raw.columns) == report_sheet.SHEET_COLUMNS
+    restored = prepare_report_sheet(raw)
+    expected = _sheet([_row("2330", "甲", "2025/11/12 12:00:00 AM"), _row(50, "乙", "2025/11/12 12:00:00 AM", growth=-5.0)])
+    pd.testing.assert_frame_equal(restored, expected)
+
+
+def test_load_sheet_without_versions_returns_none(tmp_path):
+    assert load_sheet(directory=str(tmp_path / "empty")) is None
+    assert list_sheet_versions(str(tmp_path / "empty")) == []
+
+
+# ---- 上傳時的正規化 ----
+def test_prepare_report_sheet_normalizes_raw_values():
+    raw = pd.DataFrame({
+        "股票代號": [2330.0, 50, " 2317 ", "6488"],
+        "公司名稱": [" 台積電 ", "元大台灣50", "鴻海", "環球晶"],
+        "券商": ["甲 ", "甲", "乙", "乙"],
+        "日期": ["2025/11/12 12:00:00 AM", " 2025/11/13 01:30:00 PM ", "not a date", "2025/11/10 12:00:00 AM"],
+        "目標價": ["1,200", " 150 ", "200.5", None],
+        "EPS26": ["12.3", 4.5, "", "x"],
+        "EPS26成長率(%)": ["20", 30.5, "N/A", 16],
+    })
+    df = prepare_report_sheet(raw)
+
+    assert df["股票代號"].tolist() == ["2330", "0050", "2317", "6488"]
+    assert df["公司名稱"].tolist() == ["台積電", "元大台灣50", "鴻海", "環球晶"]
+    assert isinstance(df["公司名稱"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["券商"].dtype, pd.CategoricalDtype)
+    assert df["券商"].tolist() == ["甲", "甲", "乙", "乙"]
+
+    # 缺少的欄位補上空值，EPS 為 float32、成長率為 float64
+    assert df["EPS24"].isna().all() and df["EPS25成長率(%)"].isna().all()
+    assert all(df[col].dtype == np.float32 for col in report_sheet.EPS_COLUMNS)
+    assert all(df[col].dtype == np.float64 for col in report_sheet.GROWTH_COLUMNS)
+    assert report_sheet.eps_values(df.iloc[0])[2] == 12.3
+    assert df["EPS26"].isna().tolist() == [False, False, True, True]
+    assert df["EPS26成長率(%)"].tolist()[:2] == [20.0, 30.5] and np.isnan(df.at[2, "EPS26成長率(%)"])
+
+    dates = df[report_sheet.DATE_COLUMN]
+    assert dates[0] == pd.Timestamp(2025, 11, 12) and dates[1] == pd.Timestamp(2025, 11, 13, 13, 30)
+    assert pd.isna(dates[2])
+    targets = df[report_sheet.TARGET_COLUMN]
+    assert np.isnan(targets[0]) and targets[1] == 150.0 and targets[2] == 200.5 and np.isnan(targets[3])
+
+
+def test_prepare_report_sheet_flags_latest_and_candidates():
+    df = _sheet([
+        _row("2330", "甲", "2025/11/10 12:00:00 AM"),
+        _row("2330", "甲", "2025/11/12 12:00:00 AM", growth=-1.0),  # 最新但未通過成長率條件
+        _row("2330", "乙", "壞掉的日期"),
+        _row("2330", "乙", "2025/11/01 12:00:00 AM"),
+    ])
+    assert df[report_sheet.GROWTH_MASK_COLUMN].tolist() == [True, False, True, True]
+    assert df[report_sheet.LATEST_COLUMN].tolist() == [False, True, False, True]
+    assert df[report_sheet.CANDIDATE_COLUMN].tolist() == [True, False, False, True]
+
+
+def test_ingest_sheet_normalizes_at_upload(tmp_path):
+    directory = str(tmp_path / "sheets")
+    rows = [_row(2330.0, " 甲 ", "2025/11/12 12:00:00 AM"), _row(50, "乙", "2025/11/12 12:00:00 AM")]
+    rows[1][5] = "1.1"
+    upload = _write_excel(tmp_path / "upload.xlsx", rows)
+    version, frame, _ = ingest_sheet(upload, directory=directory, chunk_rows=1)
+    assert frame["股票代號"].tolist() == ["2330", "0050"]
+    assert frame["券商"].tolist() == ["甲", "乙"]
+    assert isinstance(frame["券商"].dtype, pd.CategoricalDtype)
+    assert frame["EPS24"].dtype == np.float32 and frame.at[1, "EPS24"] == np.float32(1.1)
+
+    # 快照裡存的是正規化後的值
+    _, stored = load_sheet(version, directory=directory)
+    assert stored["股票代號"].tolist() == ["2330", "0050"]
+    assert stored["券商"].tolist() == ["甲", "乙"]
+
+
+# ---- 成長率篩選：向量化結果與原本 daily_job 的逐列迴圈一致 ----
+def _old_growth_filter(row, min_growth_26=15, min_filled_growth=0):
+    """原本 daily_job 迴圈中的條件 1、條件 2（門檻改為參數）。"""
+    try:
+        if float(row["EPS26成長率(%)"]) <= min_growth_26:
+            return False
+    except (TypeError, ValueError):
+        return False
+    values = []
+    valid_count = 0
+    for col in ["EPS25成長率(%)", "EPS26成長率(%)", "EPS27成長率(%)"]:
+        if pd.isna(row[col]) or row[col] == "":
+            continue
+        try:
+            val = float(row[col])
+        except ValueError:
+            continue
+        if val > min_filled_growth:
+            valid_count += 1
+        values.append(val)
+    return not (valid_count == 0 or valid_count < len(values))
+
+
+def test_growth_filter_mask_matches_old_row_loop():
+    rng = np.random.default_rng(9)
+    choices = [np.nan, "", "N/A", "20", -3.0, 0.0, 0.5, 15.0, 15.01, 16, 40.0, "-1"]
+    df = pd.DataFrame({col: rng.choice(np.array(choices, dtype=object), 2000)
+                       for col in report_sheet.GROWTH_COLUMNS})
+    # 原本的迴圈裡 EPS26 為 NaN 時 NaN <= 15 為 False 而被放行；向量化版本一律視為不符合條件 1
+    has_26 = pd.to_numeric(df["EPS26成長率(%)"], errors="coerce").notna()
+
+    for thresholds in [(15, 0), (10, 1), (0, -5)]:
+        mask = report_sheet.growth_filter_mask(df, *thresholds)
+        expected = df.apply(lambda row: _old_growth_filter(row, *thresholds), axis=1)
+        assert mask.dtype == bool
+        assert mask[has_26].tolist() == expected[has_26].tolist()
+        assert not mask[~has_26].any()
+    assert report_sheet.growth_filter_mask(df).sum() > 0
@@ -0,0 +1,30 @@
+# test_scan_checkpoint.py
+from scan_checkpoint import ScanCheckpoint
+
+
+def test_interrupted_scan_carries_results_and_stream_progress(tmp_path):
+    checkpoint = ScanCheckpoint(str(tmp_path / "scans.sqlite"))
+    checkpoint.start("s1", "v1", [{"代號": "2330"}], ["2330", "2317"])
+    checkpoint.save_results("s1", {"2330": ("ma", "多頭排列", {"MA買點分數": 9})})
+    checkpoint.save_stream("s1", "group-a", {1: 101}, [("2330", 0)])
+    checkpoint.save_stream("s1", "group-a", {1: 101}, [("2330", 0), ("2317", 1)])
+
+    pending = checkpoint.interrupted()
+    assert pending["scan_id"] == "s1"
+    assert set(pending["results"]) == {"2330"}
+    assert pending["streams"] == {"group-a": {"status_ids": {1: 101}, "sent": [("2330", 0), ("2317", 1)]}}
+
+    checkpoint.finish("s1")
+    assert checkpoint.interrupted() is None
+    checkpoint.close()
+
+
+def test_prune_drops_stream_progress_of_old_scans(tmp_path):
+    checkpoint = ScanCheckpoint(str(tmp_path / "scans.sqlite"))
+    for scan_id in ("s1", "s2", "s3"):
+        checkpoint.start(scan_id, "v1", [], [])
+        checkpoint.save_stream(scan_id, "group-a", {}, [])
+    checkpoint.prune(keep=1)
+    assert checkpoint.load_streams("s1") == {}
+    assert checkpoint.load_streams("s3") != {}
+    checkpoint.close()
@@ -0,0 +1,40 @@
+# test_subscribers.py
+from subscribers import SubscriberStore, apply_command, normalize_watch_code
+
+
+def _store(tmp_path, **kwargs):
+    return SubscriberStore(str(tmp_path / "subscribers.sqlite"), default_ids=[1], allowed_ids=[2], **kwargs)
+
+
+def test_only_allowed_chats_can_subscribe(tmp_path):
+    store = _store(tmp_path, open_subscription=False)
+    assert "不開放" in apply_command(store, 99, "subscribe", [])
+    assert apply_command(store, 2, "subscribe", []).startswith("✅")
+    assert store.chat_ids() == [1, 2]
+
+    # 從允許名單移除後，先前的訂閱不再收到通知
+    store.allowed_ids.clear()
+    assert store.chat_ids() == [1]
+    store.close()
+
+
+def test_open_subscription_accepts_any_chat(tmp_path):
+    store = _store(tmp_path, open_subscription=True)
+    assert apply_command(store, 99, "subscribe", []).startswith("✅")
+    assert 99 in store.chat_ids()
+    store.close()
+
+
+def test_watchlist_codes_match_sheet_codes(tmp_path):
+    store = _store(tmp_path)
+    apply_command(store, 1, "watch", ["50", "2330.TW", "6488.two", "0050"])
+    assert store.get(1).watchlist == ["0050", "2330", "6488"]
+    apply_command(store, 1, "unwatch", ["2330.TW", "50"])
+    assert store.get(1).watchlist == ["6488"]
+    store.close()
+
+
+def test_normalize_watch_code():
+    assert normalize_watch_code(" 2330 ") == "2330"
+    assert normalize_watch_code("0056.TWO") == "0056"
+    assert normalize_watch_code("56") == "0056"
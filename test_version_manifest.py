@@ -0,0 +1,39 @@
+# test_version_manifest.py
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+import report_sheet
+import score_snapshot
+from version_manifest import find_version, read_manifest, register_version
+
+
+def test_register_version_keeps_latest_and_removes_old_files(tmp_path):
+    directory = str(tmp_path)
+    for i in range(4):
+        open(os.path.join(directory, f"{i}.feather"), "w").close()
+        register_version(directory, {"version": str(i), "file": f"{i}.feather"}, limit=2)
+    assert [e["version"] for e in read_manifest(directory)] == ["2", "3"]
+    assert sorted(f for f in os.listdir(directory) if f.endswith(".feather")) == ["2.feather", "3.feather"]
+    assert find_version(directory)["version"] == "3"
+    assert find_version(directory, "2")["file"] == "2.feather"
+    assert find_version(directory, "0") is None
+
+
+def test_sheets_and_snapshots_share_the_manifest_format(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_sheet, "SHEET_HISTORY_LIMIT", 1)
+    sheets = str(tmp_path / "sheets")
+    report_sheet.save_sheet(pd.DataFrame({"股票代號": ["2330"], "公司名稱": ["台積電"]}), directory=sheets)
+    version = report_sheet.save_sheet(pd.DataFrame({"股票代號": ["2317"], "公司名稱": ["鴻海"]}), directory=sheets)
+    assert [e["version"] for e in report_sheet.list_sheet_versions(sheets)] == [version]
+    loaded_version, frame = report_sheet.load_sheet(directory=sheets)
+    assert loaded_version == version and frame["股票代號"].tolist() == ["2317"]
+
+    snapshots = str(tmp_path / "snapshots")
+    frame = pd.DataFrame({"現價": [100.0, np.nan]}, index=pd.Index(["2330", "2317"], name="股票代號"))
+    saved = score_snapshot.save_snapshot(frame, datetime.date(2026, 1, 2), sheet_version=version, directory=snapshots)
+    loaded = score_snapshot.load_snapshot(directory=snapshots)
+    assert loaded.version == saved.version and loaded.sheet_version == version
+    pd.testing.assert_frame_equal(loaded.frame, frame)
@@ -0,0 +1,232 @@
+"""
+全市場掃描：把上市櫃全部代號切成固定大小的分片，交給多個行程平行查價與計分
+（同 analyze_stocks_batch 的向量化算法），結果直接寫進共用的 memory-mapped 陣列。
+
+每個分片寫入自己在陣列中的固定列，不經過 pickle 傳回 DataFrame；
+合併時依輸入順序讀出，與行程數、分片完成的先後無關，結果完全相同。
+
+    python universe_scan.py                              # SYMBOL_LISTING_PATH 或價格庫中的全部代號
+    python universe_scan.py --workers 8 --top 50 --csv universe.csv
+    python universe_scan.py --synthetic 1800 --latency 0.5 --workers 4   # 以假資料量測擴展性
+"""
+import os
+import re
+import time
+import tempfile
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from fetch_guard import fetch_guard, rate_limiter
+from get_stock_position import get_bars_batch, get_price_store, score_bars, set_price_store
+from indicators import CORE_INDICATORS, active_indicators
+from ma_engine import MA_PERIODS, SIGNAL_LABELS, trend_labels
+from price_store import PriceStore
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """容器的 CPU 配額（可用幾顆 CPU），沒有限制或讀不到時回傳 None。支援 cgroup v2 與 v1。"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> int:
+    """這個行程可用的 CPU 數：優先看 cgroup 的 CPU 配額，其次是 CPU affinity，最後才是主機核心數。"""
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        return max(1, int(quota))
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+# 平行查價計分的行程數。每個子行程都會重新載入 pandas / numpy（約上百 MB），
+# 預設最多 2 個，且不超過這個行程實際可用的 CPU 數（容器限制而不是主機的核心數）
+UNIVERSE_WORKERS = int(os.getenv("UNIVERSE_WORKERS", "0")) or min(2, available_cpus())
+# 每個分片的代號數；分片比行程多，先做完的行程會接著領下一片
+UNIVERSE_SHARD_SIZE = int(os.getenv("UNIVERSE_SHARD_SIZE", "200"))
+# 子行程的啟動方式；機器人本身有多個執行緒，預設用 spawn 避免 fork 到上鎖中的狀態
+UNIVERSE_MP_START = os.getenv("UNIVERSE_MP_START", "spawn")
+# 只掃描符合這個格式的代號（預設為 4 碼的普通股與 ETF，排除權證等）
+UNIVERSE_CODE_PATTERN = os.getenv("UNIVERSE_CODE_PATTERN", r"^\d{4}$")
+
+LABEL_COLUMNS = ["趨勢", "買點判斷"]
+
+
+def load_universe(path: Optional[str] = None) -> pd.DataFrame:
+    """
+    全市場代號清單，回傳欄位為 代號、名稱 的 DataFrame（依代號排序）。
+    優先讀上市櫃清單 CSV（格式同 price_store.load_symbol_listing，有「名稱」欄時一併帶出），
+    沒有清單時改用價格庫中已解析出市場的代號。
+    """
+    path = path or os.getenv("SYMBOL_LISTING_PATH")
+    if path and os.path.exists(path):
+        listing = pd.read_csv(path, dtype=str)
+        universe = pd.DataFrame({
+            "代號": listing["代號"].str.strip(),
+            "名稱": listing["名稱"].fillna("").str.strip() if "名稱" in listing.columns else "",
+        })
+    else:
+        universe = pd.DataFrame({"代號": get_price_store().resolved_codes(), "名稱": ""})
+    pattern = re.compile(UNIVERSE_CODE_PATTERN)
+    universe = universe[universe["代號"].map(lambda code: bool(pattern.match(str(code))))]
+    return universe.drop_duplicates("代號").sort_values("代號").reset_index(drop=True)
+
+
+def numeric_columns() -> List[str]:
+    """寫入共用陣列的數值欄位（現價、MA、額外指標、分數與偏離度），順序固定。"""
+    extras = [name for name in active_indicators() if name not in CORE_INDICATORS]
+    return ["現價"] + [f"MA{n}" for n in MA_PERIODS] + extras + ["MA買點分數", "D240", "D60", "D20"]
+
+
+# ================== 子行程 ==================
+def _init_worker(db_path: str, rate_share: float) -> None:
+    # 每個行程各自開一條價格庫連線（SQLite 連線不能跨行程共用）
+    set_price_store(PriceStore(db_path))
+    # fetch_guard 的限速器只在行程內共用：各行程平分查價額度，合計不超過 FETCH_RATE
+    fetch_guard.limiter = rate_limiter(rate_share)
+
+
+def _score_shard(values_path: str, labels_path: str, start: int, codes: List[str], columns: List[str],
+                 batch_size: int, batch_pause: float, consolidation_threshold: float) -> int:
+    """查價並計分一個分片，寫進共用陣列的 [start, start + len(codes)) 列，回傳有現價的檔數。"""
+    bars = get_bars_batch(codes, batch_size=batch_size, batch_pause=batch_pause)
+    frame = score_bars(bars, consolidation_threshold=consolidation_threshold).reindex(codes)
+
+    stop = start + len(codes)
+    values = np.load(values_path, mmap_mode="r+")
+    values[start:stop] = frame[columns].to_numpy(dtype=float)
+    values.flush()
+    labels = np.load(labels_path, mmap_mode="r+")
+    labels[start:stop, 0] = pd.Categorical(frame["趨勢"], categories=trend_labels(consolidation_threshold)).codes
+    labels[start:stop, 1] = pd.Categorical(frame["買點判斷"], categories=SIGNAL_LABELS).codes
+    labels.flush()
+    return int(frame["現價"].notna().sum())
+
+
+# ================== 主行程 ==================
+def score_universe(codes: Sequence[str], workers: int = UNIVERSE_WORKERS, shard_size: int = UNIVERSE_SHARD_SIZE,
+                   batch_size: int = 50, batch_pause: float = 0.0, consolidation_threshold: float = 0.02,
+                   start_method: str = UNIVERSE_MP_START,
+                   on_progress: Optional[Callable[[int], None]] = None) -> pd.DataFrame:
+    """
+    以 workers 個行程平行查價與計分 codes，回傳以股票代號為索引（依輸入順序）的 DataFrame，
+    欄位同 ma_engine.score_close_matrix。分片失敗時該片的股票視為查不到資料。
+    查價速率（FETCH_RATE 等）由各行程平分，增加行程數只會讓計分平行，不會對價格來源送出更多請求。
+    on_progress(檔數) 會在每個分片完成時於主行程呼叫。
+    """
+    codes = list(dict.fromkeys(str(c).strip() for c in codes))
+    columns = numeric_columns()
+    shards = [(start, codes[start:start + shard_size]) for start in range(0, len(codes), shard_size)]
+    trends = trend_labels(consolidation_threshold)
+
+    with tempfile.TemporaryDirectory(prefix="universe-") as directory:
+        values_path = os.path.join(directory, "values.npy")
+        labels_path = os.path.join(directory, "labels.npy")
+        values = np.lib.format.open_memmap(values_path, mode="w+", dtype=np.float64,
+                                           shape=(len(codes), len(columns)))
+        values[:] = np.nan
+        values.flush()
+        labels = np.lib.format.open_memmap(labels_path, mode="w+", dtype=np.int8, shape=(len(codes), 2))
+        labels[:] = -1
+        labels.flush()
+        del values, labels
+
+        if shards:
+            context = multiprocessing.get_context(start_method)
+            processes = max(1, min(workers, len(shards)))
+            with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                                     initargs=(get_price_store().path, 1 / processes)) as pool:
+                futures = {
+                    pool.submit(_score_shard, values_path, labels_path, start, shard, columns,
+                                batch_size, batch_pause, consolidation_threshold): (start, shard)
+                    for start, shard in shards
+                }
+                for future in as_completed(futures):
+                    start, shard = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"⚠️ 全市場分片 {shard[0]}–{shard[-1]} 計算失敗: {e}")
+                    if on_progress is not None:
+                        on_progress(len(shard))
+
+        # 依列位置讀回，順序只由輸入決定
+        values = np.array(np.load(values_path, mmap_mode="r"))
+        labels = np.array(np.load(labels_path, mmap_mode="r"))
+
+    frame = pd.DataFrame(values, index=pd.Index(codes, name="股票代號"), columns=columns)
+    frame["MA買點分數"] = frame["MA買點分數"].fillna(0).astype(int)
+    # 索引 -1（沒有寫入的列）對應到最後補上的「資料缺失」狀態
+    frame["趨勢"] = np.asarray(trends + ["數據不完整"], dtype=object)[labels[:, 0]]
+    frame["買點判斷"] = np.asarray(SIGNAL_LABELS + ["數據缺失"], dtype=object)[labels[:, 1]]
+    order = ["現價"] + [c for c in columns if c not in ("現價", "MA買點分數", "D240", "D60", "D20")]
+    return frame[order + ["趨勢", "MA買點分數", "D240", "D60", "D20", "買點判斷"]]
+
+
+def top_candidates(frame: pd.DataFrame, min_score: int, top: int) -> pd.DataFrame:
+    """分數不低於 min_score 的股票，依分數由高到低（同分依代號）取前 top 檔。"""
+    picked = frame[frame["MA買點分數"] >= min_score]
+    return picked.sort_values("MA買點分數", ascending=False, kind="stable").head(top)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="全市場平行掃描")
+    parser.add_argument("--listing", help="上市櫃清單 CSV（代號, 市場[, 名稱]），預設為 SYMBOL_LISTING_PATH")
+    parser.add_argument("--workers", type=int, default=UNIVERSE_WORKERS, help="行程數")
+    parser.add_argument("--shard-size", type=int, default=UNIVERSE_SHARD_SIZE, help="每個分片的代號數")
+    parser.add_argument("--batch-size", type=int, default=50, help="每次查價請求的檔數")
+    parser.add_argument("--min-score", type=int, default=8, help="列出的最低分數")
+    parser.add_argument("--top", type=int, default=30, help="最多列出幾檔")
+    parser.add_argument("--csv", help="把全部結果存成 CSV")
+    parser.add_argument("--synthetic", type=int, default=0, help="改用幾檔假資料（不連網）")
+    parser.add_argument("--bars", type=int, default=600, help="假資料每檔的 K 棒數")
+    parser.add_argument("--latency", type=float, default=0.0, help="假資料每次請求的延遲秒數")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start_method = UNIVERSE_MP_START
+    if args.synthetic:
+        # 假資料來源只存在這個行程裡，改用 fork 讓子行程繼承
+        from benchmark import SyntheticMarket
+        from get_stock_position import set_price_provider
+        set_price_provider(SyntheticMarket(bars=args.bars, latency=args.latency))
+        set_price_store(PriceStore(os.path.join(tempfile.mkdtemp(), "prices.sqlite")))
+        universe = pd.DataFrame({"代號": [str(1000 + i) for i in range(args.synthetic)], "名稱": ""})
+        start_method = "fork"
+    else:
+        universe = load_universe(args.listing)
+    print(f"全市場共 {len(universe)} 檔，以 {args.workers} 個行程掃描")
+
+    started = time.perf_counter()
+    frame = score_universe(universe["代號"], workers=args.workers, shard_size=args.shard_size,
+                           batch_size=args.batch_size, start_method=start_method)
+    elapsed = time.perf_counter() - started
+    print(f"計算完成，耗時 {elapsed:.1f} 秒（{len(frame) / max(elapsed, 1e-9):.0f} 檔/秒），"
+          f"有資料 {int(frame['現價'].notna().sum())} 檔\n")
+
+    names = dict(zip(universe["代號"], universe["名稱"]))
+    picked = top_candidates(frame, args.min_score, args.top)
+    picked.insert(0, "名稱", [names.get(code, "") for code in picked.index])
+    with pd.option_context("display.max_rows", None, "display.width", 160):
+        print(picked[["名稱", "現價", "趨勢", "MA買點分數", "D240", "D60", "D20", "買點判斷"]])
+    if args.csv:
+        frame.to_csv(args.csv, encoding="utf-8-sig")
@@ -0,0 +1,51 @@
+import os
+import json
+import pandas as pd
+from typing import Any, Dict, List, Optional, Tuple
+
+MANIFEST = "manifest.json"
+
+
+def new_version() -> Tuple[pd.Timestamp, str]:
+    """新版本的 (保存時間, 版本代號)；版本代號依時間排序。"""
+    saved_at = pd.Timestamp.now(tz="Asia/Taipei")
+    return saved_at, saved_at.strftime("%Y%m%d-%H%M%S-%f")
+
+
+def read_manifest(directory: str) -> List[Dict[str, Any]]:
+    """讀出 directory 的版本清單（由舊到新），沒有清單時為空列表。"""
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(directory: str, entries: List[Dict[str, Any]]) -> None:
+    """先寫暫存檔再換名，寫到一半中斷也不會留下壞掉的清單。"""
+    path = os.path.join(directory, MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def register_version(directory: str, entry: Dict[str, Any], limit: int) -> None:
+    """把新版本（需含 version 與 file）加到清單最後，只保留最近 limit 個版本並刪除較舊的檔案。"""
+    entries = read_manifest(directory)
+    entries.append(entry)
+    expired, entries = entries[:-limit], entries[-limit:]
+    write_manifest(directory, entries)
+    for old in expired:
+        try:
+            os.remove(os.path.join(directory, old["file"]))
+        except OSError:
+            pass
+
+
+def find_version(directory: str, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """指定版本（預設最新一版）的清單項目，找不到時回傳 None。"""
+    entries = read_manifest(directory)
+    if version is not None:
+        entries = [e for e in entries if e["version"] == version]
+    return entries[-1] if entries else None